@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark cho các hot path của environment, replay và tạo playlist.
+
+Chạy trên catalog tổng hợp từ src/synthetic_catalog.py (1k, 10k, 100k bài hát),
+báo cáo ops/s và bộ nhớ cấp phát đỉnh (tracemalloc), lưu baseline và so sánh
+với baseline cũ.
+
+Ví dụ:
+    python benchmarks/bench_hot_paths.py --sizes 1000 10000
+    python benchmarks/bench_hot_paths.py --save benchmarks/baselines/main.json
+    python benchmarks/bench_hot_paths.py --compare benchmarks/baselines/main.json
+    python benchmarks/bench_hot_paths.py --only env. --sizes 100000
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'web'))
+
+import numpy as np
+
+from config import Config
+from synthetic_catalog import generate_catalog, generate_embeddings, write_catalog, write_embeddings
+
+@contextlib.contextmanager
+def quiet():
+    """Tắt stdout của code được benchmark (print trong hot path)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def measure(fn, min_time, max_iters):
+    """Chạy fn lặp lại tới khi đủ min_time, trả về (ops/s, số lần chạy)"""
+    fn()  # warm-up
+    iterations = 0
+    elapsed = 0.0
+    while elapsed < min_time and iterations < max_iters:
+        start = time.perf_counter()
+        fn()
+        elapsed += time.perf_counter() - start
+        iterations += 1
+    return iterations / elapsed if elapsed else float('inf'), iterations
+
+def measure_memory(fn):
+    """Bộ nhớ Python cấp phát đỉnh (bytes) trong 1 lần gọi fn"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+class Fixture:
+    """Dữ liệu dùng chung cho các benchmark với 1 kích thước catalog"""
+
+    def __init__(self, n_songs, workdir):
+        from models import PlaylistEnvironment
+        from playlist_generator import PlaylistGenerator
+
+        self.n_songs = n_songs
+        self.workdir = workdir
+        self.songs = generate_catalog(n_songs, seed=0)
+        matrix = generate_embeddings(self.songs, seed=0)
+        self.embeddings = {song['id']: matrix[i].tolist() for i, song in enumerate(self.songs)}
+
+        self.data_file = os.path.join(workdir, f"songs_{n_songs}.json")
+        self.embedding_file = os.path.join(workdir, f"embeddings_{n_songs}.txt")
+        write_catalog(self.songs, self.data_file)
+        write_embeddings(self.songs, matrix, self.embedding_file)
+
+        with quiet():
+            self.environment = PlaylistEnvironment(self.songs, self.embeddings)
+
+        self.generator = PlaylistGenerator()
+        self.generator.songs_data = self.songs
+        self.generator.embeddings = self.embeddings
+        self.generator.environment = self.environment
+        self._dqn = None
+
+    @property
+    def dqn(self):
+        """DQN model khởi tạo lười (tốn thời gian build TensorFlow graph)"""
+        if self._dqn is None:
+            from models import DQNModel
+            self._dqn = DQNModel(Config.EMBEDDING_DIM, self.n_songs)
+            self._dqn.epsilon = 0.0
+            self.generator.dqn_model = self._dqn
+        return self._dqn
+
+def bench_env_reset(fx):
+    env = fx.environment
+    def run():
+        env.reset()
+    return run
+
+def bench_env_step(fx):
+    env = fx.environment
+    def run():
+        if len(env.current_playlist) >= Config.MAX_PLAYLIST_LENGTH - 1:
+            env.reset()
+        env.step(random.choice(env.available_songs))
+    return run
+
+def bench_env_get_state(fx):
+    env = fx.environment
+    with quiet():
+        env.reset()
+        for _ in range(19):
+            env.step(random.choice(env.available_songs))
+    return env._get_state
+
+def bench_env_calculate_reward(fx):
+    env = fx.environment
+    with quiet():
+        env.reset()
+        for _ in range(9):
+            env.step(random.choice(env.available_songs))
+    candidate = env.available_songs[0]
+    def run():
+        env._calculate_reward(candidate)
+    return run
+
+def bench_dqn_act(fx):
+    dqn = fx.dqn
+    env = fx.environment
+    with quiet():
+        state = env.reset()
+    def run():
+        dqn.act(state, env.available_songs)
+    return run
+
+def bench_dqn_replay(fx):
+    dqn = fx.dqn
+    rng = np.random.default_rng(0)
+    dqn.memory = [
+        (rng.normal(size=Config.EMBEDDING_DIM), int(rng.integers(fx.n_songs)), float(rng.random()),
+         rng.normal(size=Config.EMBEDDING_DIM), bool(rng.random() < 0.05))
+        for _ in range(1000)
+    ]
+    def run():
+        dqn.replay(Config.BATCH_SIZE)
+    return run
+
+def bench_apply_constraints(fx):
+    generator = fx.generator
+    env = fx.environment
+    constraints = {'genre': ['Pop', 'K-pop'], 'min_popularity': 40, 'min_year': 2000}
+    def run():
+        env.available_songs = list(range(fx.n_songs))
+        generator._apply_constraints(constraints)
+    return run
+
+def bench_generate_playlist(fx):
+    generator = fx.generator
+    fx.dqn  # đảm bảo đã có model
+    constraints = {'genre': ['Pop'], 'min_popularity': 30}
+    def run():
+        generator.generate_playlist(length=20, constraints=constraints)
+    return run
+
+def bench_evaluate_playlist(fx):
+    generator = fx.generator
+    playlist = random.Random(0).sample(fx.songs, 20)
+    def run():
+        generator.evaluate_playlist(playlist)
+    return run
+
+def bench_evaluate_playlists(fx):
+    generator = fx.generator
+    rng = random.Random(0)
+    playlists = [rng.sample(range(len(generator.songs_data)), 20) for _ in range(100)]
+    def run():
+        generator.evaluate_playlists(playlists)
+    return run
+
+def bench_load_embeddings(fx):
+    generator = fx.generator
+    def run():
+        Config.EMBEDDING_FILE = fx.embedding_file
+        generator.load_embeddings()
+    return run
+
+def bench_load_data(fx):
+    from playlist_generator import PlaylistGenerator
+    def run():
+        Config.PLAYLIST_DATA_FILE = fx.data_file
+        Config.EMBEDDING_FILE = fx.embedding_file
+        PlaylistGenerator().load_data()
+    return run
+
+# (tên, hàm tạo benchmark, số lần chạy tối đa)
+BENCHMARKS = [
+    ('env.reset', bench_env_reset, 10000),
+    ('env.step', bench_env_step, 10000),
+    ('env._get_state', bench_env_get_state, 10000),
+    ('env._calculate_reward', bench_env_calculate_reward, 10000),
+    ('dqn.act', bench_dqn_act, 500),
+    ('dqn.replay', bench_dqn_replay, 100),
+    ('generator._apply_constraints', bench_apply_constraints, 1000),
+    ('generator.generate_playlist', bench_generate_playlist, 50),
+    ('generator.evaluate_playlist', bench_evaluate_playlist, 10000),
+    ('generator.evaluate_playlists[100]', bench_evaluate_playlists, 1000),
+    ('generator.load_embeddings', bench_load_embeddings, 20),
+    ('generator.load_data', bench_load_data, 20),
+]
+
+def run_benchmarks(sizes, only, min_time):
+    """Chạy toàn bộ benchmark, trả về {'size/name': {ops_per_s, iterations, peak_bytes}}"""
+    results = {}
+    original_paths = (Config.PLAYLIST_DATA_FILE, Config.EMBEDDING_FILE)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)  # replay() ghi loss_log.txt vào thư mục hiện tại
+        try:
+            for size in sizes:
+                selected = [b for b in BENCHMARKS if not only or any(pattern in b[0] for pattern in only)]
+                if not selected:
+                    continue
+                print(f"\n=== Catalog {size:,} bài hát ===")
+                random.seed(0)
+                np.random.seed(0)
+                fx = Fixture(size, workdir)
+
+                for name, factory, max_iters in selected:
+                    with quiet():
+                        fn = factory(fx)
+                        ops, iterations = measure(fn, min_time, max_iters)
+                        peak = measure_memory(fn)
+                    key = f"{size}/{name}"
+                    results[key] = {'ops_per_s': ops, 'iterations': iterations, 'peak_bytes': peak}
+                    print(f"  {name:32s} {ops:14,.1f} ops/s  {peak / 1024:12,.1f} KiB peak  ({iterations} lần)")
+        finally:
+            os.chdir(cwd)
+            Config.PLAYLIST_DATA_FILE, Config.EMBEDDING_FILE = original_paths
+
+    return results
+
+def compare(baseline, results, threshold):
+    """In so sánh với baseline, trả về số benchmark chậm hơn quá threshold"""
+    print(f"\n=== So sánh với baseline ({baseline.get('created_at', '?')}) ===")
+    slower = 0
+    for key, current in results.items():
+        old = baseline['results'].get(key)
+        if not old:
+            print(f"  {key:45s} (mới)")
+            continue
+        ratio = current['ops_per_s'] / old['ops_per_s'] if old['ops_per_s'] else float('inf')
+        memory_ratio = current['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else float('inf')
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = '  <-- CHẬM HƠN'
+            slower += 1
+        elif ratio > 1 + threshold:
+            flag = '  (nhanh hơn)'
+        print(f"  {key:45s} x{ratio:7.2f} tốc độ  x{memory_ratio:6.2f} bộ nhớ{flag}")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark các hot path")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--only', nargs='*', default=None, help="Chỉ chạy benchmark có tên chứa chuỗi này")
+    parser.add_argument('--min-time', type=float, default=0.5, help="Thời gian đo tối thiểu mỗi benchmark (giây)")
+    parser.add_argument('--save', default=None, help="Lưu kết quả làm baseline (JSON)")
+    parser.add_argument('--compare', default=None, help="So sánh với baseline JSON")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Ngưỡng báo chậm hơn (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.only, args.min_time)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2)
+        print(f"\nĐã lưu baseline vào {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Đánh giá offline các DQN model đã train (models/*.h5).
+
+Sinh nhiều playlist theo lưới (seed x độ dài x bộ constraints) song song trên
+nhiều process, đo throughput/latency và chất lượng, rồi ghi report dạng JSON.
+
+Ví dụ:
+    python evaluate_models.py --models ../models/*.h5 --playlists 50 \\
+        --lengths 10 20 --seeds 0 1 2 --workers 4 --output eval_report.json
+    python evaluate_models.py --baseline eval_report.json --output eval_new.json
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import multiprocessing
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+
+DEFAULT_CONSTRAINT_SETS = {
+    'none': {},
+    'pop_popular': {'genre': ['Pop'], 'min_popularity': 50},
+    'vietnamese_recent': {'genre': ['Vietnamese'], 'min_year': 2020},
+    'kpop_hits': {'genre': ['K-pop'], 'min_popularity': 60}
+}
+
+# Metrics được tính bằng batch API (tỉ lệ thuận: càng cao càng tốt)
+QUALITY_KEYS = ['score', 'improved_total_reward', 'diversity_total_reward',
+                'similarity', 'diversity', 'flow_score', 'genre_diversity', 'popularity']
+
+# State riêng của từng worker process
+_worker = {}
+
+def _init_worker(data_file, embedding_file, epsilon):
+    """Load dữ liệu 1 lần cho mỗi worker"""
+    from playlist_generator import PlaylistGenerator
+    from song_features import build_improved_feature_table, build_diverse_feature_table
+
+    if data_file:
+        Config.PLAYLIST_DATA_FILE = data_file
+    if embedding_file:
+        Config.EMBEDDING_FILE = embedding_file
+
+    generator = PlaylistGenerator()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not generator.load_data():
+            raise RuntimeError(f"Không load được dữ liệu từ {Config.PLAYLIST_DATA_FILE}")
+
+    _worker['generator'] = generator
+    _worker['epsilon'] = epsilon
+    _worker['models'] = {}
+    _worker['improved_table'] = build_improved_feature_table(generator.songs_data)
+    _worker['diverse_table'] = build_diverse_feature_table(generator.songs_data)
+
+def _get_model(model_path):
+    """Load DQN model (cache theo đường dẫn trong worker)"""
+    from models import DQNModel
+
+    models = _worker['models']
+    if model_path not in models:
+        generator = _worker['generator']
+        model = DQNModel(Config.EMBEDDING_DIM, len(generator.songs_data))
+        model.load(model_path)
+        model.epsilon = _worker['epsilon']
+        models[model_path] = model
+    return models[model_path]
+
+def _run_job(job):
+    """Sinh `count` playlist cho 1 ô của lưới và trả về số đo thô"""
+    from playlist_metrics import batch_improved_metrics, batch_diversity_focused_metrics
+
+    generator = _worker['generator']
+    result = {key: job[key] for key in ('model', 'seed', 'length', 'constraint_set')}
+
+    try:
+        generator.dqn_model = _get_model(job['model'])
+        if generator.environment is None:
+            from models import PlaylistEnvironment
+            with contextlib.redirect_stdout(io.StringIO()):
+                generator.environment = PlaylistEnvironment(generator.songs_data, generator.embeddings)
+    except Exception as e:
+        result['error'] = f"Không load được model: {e}"
+        return result
+
+    np.random.seed(job['seed'])
+    random.seed(job['seed'])
+
+    latencies = []
+    steps = 0
+    playlists = []
+    generated = []
+
+    for _ in range(job['count']):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            playlist = generator.generate_playlist(length=job['length'], constraints=job['constraints'])
+        latencies.append(time.perf_counter() - start)
+
+        # Mỗi lần tạo có environment riêng: lấy lại index từ các bài hát (view của catalog)
+        indices = [generator.songs_data.index_of(song) for song in playlist]
+        steps += max(len(indices) - 1, 0)
+        generated.append(indices)
+        if len(indices) >= 2:
+            playlists.append(indices)
+
+    # Chấm điểm cả lô 1 lần thay vì từng playlist
+    quality = {'score': generator.evaluate_playlists(generated).tolist()}
+    if playlists:
+        improved = batch_improved_metrics(playlists, _worker['improved_table'])
+        diverse = batch_diversity_focused_metrics(playlists, _worker['diverse_table'])
+        quality['improved_total_reward'] = improved['total_reward'].tolist()
+        quality['diversity_total_reward'] = diverse['total_reward'].tolist()
+        for key in ('similarity', 'diversity', 'flow_score', 'genre_diversity', 'popularity'):
+            quality[key] = improved[key].tolist()
+
+    result.update({
+        'latencies': latencies,
+        'steps': steps,
+        'playlist_lengths': [len(p) for p in playlists],
+        'quality': quality
+    })
+    return result
+
+def _summarize(results):
+    """Gộp kết quả thô của nhiều job thành throughput, latency percentiles và quality"""
+    latencies = np.array([x for r in results for x in r.get('latencies', [])])
+    if len(latencies) == 0:
+        return {'playlists': 0}
+
+    busy_time = float(latencies.sum())
+    steps = sum(r['steps'] for r in results)
+    quality = {}
+    for key in QUALITY_KEYS:
+        values = [x for r in results for x in r['quality'].get(key, [])]
+        if values:
+            quality[key] = {'mean': float(np.mean(values)), 'std': float(np.std(values))}
+
+    return {
+        'playlists': int(len(latencies)),
+        'steps': int(steps),
+        'throughput': {
+            'playlists_per_s': len(latencies) / busy_time if busy_time else 0.0,
+            'steps_per_s': steps / busy_time if busy_time else 0.0
+        },
+        'latency_ms': {
+            'mean': float(latencies.mean() * 1000),
+            'p50': float(np.percentile(latencies, 50) * 1000),
+            'p90': float(np.percentile(latencies, 90) * 1000),
+            'p99': float(np.percentile(latencies, 99) * 1000),
+            'max': float(latencies.max() * 1000)
+        },
+        'quality': quality
+    }
+
+def build_report(results, config, wall_time):
+    """Tạo report theo model và theo từng ô (độ dài, constraints) của lưới"""
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'config': config,
+        'wall_time_s': wall_time,
+        'models': {},
+        'errors': [r for r in results if 'error' in r]
+    }
+
+    ok_results = [r for r in results if 'error' not in r]
+    total_playlists = sum(len(r['latencies']) for r in ok_results)
+    report['wall_playlists_per_s'] = total_playlists / wall_time if wall_time else 0.0
+
+    for model in sorted({r['model'] for r in ok_results}):
+        model_results = [r for r in ok_results if r['model'] == model]
+        summary = _summarize(model_results)
+        summary['cells'] = {}
+        for length, constraint_set in sorted({(r['length'], r['constraint_set']) for r in model_results}):
+            cell = [r for r in model_results if r['length'] == length and r['constraint_set'] == constraint_set]
+            summary['cells'][f"len={length}/{constraint_set}"] = _summarize(cell)
+        report['models'][model] = summary
+
+    return report
+
+def compare_reports(baseline, current, tolerance):
+    """So sánh với report cũ, trả về danh sách regression (tốc độ hoặc chất lượng giảm quá tolerance)"""
+    regressions = []
+    for model, summary in current['models'].items():
+        old = baseline.get('models', {}).get(model)
+        if not old or 'throughput' not in old or 'throughput' not in summary:
+            continue
+
+        checks = [
+            ('throughput.playlists_per_s', old['throughput']['playlists_per_s'],
+             summary['throughput']['playlists_per_s'], True),
+            ('latency_ms.p90', old['latency_ms']['p90'], summary['latency_ms']['p90'], False)
+        ]
+        for key, values in summary['quality'].items():
+            if key in old['quality']:
+                checks.append((f"quality.{key}", old['quality'][key]['mean'], values['mean'], True))
+
+        for name, before, after, higher_is_better in checks:
+            if before == 0:
+                continue
+            change = (after - before) / abs(before)
+            worse = -change if higher_is_better else change
+            print(f"  {os.path.basename(model):35s} {name:35s} {before:12.4f} -> {after:12.4f} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append({'model': model, 'metric': name, 'before': before, 'after': after, 'change': change})
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá offline các DQN model")
+    parser.add_argument('--models', nargs='+', default=sorted(glob.glob(os.path.join('models', '*.h5'))),
+                        help="Các file model .h5 (mặc định: models/*.h5)")
+    parser.add_argument('--data', default=None, help="File dữ liệu bài hát (mặc định: Config.PLAYLIST_DATA_FILE)")
+    parser.add_argument('--embeddings', default=None, help="File embeddings (mặc định: Config.EMBEDDING_FILE)")
+    parser.add_argument('--playlists', type=int, default=20, help="Số playlist cho mỗi ô của lưới")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 20])
+    parser.add_argument('--constraints-file', default=None,
+                        help="File JSON {tên: constraints}; mặc định dùng các bộ constraints có sẵn")
+    parser.add_argument('--epsilon', type=float, default=0.0, help="Epsilon khi sinh playlist (0 = greedy)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--output', default='eval_report.json')
+    parser.add_argument('--baseline', default=None, help="Report cũ để so sánh regression")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Ngưỡng regression (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    if not args.models:
+        print("Không tìm thấy model nào (models/*.h5)")
+        return 1
+
+    if args.constraints_file:
+        with open(args.constraints_file, 'r', encoding='utf-8') as f:
+            constraint_sets = json.load(f)
+    else:
+        constraint_sets = DEFAULT_CONSTRAINT_SETS
+
+    jobs = [
+        {'model': model, 'seed': seed, 'length': length, 'constraint_set': name,
+         'constraints': constraint_sets[name], 'count': args.playlists}
+        for model, seed, length, name in itertools.product(args.models, args.seeds, args.lengths, constraint_sets)
+    ]
+    print(f"Đánh giá {len(args.models)} model, {len(jobs)} job, {len(jobs) * args.playlists} playlist "
+          f"với {args.workers} worker...")
+
+    # spawn để mỗi worker có TensorFlow runtime riêng
+    context = multiprocessing.get_context('spawn')
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=_init_worker,
+                             initargs=(args.data, args.embeddings, args.epsilon)) as executor:
+        futures = [executor.submit(_run_job, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            status = result.get('error', f"{len(result['latencies'])} playlist")
+            print(f"  [{done}/{len(jobs)}] {os.path.basename(result['model'])} seed={result['seed']} "
+                  f"len={result['length']} {result['constraint_set']}: {status}")
+    wall_time = time.perf_counter() - start
+
+    config = {key: value for key, value in vars(args).items() if key not in ('baseline', 'output')}
+    config['constraint_sets'] = constraint_sets
+    report = build_report(results, config, wall_time)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Đã ghi report vào {args.output} ({report['wall_playlists_per_s']:.1f} playlist/s tổng)")
+
+    for model, summary in report['models'].items():
+        if 'throughput' in summary:
+            print(f"  {os.path.basename(model)}: {summary['throughput']['playlists_per_s']:.2f} playlist/s, "
+                  f"{summary['throughput']['steps_per_s']:.1f} step/s, p90 {summary['latency_ms']['p90']:.1f} ms, "
+                  f"score {summary['quality']['score']['mean']:.2f}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"So sánh với {args.baseline}:")
+        regressions = compare_reports(baseline, report, args.tolerance)
+        if regressions:
+            print(f"Phát hiện {len(regressions)} regression vượt {args.tolerance:.0%}")
+            return 1
+        print("Không có regression")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Metrics cho nhiều playlist cùng lúc, tính bằng phép toán mảng trên SongFeatureTable.
+Playlist được truyền dưới dạng mảng index (m, L); danh sách playlist có độ dài khác
+nhau sẽ được gom theo độ dài và tính theo từng nhóm.
+"""
+
+import numpy as np
+
+BATCH_ONLY_METRICS = ('genre_diversity',)  # Dùng khi so sánh model (evaluate_models), không có trong metrics lúc training
+
+def _unique_count(values):
+    """Số giá trị khác nhau trên mỗi hàng của mảng 2D"""
+    ordered = np.sort(values, axis=1)
+    return 1 + np.count_nonzero(np.diff(ordered, axis=1), axis=1)
+
+def _grouped(playlists, compute, feature_table):
+    """Gom playlist theo độ dài, tính metrics từng nhóm rồi ghép lại theo thứ tự ban đầu"""
+    if isinstance(playlists, np.ndarray) and playlists.ndim == 2:
+        if playlists.shape[1] < 2:
+            raise ValueError("Mỗi playlist cần ít nhất 2 bài hát để tính metrics")
+        return compute(playlists.astype(np.intp, copy=False), feature_table)
+
+    groups = {}
+    for position, playlist in enumerate(playlists):
+        groups.setdefault(len(playlist), []).append(position)
+
+    results = {}
+    for length, positions in groups.items():
+        if length < 2:
+            raise ValueError("Mỗi playlist cần ít nhất 2 bài hát để tính metrics")
+        batch = np.asarray([playlists[i] for i in positions], dtype=np.intp)
+        for key, values in compute(batch, feature_table).items():
+            if key not in results:
+                results[key] = np.zeros(len(playlists), dtype=values.dtype)
+            results[key][positions] = values
+    return results
+
+def _improved(playlists, table):
+    columns = table.columns
+    features = table.features[playlists]          # (m, L, 22)
+    popularities = columns['popularity'][playlists]
+    energies = columns['energy'][playlists]
+    danceabilities = columns['danceability'][playlists]
+    valences = columns['valence'][playlists]
+    tempos = columns['tempo'][playlists]
+    length = playlists.shape[1]
+
+    # 1. Similarity giữa các bài liên tiếp, penalty khi > 0.9
+    avg_similarity = table.similarity.consecutive(playlists).mean(axis=1)
+    adjusted_similarity = avg_similarity - np.maximum(0, (avg_similarity - 0.9) * 2)
+
+    # 2. Diversity
+    tempo_variance = tempos.var(axis=1) / 1000
+    diversity = (
+        features.var(axis=1).mean(axis=1) * 5 +
+        tempo_variance * 3 +
+        energies.var(axis=1) * 2 +
+        valences.var(axis=1) * 2
+    )
+    diversity = np.minimum(diversity, 5.0)
+
+    # 3. Popularity (thưởng cho mức trung bình 50-70)
+    avg_popularity = popularities.mean(axis=1)
+    popularity_bonus = np.where(
+        (avg_popularity >= 50) & (avg_popularity <= 70), 1.2,
+        np.where((avg_popularity >= 40) & (avg_popularity <= 80), 1.0, 0.8)
+    )
+    popularity_score = (avg_popularity / 100 * 3) * popularity_bonus
+
+    # 4. Flow
+    energy_flow = 1.0 - np.abs(np.diff(energies, axis=1)).mean(axis=1)
+    tempo_flow = 1.0 - np.abs(np.diff(tempos, axis=1)).mean(axis=1) / 50
+    flow_score = (energy_flow + tempo_flow) / 2
+
+    # 5. Reward
+    balance_bonus = np.where(
+        (avg_similarity >= 0.7) & (avg_similarity <= 0.85) & (diversity >= 1.0), 1.0, 0.0
+    )
+    total_reward = (
+        adjusted_similarity * 0.25 * 10 +
+        diversity * 0.35 +
+        popularity_score * 0.25 +
+        flow_score * 0.15 * 5 +
+        balance_bonus
+    )
+
+    return {
+        'similarity': avg_similarity,
+        'adjusted_similarity': adjusted_similarity,
+        'diversity': diversity,
+        'popularity': avg_popularity,
+        'avg_energy': energies.mean(axis=1),
+        'avg_danceability': danceabilities.mean(axis=1),
+        'avg_valence': valences.mean(axis=1),
+        'tempo_variance': tempo_variance,
+        'flow_score': flow_score,
+        'genre_diversity': _unique_count(table.genre_codes[playlists]) / length,
+        'balance_bonus': balance_bonus,
+        'total_reward': total_reward,
+        'num_songs': np.full(len(playlists), length)
+    }
+
+def _diversity_focused(playlists, table):
+    columns = table.columns
+    features = table.features[playlists]
+    popularities = columns['popularity'][playlists]
+    energies = columns['energy'][playlists]
+    tempos = columns['tempo'][playlists]
+    keys = columns['key'][playlists]
+    valences = columns['valence'][playlists]
+    danceabilities = columns['danceability'][playlists]
+    length = playlists.shape[1]
+
+    # 1. Similarity với penalty mạnh khi > 0.8
+    avg_similarity = table.similarity.consecutive(playlists).mean(axis=1)
+    similarity_penalty = np.where(avg_similarity > 0.8, (avg_similarity - 0.8) * 10, 0)
+    adjusted_similarity = np.maximum(0.1, avg_similarity - similarity_penalty)
+
+    # 2. Diversity từ nhiều góc độ
+    tempo_diversity = tempos.var(axis=1) / 100 + np.ptp(tempos, axis=1) / 100
+    energy_diversity = energies.var(axis=1) * 5 + np.ptp(energies, axis=1) * 3
+    key_diversity = _unique_count(keys) / length * 3
+    total_diversity = (
+        features.var(axis=1).mean(axis=1) * 20 * 0.3 +
+        tempo_diversity * 0.2 +
+        energy_diversity * 0.2 +
+        key_diversity * 0.15 +
+        valences.var(axis=1) * 4 * 0.075 +
+        danceabilities.var(axis=1) * 4 * 0.075
+    )
+
+    # 3. Popularity
+    avg_popularity = popularities.mean(axis=1)
+    popularity_score = avg_popularity / 100 * 2
+
+    # 4. Reward với bonus lớn cho diversity cao
+    diversity_bonus = np.select(
+        [total_diversity > 2.0, total_diversity > 1.5, total_diversity > 1.0],
+        [5.0, 3.0, 1.5],
+        default=0.0
+    )
+    total_reward = (
+        adjusted_similarity * 0.15 * 5 +
+        total_diversity * 0.60 +
+        popularity_score * 0.25 +
+        diversity_bonus
+    )
+
+    return {
+        'similarity': avg_similarity,
+        'adjusted_similarity': adjusted_similarity,
+        'diversity': total_diversity,
+        'popularity': avg_popularity,
+        'tempo_diversity': tempo_diversity,
+        'energy_diversity': energy_diversity,
+        'key_diversity': key_diversity,
+        'genre_diversity': _unique_count(table.genre_codes[playlists]) / length,
+        'diversity_bonus': diversity_bonus,
+        'total_reward': total_reward,
+        'num_songs': np.full(len(playlists), length)
+    }
+
+def batch_improved_metrics(playlists, feature_table):
+    """Metrics của train_improved cho nhiều playlist, trả về dict {metric: mảng (m,)}"""
+    return _grouped(playlists, _improved, feature_table)
+
+def batch_diversity_focused_metrics(playlists, feature_table):
+    """Metrics của train_diversity_focused cho nhiều playlist, trả về dict {metric: mảng (m,)}"""
+    return _grouped(playlists, _diversity_focused, feature_table)
+
+def single_playlist_metrics(batch_metrics, playlist, feature_table):
+    """Chạy hàm batch cho 1 playlist và trả về dict giá trị scalar (cùng các key như hàm calculate_* cũ,
+    không gồm metric chỉ có ở batch API như genre_diversity)"""
+    metrics = batch_metrics(np.asarray([playlist], dtype=np.intp), feature_table)
+    return {key: values[0].item() for key, values in metrics.items() if key not in BATCH_ONLY_METRICS}
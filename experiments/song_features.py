@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Bảng feature (n_songs, 22) dùng chung cho reward function của các experiment.
+Mỗi bài hát chỉ được tính feature một lần khi tạo environment, sau đó
+environment và các hàm metrics chỉ cần index vào mảng.
+"""
+
+import numpy as np
+from similarity import SimilarityIndex
+
+FEATURE_DIM = 22
+
+class SongFeatureTable:
+    """Feature vector và các cột audio thô (đã điền giá trị thiếu) cho toàn bộ catalog"""
+
+    def __init__(self, features, columns, genre_codes=None, genres=None):
+        self.features = features  # (n_songs, 22)
+        self.columns = columns    # {'tempo': (n_songs,), 'energy': ..., ...}
+        self.genre_codes = genre_codes if genre_codes is not None else np.zeros(len(features), dtype=np.int32)
+        self.genres = genres or []
+        # Feature đã chuẩn hóa L2 để tính cosine similarity bằng 1 phép dot
+        self.similarity = SimilarityIndex(features, normalize=True)
+
+    def __len__(self):
+        return len(self.features)
+
+    def rows(self, indices):
+        """Lấy feature của nhiều bài hát theo index"""
+        return self.features[np.asarray(indices, dtype=np.intp)]
+
+def _column(songs_data, key, default):
+    """Lấy 1 cột từ songs_data, giá trị thiếu (hoặc None) được thay bằng default"""
+    values = np.array(
+        [np.nan if song.get(key) is None else song[key] for song in songs_data],
+        dtype=np.float64
+    )
+    return np.where(np.isnan(values), default, values)
+
+def _genre_codes(songs_data):
+    """Mã hóa genre của mỗi bài hát thành số nguyên"""
+    genres = {}
+    codes = np.array(
+        [genres.setdefault(song.get('genre', 'Unknown'), len(genres)) for song in songs_data],
+        dtype=np.int32
+    )
+    return codes, list(genres)
+
+def build_improved_feature_table(songs_data):
+    """Feature table cho train_improved (giá trị mặc định cố định)"""
+    c = {
+        'danceability': _column(songs_data, 'danceability', 0.5),
+        'energy': _column(songs_data, 'energy', 0.5),
+        'valence': _column(songs_data, 'valence', 0.5),
+        'tempo': _column(songs_data, 'tempo', 120),
+        'loudness': _column(songs_data, 'loudness', -10),
+        'speechiness': _column(songs_data, 'speechiness', 0.1),
+        'acousticness': _column(songs_data, 'acousticness', 0.5),
+        'instrumentalness': _column(songs_data, 'instrumentalness', 0.1),
+        'liveness': _column(songs_data, 'liveness', 0.1),
+        'key': _column(songs_data, 'key', 6),
+        'mode': _column(songs_data, 'mode', 0.5),
+        'time_signature': _column(songs_data, 'time_signature', 4),
+        'duration_ms': _column(songs_data, 'duration_ms', 200000),
+        'popularity': _column(songs_data, 'popularity', 50),
+    }
+
+    # Các interaction feature gốc dùng mặc định 0 cho speechiness/liveness/instrumentalness
+    speech0 = _column(songs_data, 'speechiness', 0)
+    live0 = _column(songs_data, 'liveness', 0)
+    instr0 = _column(songs_data, 'instrumentalness', 0)
+
+    energy = c['energy']
+    safe_energy = np.where(energy > 0, energy, 1.0)
+
+    features = np.column_stack([
+        c['danceability'],
+        energy,
+        c['valence'],
+        np.minimum(c['tempo'] / 200.0, 1.0),              # Normalize tempo
+        np.maximum((c['loudness'] + 60) / 60.0, 0),       # Normalize loudness
+        c['speechiness'],
+        c['acousticness'],
+        c['instrumentalness'],
+        c['liveness'],
+        c['key'] / 11.0,                                  # Normalize key
+        c['mode'],
+        (c['time_signature'] - 3) / 4.0,                  # Normalize time signature
+        np.minimum(c['duration_ms'] / 300000.0, 1.0),     # Normalize duration
+        c['popularity'] / 100.0,                          # Normalize popularity
+        energy * c['danceability'],                       # Energy-dance interaction
+        c['valence'] * energy,                            # Valence-energy interaction
+        1.0 - c['acousticness'],                          # Electric-ness
+        c['tempo'] / c['duration_ms'] * 1000,             # Tempo density
+        np.where(energy > 0, c['loudness'] / safe_energy, 0),  # Loudness per energy
+        speech0 + live0,                                  # Human factor
+        np.abs(c['valence'] - 0.5) * 2,                   # Emotional intensity
+        instr0 * (1 - speech0)                            # Pure instrumental
+    ])
+
+    return SongFeatureTable(features, c, *_genre_codes(songs_data))
+
+def build_diverse_feature_table(songs_data, seed=42):
+    """Feature table cho train_diversity_focused (giá trị thiếu được random có seed, cố định theo bài hát)"""
+    rng = np.random.default_rng(seed)
+    n = len(songs_data)
+
+    c = {
+        'danceability': _column(songs_data, 'danceability', rng.uniform(0.3, 0.7, n)),
+        'energy': _column(songs_data, 'energy', rng.uniform(0.3, 0.7, n)),
+        'valence': _column(songs_data, 'valence', rng.uniform(0.2, 0.8, n)),
+        'tempo': _column(songs_data, 'tempo', rng.uniform(80, 160, n)),
+        'loudness': _column(songs_data, 'loudness', rng.uniform(-20, -5, n)),
+        'speechiness': _column(songs_data, 'speechiness', rng.uniform(0, 0.3, n)),
+        'acousticness': _column(songs_data, 'acousticness', rng.uniform(0.1, 0.9, n)),
+        'instrumentalness': _column(songs_data, 'instrumentalness', rng.uniform(0, 0.8, n)),
+        'liveness': _column(songs_data, 'liveness', rng.uniform(0.05, 0.4, n)),
+        'key': _column(songs_data, 'key', rng.integers(0, 12, n)),
+        'mode': _column(songs_data, 'mode', rng.choice([0, 1], n)),
+        'time_signature': _column(songs_data, 'time_signature', rng.choice([3, 4, 5], n)),
+        'duration_ms': _column(songs_data, 'duration_ms', rng.uniform(120000, 300000, n)),
+        'popularity': _column(songs_data, 'popularity', rng.uniform(20, 80, n)),
+    }
+
+    base = np.column_stack([
+        c['danceability'],
+        c['energy'],
+        c['valence'],
+        c['tempo'] / 200.0,
+        np.maximum((c['loudness'] + 60) / 60.0, 0),
+        c['speechiness'],
+        c['acousticness'],
+        c['instrumentalness'],
+        c['liveness'],
+        c['key'] / 11.0,
+        c['mode'],
+        (c['time_signature'] - 3) / 4.0,
+        c['duration_ms'] / 300000.0,
+        c['popularity'] / 100.0
+    ])
+
+    # Interaction features để tăng diversity
+    interactions = np.column_stack([
+        base[:, 0] * base[:, 1],                   # dance-energy
+        base[:, 2] * base[:, 1],                   # valence-energy
+        1.0 - base[:, 6],                          # electric-ness
+        base[:, 3] * base[:, 2],                   # tempo-valence
+        base[:, 4] / np.maximum(base[:, 1], 0.1),  # loudness/energy
+        base[:, 5] + base[:, 8],                   # speech+live
+        np.abs(base[:, 2] - 0.5) * 2,              # emotional intensity
+        base[:, 7] * (1 - base[:, 5])              # pure instrumental
+    ])
+
+    return SongFeatureTable(np.hstack([base, interactions]), c, *_genre_codes(songs_data))
@@ -5,13 +5,14 @@ import sys
 import time
 import numpy as np
 from datetime import datetime
-from sklearn.metrics.pairwise import cosine_similarity
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from playlist_generator import PlaylistGenerator
 from models import DQNModel, PlaylistEnvironment
 from config import Config
+from song_features import build_diverse_feature_table
+from playlist_metrics import batch_diversity_focused_metrics, single_playlist_metrics
 
 def log_message(message, log_file="log_train_diversity_focused.txt"):
     """Log message with timestamp"""
@@ -22,41 +23,7 @@ def log_message(message, log_file="log_train_diversity_focused.txt"):
     with open(log_file, 'a', encoding='utf-8') as f:
         f.write(log_entry + '\n')
 
-def get_diverse_song_features(song):
-    """Extract MORE DIVERSE features from song data"""
-    # Lấy tất cả features có thể để tăng diversity
-    base_features = [
-        song.get('danceability', np.random.uniform(0.3, 0.7)),
-        song.get('energy', np.random.uniform(0.3, 0.7)),
-        song.get('valence', np.random.uniform(0.2, 0.8)),
-        song.get('tempo', np.random.uniform(80, 160)) / 200.0,
-        max((song.get('loudness', np.random.uniform(-20, -5)) + 60) / 60.0, 0),
-        song.get('speechiness', np.random.uniform(0, 0.3)),
-        song.get('acousticness', np.random.uniform(0.1, 0.9)),
-        song.get('instrumentalness', np.random.uniform(0, 0.8)),
-        song.get('liveness', np.random.uniform(0.05, 0.4)),
-        song.get('key', np.random.randint(0, 12)) / 11.0,
-        song.get('mode', np.random.choice([0, 1])),
-        (song.get('time_signature', np.random.choice([3, 4, 5])) - 3) / 4.0,
-        song.get('duration_ms', np.random.uniform(120000, 300000)) / 300000.0,
-        song.get('popularity', np.random.uniform(20, 80)) / 100.0
-    ]
-    
-    # Thêm nhiều interaction features để tăng diversity
-    interaction_features = [
-        base_features[0] * base_features[1],  # dance-energy
-        base_features[2] * base_features[1],  # valence-energy  
-        1.0 - base_features[6],               # electric-ness
-        base_features[3] * base_features[2],  # tempo-valence
-        base_features[4] / max(base_features[1], 0.1),  # loudness/energy
-        base_features[5] + base_features[8],  # speech+live
-        abs(base_features[2] - 0.5) * 2,     # emotional intensity
-        base_features[7] * (1 - base_features[5])  # pure instrumental
-    ]
-    
-    return np.array(base_features + interaction_features)
-
-def calculate_diversity_focused_metrics(playlist, generator):
+def calculate_diversity_focused_metrics(playlist, feature_table):
     """Calculate metrics với focus MẠNH vào diversity"""
     if len(playlist) < 2:
         return {
@@ -70,123 +37,19 @@ def calculate_diversity_focused_metrics(playlist, generator):
             'num_songs': len(playlist)
         }
     
-    # Get song data and features
-    playlist_features = []
-    popularities = []
-    energies = []
-    tempos = []
-    keys = []
-    valences = []
-    danceabilities = []
-    
-    for song_idx in playlist:
-        song = generator.songs_data[song_idx]
-        features = get_diverse_song_features(song)
-        
-        playlist_features.append(features)
-        popularities.append(song.get('popularity', np.random.uniform(20, 80)))
-        energies.append(song.get('energy', np.random.uniform(0.3, 0.7)))
-        tempos.append(song.get('tempo', np.random.uniform(80, 160)))
-        keys.append(song.get('key', np.random.randint(0, 12)))
-        valences.append(song.get('valence', np.random.uniform(0.2, 0.8)))
-        danceabilities.append(song.get('danceability', np.random.uniform(0.3, 0.7)))
-    
-    playlist_features = np.array(playlist_features)
-    
-    # 1. SIMILARITY với PENALTY CỰC MẠNH
-    similarities = []
-    for i in range(len(playlist_features) - 1):
-        sim = cosine_similarity(
-            playlist_features[i].reshape(1, -1),
-            playlist_features[i + 1].reshape(1, -1)
-        )[0][0]
-        similarities.append(sim)
-    
-    avg_similarity = np.mean(similarities) if similarities else 0.0
-    
-    # PENALTY CỰC MẠNH cho similarity cao
-    if avg_similarity > 0.8:
-        similarity_penalty = (avg_similarity - 0.8) * 10  # Penalty x10
-    elif avg_similarity > 0.9:
-        similarity_penalty = (avg_similarity - 0.9) * 20  # Penalty x20
-    else:
-        similarity_penalty = 0
-    
-    adjusted_similarity = max(0.1, avg_similarity - similarity_penalty)
-    
-    # 2. DIVERSITY SCORE - TÍNH TOÁN MẠNH MẼ
-    # Feature variance diversity
-    feature_variance = np.mean(np.var(playlist_features, axis=0)) * 20
-    
-    # Tempo diversity
-    tempo_variance = np.var(tempos) / 100
-    tempo_range = (max(tempos) - min(tempos)) / 100
-    tempo_diversity = tempo_variance + tempo_range
-    
-    # Energy diversity  
-    energy_variance = np.var(energies) * 5
-    energy_range = (max(energies) - min(energies)) * 3
-    energy_diversity = energy_variance + energy_range
-    
-    # Key diversity (số lượng keys khác nhau)
-    unique_keys = len(set(keys))
-    key_diversity = unique_keys / max(len(keys), 1) * 3
-    
-    # Valence diversity
-    valence_variance = np.var(valences) * 4
-    
-    # Danceability diversity
-    dance_variance = np.var(danceabilities) * 4
-    
-    # TỔNG HỢP DIVERSITY
-    total_diversity = (
-        feature_variance * 0.3 +
-        tempo_diversity * 0.2 +
-        energy_diversity * 0.2 +
-        key_diversity * 0.15 +
-        valence_variance * 0.075 +
-        dance_variance * 0.075
-    )
-    
-    # 3. POPULARITY cân bằng
-    avg_popularity = np.mean(popularities)
-    popularity_score = avg_popularity / 100 * 2
-    
-    # 4. REWARD FUNCTION TẬP TRUNG VÀO DIVERSITY
-    total_reward = (
-        adjusted_similarity * 0.15 * 5 +    # Similarity: CHỈ 15% (giảm mạnh)
-        total_diversity * 0.60 +            # Diversity: 60% (tăng cực mạnh)
-        popularity_score * 0.25             # Popularity: 25%
-    )
-    
-    # BONUS CỰC LỚN cho diversity cao
-    if total_diversity > 2.0:
-        diversity_bonus = 5.0
-    elif total_diversity > 1.5:
-        diversity_bonus = 3.0
-    elif total_diversity > 1.0:
-        diversity_bonus = 1.5
-    else:
-        diversity_bonus = 0
-    
-    total_reward += diversity_bonus
-    
-    return {
-        'similarity': avg_similarity,
-        'adjusted_similarity': adjusted_similarity,
-        'diversity': total_diversity,
-        'popularity': avg_popularity,
-        'tempo_diversity': tempo_diversity,
-        'energy_diversity': energy_diversity,
-        'key_diversity': key_diversity,
-        'diversity_bonus': diversity_bonus,
-        'total_reward': total_reward,
-        'num_songs': len(playlist)
-    }
+    # Tính bằng batch API (mảng index) trên feature table dùng chung
+    return single_playlist_metrics(batch_diversity_focused_metrics, playlist, feature_table)
 
 class DiversityFocusedEnvironment(PlaylistEnvironment):
     """Environment tập trung MẠNH vào diversity"""
     
+    def __init__(self, songs_data, embeddings, feature_table=None):
+        # Feature của mọi bài hát được tính 1 lần, step() chỉ index vào bảng
+        if feature_table is None:
+            feature_table = build_diverse_feature_table(songs_data)
+        self.feature_table = feature_table
+        super().__init__(songs_data, embeddings)
+    
     def step(self, action):
         if action not in self.available_songs:
             return self.state, -20, True, {}  # Penalty lớn hơn
@@ -197,16 +60,12 @@ class DiversityFocusedEnvironment(PlaylistEnvironment):
         
         # Calculate DIVERSITY-FOCUSED reward
         if len(self.current_playlist) >= 2:
-            last_song = self.songs_data[self.current_playlist[-1]]
-            prev_song = self.songs_data[self.current_playlist[-2]]
+            last_idx = self.current_playlist[-1]
+            prev_idx = self.current_playlist[-2]
+            columns = self.feature_table.columns
             
             # Similarity với PENALTY MẠNH
-            last_features = get_diverse_song_features(last_song)
-            prev_features = get_diverse_song_features(prev_song)
-            similarity = cosine_similarity(
-                last_features.reshape(1, -1),
-                prev_features.reshape(1, -1)
-            )[0][0]
+            similarity = self.feature_table.similarity.pair(last_idx, prev_idx)
             
             # PENALTY CỰC MẠNH cho similarity cao
             if similarity > 0.9:
@@ -223,9 +82,9 @@ class DiversityFocusedEnvironment(PlaylistEnvironment):
                 recent_songs = self.current_playlist[-3:]
                 
                 # Tính diversity từ nhiều góc độ
-                tempos = [self.songs_data[i].get('tempo', np.random.uniform(80, 160)) for i in recent_songs]
-                energies = [self.songs_data[i].get('energy', np.random.uniform(0.3, 0.7)) for i in recent_songs]
-                keys = [self.songs_data[i].get('key', np.random.randint(0, 12)) for i in recent_songs]
+                tempos = columns['tempo'][recent_songs]
+                energies = columns['energy'][recent_songs]
+                keys = columns['key'][recent_songs]
                 
                 tempo_div = np.var(tempos) / 100 * 10
                 energy_div = np.var(energies) * 15
@@ -237,7 +96,7 @@ class DiversityFocusedEnvironment(PlaylistEnvironment):
                 diversity_reward = 5  # Base diversity reward
             
             # Popularity reward
-            popularity = (last_song.get('popularity', 50) + prev_song.get('popularity', 50)) / 2
+            popularity = (columns['popularity'][last_idx] + columns['popularity'][prev_idx]) / 2
             if 30 <= popularity <= 70:
                 popularity_reward = 3
             else:
@@ -367,7 +226,7 @@ def main():
                 # Log results every 5 episodes
                 if episode % 5 == 0 or len(current_playlist) >= 2:
                     if len(current_playlist) >= 2:
-                        metrics = calculate_diversity_focused_metrics(current_playlist, generator)
+                        metrics = calculate_diversity_focused_metrics(current_playlist, generator.environment.feature_table)
                         
                         log_message(f"EPISODE {episode} COMPLETED:")
                         log_message(f"  Time: {episode_time:.2f}s | Steps: {steps} | Songs: {metrics['num_songs']}")
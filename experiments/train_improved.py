@@ -5,7 +5,6 @@ import sys
 import time
 import numpy as np
 from datetime import datetime
-from sklearn.metrics.pairwise import cosine_similarity
 
 # Add current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -13,6 +12,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from playlist_generator import PlaylistGenerator
 from models import DQNModel, PlaylistEnvironment
 from config import Config
+from song_features import build_improved_feature_table
+from playlist_metrics import batch_improved_metrics, single_playlist_metrics
 
 def log_message(message, log_file="log_train_improved.txt"):
     """Log message with timestamp"""
@@ -24,7 +25,7 @@ def log_message(message, log_file="log_train_improved.txt"):
     with open(log_file, 'a', encoding='utf-8') as f:
         f.write(log_entry + '\n')
 
-def calculate_improved_metrics(playlist, generator):
+def calculate_improved_metrics(playlist, feature_table):
     """Tính toán metrics cải tiến với reward function tối ưu"""
     if len(playlist) < 2:
         return {
@@ -39,142 +40,24 @@ def calculate_improved_metrics(playlist, generator):
             'total_reward': 0.0
         }
     
-    # Lấy features và thông tin của các bài hát trong playlist
-    playlist_features = []
-    popularities = []
-    energies = []
-    danceabilities = []
-    valences = []
-    tempos = []
-    
-    for song_idx in playlist:
-        song = generator.songs_data[song_idx]
-        
-        # Audio features (chuẩn hóa tốt hơn)
-        features = [
-            song.get('danceability', 0.5),
-            song.get('energy', 0.5),
-            song.get('valence', 0.5),
-            min(song.get('tempo', 120) / 200.0, 1.0),  # Normalize tempo
-            max((song.get('loudness', -10) + 60) / 60.0, 0),  # Normalize loudness
-            song.get('speechiness', 0.1),
-            song.get('acousticness', 0.5),
-            song.get('instrumentalness', 0.1),
-            song.get('liveness', 0.1),
-            song.get('key', 6) / 11.0,  # Normalize key
-            song.get('mode', 0.5),
-            (song.get('time_signature', 4) - 3) / 4.0,  # Normalize time signature
-            min(song.get('duration_ms', 200000) / 300000.0, 1.0),  # Normalize duration
-            song.get('popularity', 50) / 100.0  # Normalize popularity
-        ]
-        
-        # Add more varied features to reach 22
-        features.extend([
-            song.get('energy', 0.5) * song.get('danceability', 0.5),  # Energy-dance interaction
-            song.get('valence', 0.5) * song.get('energy', 0.5),      # Valence-energy interaction
-            1.0 - song.get('acousticness', 0.5),                      # Electric-ness
-            song.get('tempo', 120) / song.get('duration_ms', 200000) * 1000,  # Tempo density
-            song.get('loudness', -10) / song.get('energy', 0.5) if song.get('energy', 0.5) > 0 else 0,  # Loudness per energy
-            song.get('speechiness', 0) + song.get('liveness', 0),     # Human factor
-            abs(song.get('valence', 0.5) - 0.5) * 2,                 # Emotional intensity
-            song.get('instrumentalness', 0) * (1 - song.get('speechiness', 0))  # Pure instrumental
-        ])
-        
-        playlist_features.append(features[:22])  # Ensure exactly 22 features
-        popularities.append(song.get('popularity', 50))
-        energies.append(song.get('energy', 0.5))
-        danceabilities.append(song.get('danceability', 0.5))
-        valences.append(song.get('valence', 0.5))
-        tempos.append(song.get('tempo', 120))
-    
-    playlist_features = np.array(playlist_features)
-    
-    # 1. IMPROVED SIMILARITY SCORE - Tính độ tương đồng với penalty cho quá cao
-    similarities = []
-    for i in range(len(playlist_features) - 1):
-        sim = cosine_similarity(
-            playlist_features[i].reshape(1, -1),
-            playlist_features[i + 1].reshape(1, -1)
-        )[0][0]
-        similarities.append(sim)
-    
-    avg_similarity = np.mean(similarities) if similarities else 0.0
-    
-    # Penalty cho similarity quá cao (>0.9)
-    similarity_penalty = max(0, (avg_similarity - 0.9) * 2)
-    adjusted_similarity = avg_similarity - similarity_penalty
-    
-    # 2. ENHANCED DIVERSITY SCORE - Cải thiện tính đa dạng
-    feature_variance = np.mean(np.var(playlist_features, axis=0))
-    tempo_variance = np.var(tempos) / 1000  # Normalize tempo variance
-    energy_variance = np.var(energies)
-    valence_variance = np.var(valences)
-    
-    # Tổng hợp diversity từ nhiều nguồn
-    diversity_score = (
-        feature_variance * 5 +      # Feature variance
-        tempo_variance * 3 +        # Tempo diversity
-        energy_variance * 2 +       # Energy diversity
-        valence_variance * 2        # Mood diversity
-    )
-    diversity_score = min(diversity_score, 5.0)  # Cap at 5.0
-    
-    # 3. BALANCED POPULARITY SCORE - Cân bằng độ phổ biến
-    avg_popularity = np.mean(popularities)
-    popularity_variance = np.var(popularities)
-    
-    # Thưởng cho popularity trung bình (50-70) và có variance hợp lý
-    if 50 <= avg_popularity <= 70:
-        popularity_bonus = 1.2
-    elif 40 <= avg_popularity <= 80:
-        popularity_bonus = 1.0
-    else:
-        popularity_bonus = 0.8
-    
-    popularity_score = (avg_popularity / 100 * 3) * popularity_bonus
-    
-    # 4. FLOW SCORE - Đánh giá tính liền mạch của playlist
-    energy_flow = 1.0 - np.mean(np.abs(np.diff(energies)))  # Smooth energy transition
-    tempo_flow = 1.0 - np.mean(np.abs(np.diff(tempos))) / 50  # Smooth tempo transition
-    flow_score = (energy_flow + tempo_flow) / 2
-    
-    # 5. IMPROVED REWARD CALCULATION - Cân bằng tốt hơn
-    total_reward = (
-        adjusted_similarity * 0.25 * 10 +  # Similarity: 25% (giảm từ 40%)
-        diversity_score * 0.35 +           # Diversity: 35% (tăng từ 30%)
-        popularity_score * 0.25 +          # Popularity: 25% (giảm từ 30%)
-        flow_score * 0.15 * 5              # Flow: 15% (mới thêm)
-    )
-    
-    # Bonus cho playlist cân bằng
-    balance_bonus = 0
-    if 0.7 <= avg_similarity <= 0.85 and diversity_score >= 1.0:
-        balance_bonus = 1.0
-    
-    total_reward += balance_bonus
-    
-    return {
-        'similarity': avg_similarity,
-        'adjusted_similarity': adjusted_similarity,
-        'diversity': diversity_score,
-        'popularity': avg_popularity,
-        'avg_energy': np.mean(energies),
-        'avg_danceability': np.mean(danceabilities),
-        'avg_valence': np.mean(valences),
-        'tempo_variance': tempo_variance,
-        'flow_score': flow_score,
-        'balance_bonus': balance_bonus,
-        'total_reward': total_reward,
-        'num_songs': len(playlist)
-    }
+    # Tính bằng batch API (mảng index) trên feature table dùng chung
+    return single_playlist_metrics(batch_improved_metrics, playlist, feature_table)
 
 class ImprovedPlaylistEnvironment(PlaylistEnvironment):
     """Environment cải tiến với reward function tối ưu"""
     
-    def __init__(self, songs_data, embeddings):
+    def __init__(self, songs_data, embeddings, feature_table=None):
+        # Feature của mọi bài hát được tính 1 lần, step() chỉ index vào bảng
+        if feature_table is None:
+            feature_table = build_improved_feature_table(songs_data)
+        self.feature_table = feature_table
         super().__init__(songs_data, embeddings)
         self.step_rewards = []
     
+    def _get_song_features(self, song_idx):
+        """Lấy feature vector 22 chiều của bài hát từ feature table"""
+        return self.feature_table.features[song_idx]
+    
     def step(self, action):
         """Override step function với reward cải tiến"""
         if action not in self.available_songs:
@@ -188,16 +71,12 @@ class ImprovedPlaylistEnvironment(PlaylistEnvironment):
         # Calculate improved reward
         if len(self.current_playlist) >= 2:
             # Immediate reward cho step này
-            last_song = self.songs_data[self.current_playlist[-1]]
-            prev_song = self.songs_data[self.current_playlist[-2]]
+            last_idx = self.current_playlist[-1]
+            prev_idx = self.current_playlist[-2]
+            columns = self.feature_table.columns
             
             # Similarity reward (cải tiến)
-            last_features = self._get_song_features(last_song)
-            prev_features = self._get_song_features(prev_song)
-            similarity = cosine_similarity(
-                last_features.reshape(1, -1),
-                prev_features.reshape(1, -1)
-            )[0][0]
+            similarity = self.feature_table.similarity.pair(last_idx, prev_idx)
             
             # Optimal similarity range: 0.7-0.85
             if 0.7 <= similarity <= 0.85:
@@ -209,15 +88,14 @@ class ImprovedPlaylistEnvironment(PlaylistEnvironment):
             
             # Diversity reward
             if len(self.current_playlist) >= 3:
-                recent_features = [self._get_song_features(self.songs_data[idx]) 
-                                 for idx in self.current_playlist[-3:]]
+                recent_features = self.feature_table.rows(self.current_playlist[-3:])
                 diversity = np.mean(np.var(recent_features, axis=0)) * 20
                 diversity_reward = min(diversity, 5)
             else:
                 diversity_reward = 0
             
             # Popularity reward
-            popularity = (last_song.get('popularity', 50) + prev_song.get('popularity', 50)) / 2
+            popularity = (columns['popularity'][last_idx] + columns['popularity'][prev_idx]) / 2
             if 50 <= popularity <= 70:
                 popularity_reward = 3
             elif 40 <= popularity <= 80:
@@ -226,8 +104,8 @@ class ImprovedPlaylistEnvironment(PlaylistEnvironment):
                 popularity_reward = 1
             
             # Flow reward (energy/tempo transition)
-            energy_diff = abs(last_song.get('energy', 0.5) - prev_song.get('energy', 0.5))
-            tempo_diff = abs(last_song.get('tempo', 120) - prev_song.get('tempo', 120)) / 50
+            energy_diff = abs(columns['energy'][last_idx] - columns['energy'][prev_idx])
+            tempo_diff = abs(columns['tempo'][last_idx] - columns['tempo'][prev_idx]) / 50
             flow_reward = max(0, 3 - energy_diff * 5 - tempo_diff)
             
             step_reward = similarity_reward + diversity_reward + popularity_reward + flow_reward
@@ -359,7 +237,7 @@ def main():
                 
                 if len(current_playlist) >= 2:
                     # Calculate improved metrics
-                    metrics = calculate_improved_metrics(current_playlist, generator)
+                    metrics = calculate_improved_metrics(current_playlist, generator.environment.feature_table)
                     
                     # Log detailed results
                     log_message(f"EPISODE {episode} COMPLETED:")
@@ -0,0 +1,242 @@
+from collections.abc import Mapping, Sequence
+import json
+import re
+import numpy as np
+
+_MISSING = object()
+
+class Song(Mapping):
+    """View read-only tới 1 bài hát trong SongCatalog, dùng được như dict cũ (song['id'], song.get(...))"""
+
+    __slots__ = ('_catalog', '_index')
+
+    def __init__(self, catalog, index):
+        self._catalog = catalog
+        self._index = index
+
+    def __getitem__(self, key):
+        value = self._catalog.value(self._index, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return self._catalog.value(self._index, key, default)
+
+    def __contains__(self, key):
+        return self._catalog.value(self._index, key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return (key for key in self._catalog.fields if key in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f"Song({self.to_dict()!r})"
+
+class SongCatalog(Sequence):
+    """Danh sách bài hát lưu theo cột thay cho list các dict.
+
+    Cột số (popularity, duration_ms, audio features...) là mảng numpy; cột chuỗi (artist, album,
+    genre...) lưu mã int32 trỏ vào danh sách giá trị không trùng. catalog[i] trả về Song (view
+    có __slots__) nên code cũ dùng song['id'] / song.get(...) vẫn chạy; code nóng nên dùng column().
+    Phân biệt được thiếu key và giá trị None giống dict gốc.
+    """
+
+    def __init__(self, songs):
+        self._size = len(songs)
+        self.fields = []
+        seen = set()
+        for song in songs:
+            for key in song:
+                if key not in seen:
+                    seen.add(key)
+                    self.fields.append(key)
+
+        self._columns = {}
+        self._missing = {}  # field -> mask bài hát không có key (None nếu bài nào cũng có)
+        self._none = {}  # field -> mask bài hát có giá trị None
+        for field in self.fields:
+            values = [song.get(field, _MISSING) for song in songs]
+            missing = np.fromiter((v is _MISSING for v in values), dtype=bool, count=self._size)
+            none = np.fromiter((v is None for v in values), dtype=bool, count=self._size)
+            self._missing[field] = missing if missing.any() else None
+            self._none[field] = none if none.any() else None
+            self._columns[field] = self._build_column([v for v in values if v is not _MISSING and v is not None],
+                                                      values)
+        self._lowered = {}  # field -> (vocab viết thường nối bằng '\0', vị trí bắt đầu mỗi giá trị), tạo khi tìm kiếm lần đầu
+        # 1 lần tra dict cho mỗi lần đọc Song.get
+        self._accessors = {field: self._columns[field] + (self._missing[field], self._none[field])
+                           for field in self.fields}
+
+    def _build_column(self, present, values):
+        """(kind, data, vocab): chọn kiểu lưu theo kiểu của các giá trị có mặt"""
+        types = {type(v) for v in present}
+        if types == {str}:
+            vocab = {}
+            codes = np.fromiter((vocab.setdefault(v, len(vocab)) if isinstance(v, str) else 0 for v in values),
+                                dtype=np.int32, count=self._size)
+            return 'str', codes, list(vocab)
+        numeric = {bool: np.bool_, int: np.int64, float: np.float64}
+        if len(types) == 1 and next(iter(types)) in numeric:
+            dtype = numeric[next(iter(types))]
+            fill = dtype(0)
+            try:
+                data = np.array([v if type(v) in numeric else fill for v in values], dtype=dtype)
+                return 'number', data, None
+            except OverflowError:
+                pass
+        return 'object', [None if v is _MISSING else v for v in values], None
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Song(self, i) for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return Song(self, index)
+
+    def __iter__(self):
+        return (Song(self, i) for i in range(self._size))
+
+    def index_of(self, song):
+        """Vị trí của song trong catalog nếu song là view của chính catalog này, không thì -1"""
+        if isinstance(song, Song) and song._catalog is self:
+            return song._index
+        return -1
+
+    def value(self, index, field, default=None):
+        """Giá trị field của bài hát index, default nếu bài hát không có key đó"""
+        accessor = self._accessors.get(field)
+        if accessor is None:
+            return default
+        kind, data, vocab, missing, none = accessor
+        if missing is not None and missing[index]:
+            return default
+        if none is not None and none[index]:
+            return None
+        if kind == 'str':
+            return vocab[data[index]]
+        if kind == 'number':
+            return data[index].item()
+        return data[index]
+
+    def column(self, field, default=None, none=None):
+        """Cả cột dưới dạng mảng numpy: bài hát thiếu key nhận default, giá trị None nhận `none`.
+
+        Cột số trả về float64 nếu default và none đều là số, còn lại là mảng object.
+        """
+        result = np.empty(self._size, dtype=object)
+        column = self._columns.get(field)
+        if column is None:
+            result[:] = [default] * self._size
+            return result
+        kind, data, vocab = column
+        if kind == 'str':
+            if vocab:
+                result[:] = np.array(vocab, dtype=object)[data]
+        elif kind == 'number':
+            numeric = isinstance(default, (int, float)) and isinstance(none, (int, float))
+            result = data.astype(np.float64) if numeric else data.astype(object)
+        else:
+            for i, value in enumerate(data):
+                result[i] = value
+        for mask, fill in ((self._missing[field], default), (self._none[field], none)):
+            if mask is not None:
+                result[mask] = fill
+        return result
+
+    def contains(self, field, text, default=''):
+        """Mảng bool: `text` nằm trong giá trị field viết thường (bài thiếu key hoặc None dùng default).
+
+        Cột chuỗi chỉ so trên danh sách giá trị không trùng rồi tra theo mã, không duyệt từng bài hát.
+        """
+        column = self._columns.get(field)
+        if column is None or column[0] != 'str':
+            return np.fromiter((text in str(value).lower() for value in self.column(field, default, default)),
+                               dtype=bool, count=self._size)
+        _, data, vocab = column
+        lowered = self._lowered.get(field)
+        if lowered is None:
+            # Các giá trị viết thường nối bằng '\0': 1 lần quét chuỗi thay cho 1 phép `in` mỗi giá trị
+            values = [value.lower() for value in vocab]  # lower() có thể đổi độ dài chuỗi
+            joined = '\0'.join(values)
+            starts = np.cumsum([0] + [len(value) + 1 for value in values[:-1]])
+            lowered = self._lowered[field] = (joined, starts)
+        joined, starts = lowered
+        matches = np.zeros(len(vocab), dtype=bool)
+        if not text:
+            matches[:] = True
+        elif '\0' not in text:
+            positions = [match.start() for match in re.finditer(re.escape(text), joined)]
+            matches[np.searchsorted(starts, positions, side='right') - 1] = True
+        result = matches[data] if vocab else np.zeros(self._size, dtype=bool)
+        for mask in (self._missing[field], self._none[field]):
+            if mask is not None:
+                result[mask] = text in default.lower()
+        return result
+
+    def to_list(self):
+        """Chuyển lại thành list các dict (ví dụ để ghi JSON)"""
+        return [song.to_dict() for song in self]
+
+def column_of(songs_data, field, default=None, none=None):
+    """Cột field của songs_data (SongCatalog hoặc list các dict) như SongCatalog.column"""
+    if isinstance(songs_data, SongCatalog):
+        return songs_data.column(field, default, none)
+    values = np.empty(len(songs_data), dtype=object)
+    for i, song in enumerate(songs_data):
+        value = song.get(field, _MISSING)
+        values[i] = default if value is _MISSING else none if value is None else value
+    return values
+
+def contains_text(songs_data, field, text, default=''):
+    """SongCatalog.contains cho cả SongCatalog lẫn list các dict"""
+    if isinstance(songs_data, SongCatalog):
+        return songs_data.contains(field, text, default)
+    return np.fromiter((text in str(value).lower() for value in column_of(songs_data, field, default, default)),
+                       dtype=bool, count=len(songs_data))
+
+def iter_catalog_file(path, chunk_size=10000, read_size=1 << 20):
+    """Đọc file catalog JSON (mảng các bài hát) thành từng lô tối đa chunk_size bài, không load cả file vào RAM"""
+    decoder = json.JSONDecoder()
+    chunk = []
+    buffer = ''
+    pos = None  # None: chưa gặp '[' mở đầu
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            data = f.read(read_size)
+            buffer = buffer[pos or 0:] + data
+            pos = buffer.index('[') + 1 if pos is None and '[' in buffer else (0 if pos is not None else None)
+            if pos is None:
+                if not data:
+                    raise ValueError(f"{path} không phải mảng JSON")
+                continue
+
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if buffer.startswith(']', pos):
+                    if chunk:
+                        yield chunk
+                    return
+                try:
+                    song, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not data:
+                        raise
+                    break  # Bài hát bị cắt ở cuối buffer: đọc thêm
+                chunk.append(song)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if not data:
+                raise ValueError(f"{path} kết thúc trước ']'")
@@ -13,8 +13,16 @@ class Config:
     DATA_DIR = "data"
     RAW_DATA_FILE = os.path.join(DATA_DIR, "raw_data.txt")
     EMBEDDING_FILE = os.path.join(DATA_DIR, "embeddings.txt")
+    EMBEDDING_STORE_FILE = os.path.join(DATA_DIR, "embeddings.f32")  # Embeddings nhị phân (+ .ids, .json) do create_embeddings ghi
     METRICS_FILE = os.path.join(DATA_DIR, "metrics.txt")
     PLAYLIST_DATA_FILE = "spotify_songs.json"
+    SHARED_STORE_DIR = os.path.join(DATA_DIR, "shared")  # Embeddings + cột số dạng .npy để các process mmap dùng chung ("" = tắt)
+    
+    # Search Cache Configuration
+    SEARCH_CACHE_ENABLED = True
+    SEARCH_CACHE_FILE = os.path.join(DATA_DIR, "search_cache.sqlite3")
+    SEARCH_CACHE_TTL = 7 * 24 * 3600  # 7 ngày
+    SEARCH_CACHE_MAX_ENTRIES = 20000
     
     # Model Configuration
     EMBEDDING_DIM = 22  # Sửa lại để khớp với embeddings thực tế
@@ -22,6 +30,13 @@ class Config:
     LEARNING_RATE = 0.001
     BATCH_SIZE = 32
     EPOCHS = 100
+    EMBEDDING_PCA_SOLVER = "auto"  # auto | full | randomized | incremental (IncrementalPCA theo lô, cho catalog rất lớn)
+    EMBEDDING_BATCH_SIZE = 10000  # Số bài hát mỗi lô khi fit IncrementalPCA / ghi embeddings
+    EMBEDDING_MODEL_FILE = os.path.join("models", "embedding_model.weights.h5")  # Weights của SongEmbeddingModel
+    DQN_MODEL_FILE = os.path.join("models", "dqn_model.h5")
+    DQN_INFERENCE_BACKEND = os.getenv("DQN_INFERENCE_BACKEND", "auto")  # auto | numpy | keras (xem numpy_dqn.load_serving_dqn)
+    DQN_QUANTIZATION = os.getenv("DQN_QUANTIZATION", "")  # "" | int8 | float16: weights NumPy lượng tử hóa khi phục vụ
+    DQN_DEQUANTIZE_ON_LOAD = True  # False: giữ weights int8/float16 trong RAM (nhỏ hơn, mỗi bước chậm hơn)
     
     # RL Configuration
     GAMMA = 0.99
@@ -32,10 +47,29 @@ class Config:
     # Playlist Configuration
     MAX_PLAYLIST_LENGTH = 50
     MIN_PLAYLIST_LENGTH = 10
+    DETERMINISTIC_GENERATION = False  # Mặc định cho /api/generate-playlist khi request không chỉ định
+    PLAYLIST_CACHE_SIZE = 1000  # Số kết quả deterministic được cache (0 = tắt cache)
+    PLAYLIST_CACHE_TTL = 3600  # Giây
+    CONSTRAINT_MASK_CACHE_SIZE = 256  # Số bộ constraints (genre, popularity, năm) giữ bitmap
     
     # Web Configuration
     FLASK_SECRET_KEY = "your-secret-key-here"
     DEBUG = True
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # DEBUG để xem log từng bước khi tạo playlist
+    TRAINING_LOG_BUFFER_SIZE = 1000  # Số log training giữ lại trong bộ nhớ
+    JOB_CANCEL_GRACE = 10  # Giây chờ job tự dừng khi bị hủy trước khi terminate worker process
+    RELOAD_WATCH_INTERVAL = int(os.getenv("RELOAD_WATCH_INTERVAL", "0"))  # Giây giữa 2 lần kiểm tra file dữ liệu/model để tự reload (0 = tắt)
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # Nếu đặt, /api/admin/reload yêu cầu header X-Admin-Token
+    SSE_STATUS_INTERVAL = 5  # Giây giữa 2 lần kiểm tra trạng thái trong /api/stream (cũng là chu kỳ keep-alive)
+    SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", "4"))  # Kết nối /api/stream tối đa mỗi process (mỗi kết nối giữ 1 thread), vượt quá trả 503 để client polling
+    
+    # Production serving (web/serve.py, gunicorn pre-fork)
+    SERVE_BIND = os.getenv("SERVE_BIND", "0.0.0.0:5000")
+    SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "2"))  # Số worker process (mỗi worker load 1 DQN)
+    SERVE_THREADS = int(os.getenv("SERVE_THREADS", "8"))  # Thread mỗi worker (SSE giữ 1 thread/kết nối)
+    SERVE_TIMEOUT = 120  # Giây trước khi gunicorn coi worker bị treo
+    SERVE_RELOAD_WATCH_INTERVAL = 30  # Mỗi worker tự reload khi file model/dữ liệu đổi (0 = tắt)
+    SERVE_JOB_STATE_FILE = "models/job_state.json"  # Trạng thái + log job dùng chung giữa các worker
     
     # Data Collection
     TARGET_SONGS_COUNT = 10000
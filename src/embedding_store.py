@@ -0,0 +1,156 @@
+import json
+import os
+import numpy as np
+
+STORE_FORMAT = 1
+
+class EmbeddingStore:
+    """Embeddings dạng nhị phân, ghi nối được.
+
+    Gồm 3 file: `path` (các hàng float32 nối tiếp), `path.ids` (1 song_id mỗi dòng, cùng thứ tự)
+    và `path.json` (dim, số hàng). Meta được ghi sau cùng nên số hàng trong meta là số hàng đã ghi
+    xong: phần ghi dở do process bị dừng giữa chừng sẽ bị bỏ qua khi đọc và bị cắt ở lần ghi nối sau.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ids_path = path + '.ids'
+        self.meta_path = path + '.json'
+        self.transform_path = path + '.transform.npz'
+
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def meta(self):
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def ids(self):
+        """Danh sách song_id theo thứ tự hàng"""
+        count = self.meta()['count']
+        with open(self.ids_path, 'r', encoding='utf-8') as f:
+            ids = f.read().split('\n')
+        return ids[:count]
+
+    def read(self):
+        """(ids, ma trận (count, dim) float32 mmap read-only)"""
+        meta = self.meta()
+        ids = self.ids()
+        if meta['count'] == 0:
+            return ids, np.zeros((0, meta['dim']), dtype=np.float32)
+        matrix = np.memmap(self.path, dtype=np.float32, mode='r', shape=(meta['count'], meta['dim']))
+        return ids, matrix
+
+    def to_dict(self):
+        """{song_id: vector} với vector là view vào file mmap (không copy)"""
+        ids, matrix = self.read()
+        matrix = np.asarray(matrix)  # Cắt hàng của ndarray nhanh hơn nhiều so với np.memmap (vẫn chung bộ nhớ)
+        return {song_id: matrix[i] for i, song_id in enumerate(ids)}
+
+    def writer(self, dim, append=False):
+        """EmbeddingWriter ghi lại từ đầu (append=False) hoặc ghi nối vào store hiện có"""
+        return EmbeddingWriter(self, dim, append=append)
+
+    def write(self, ids, matrix):
+        """Ghi đè toàn bộ store"""
+        matrix = np.asarray(matrix)
+        with self.writer(matrix.shape[1]) as writer:
+            writer.write(ids, matrix)
+
+    def append(self, ids, matrix):
+        """Ghi nối các hàng mới (tạo store nếu chưa có)"""
+        matrix = np.asarray(matrix)
+        with self.writer(matrix.shape[1], append=self.exists()) as writer:
+            writer.write(ids, matrix)
+
+    def save_transform(self, kind, **arrays):
+        """Lưu phép biến đổi feature -> embedding đã fit (ví dụ mean/components của PCA) cùng store,
+        để sau này chỉ cần embed bài hát mới rồi ghi nối thay vì fit lại trên cả catalog"""
+        tmp_path = self.transform_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, kind=np.array(kind), **arrays)
+        os.replace(tmp_path, self.transform_path)
+
+    def load_transform(self):
+        """{'kind': ..., tên mảng: mảng} đã lưu bằng save_transform, None nếu chưa có"""
+        if not os.path.exists(self.transform_path):
+            return None
+        with np.load(self.transform_path) as data:
+            transform = {name: data[name] for name in data.files}
+        transform['kind'] = str(transform['kind'])
+        return transform
+
+    def remove(self):
+        for path in (self.meta_path, self.path, self.ids_path, self.transform_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class EmbeddingWriter:
+    """Ghi embeddings theo từng lô (dùng với `with`); meta chỉ được cập nhật khi thoát không lỗi"""
+
+    def __init__(self, store, dim, append=False):
+        self.store = store
+        self.dim = dim
+        self.append = append
+        self.count = 0
+
+    def __enter__(self):
+        store = self.store
+        directory = os.path.dirname(store.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if self.append:
+            meta = store.meta()
+            if meta['dim'] != self.dim:
+                raise ValueError(f"{store.path} có dim {meta['dim']}, không ghi nối được vector dim {self.dim}")
+            self.count = meta['count']
+            with open(store.ids_path, 'rb') as f:
+                ids_size = sum(len(line) for line, _ in zip(f, range(self.count)))
+            # Cắt phần ghi dở của lần trước (nếu có) rồi mới ghi tiếp
+            self._vectors = open(store.path, 'r+b')
+            self._vectors.truncate(self.count * self.dim * 4)
+            self._vectors.seek(0, os.SEEK_END)
+            self._ids = open(store.ids_path, 'r+b')
+            self._ids.truncate(ids_size)
+            self._ids.seek(0, os.SEEK_END)
+            self._paths = None
+        else:
+            # Ghi ra file tạm, đổi tên khi xong để không bao giờ để lại store ghi dở
+            self._paths = (store.path + '.tmp', store.ids_path + '.tmp')
+            self._vectors = open(self._paths[0], 'wb')
+            self._ids = open(self._paths[1], 'wb')
+        return self
+
+    def write(self, ids, matrix):
+        """Ghi 1 lô: len(ids) hàng của matrix (dim phải khớp)"""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim or len(matrix) != len(ids):
+            raise ValueError(f"Cần ma trận ({len(ids)}, {self.dim}), nhận {matrix.shape}")
+        self._vectors.write(matrix.tobytes())
+        self._ids.write(''.join(f"{song_id}\n" for song_id in ids).encode('utf-8'))
+        self.count += len(ids)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._vectors.close()
+        self._ids.close()
+        store = self.store
+        if exc_type is not None:
+            if self._paths:
+                for path in self._paths:
+                    os.remove(path)
+            return False
+
+        if self._paths:
+            # Xóa meta trước: trong lúc thay file, người đọc thấy store chưa có thay vì meta lệch dữ liệu.
+            # Transform cũ không còn khớp với dữ liệu mới: người ghi lưu lại bằng save_transform nếu cần
+            for path in (store.meta_path, store.transform_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            os.replace(self._paths[0], store.path)
+            os.replace(self._paths[1], store.ids_path)
+        tmp_meta = store.meta_path + '.tmp'
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({'format': STORE_FORMAT, 'dim': self.dim, 'count': self.count}, f)
+        os.replace(tmp_meta, store.meta_path)
+        return False
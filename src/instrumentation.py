@@ -0,0 +1,313 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Bucket (giây) cho histogram latency, giống bucket mặc định của Prometheus
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bucket cho kích thước batch khi gọi Q-network
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+class Histogram:
+    """Histogram với bucket cố định, chi phí ghi O(số bucket) và không giữ từng giá trị"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # bucket cuối là +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value):
+        """Ghi nhận 1 giá trị"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Ước lượng percentile (0-100) bằng nội suy tuyến tính trong bucket"""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        cumulative = 0
+        lower = 0.0
+        for i, count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if count and cumulative + count >= rank:
+                fraction = (rank - cumulative) / count
+                value = lower + (upper - lower) * fraction
+                return min(max(value, self.min), self.max)
+            cumulative += count
+            lower = upper
+        return self.max
+
+    def snapshot(self):
+        """Thống kê dạng dict (giây)"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))
+        }
+
+class StageProfiler:
+    """Đo thời gian theo từng giai đoạn (reset, constraints, act, step, ...) và gộp thành histogram"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.enabled = True
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def observe(self, stage, seconds):
+        """Ghi nhận thời gian của 1 giai đoạn"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager đo thời gian 1 giai đoạn"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Thống kê của mọi giai đoạn: {stage: {count, mean, p50, p90, p99, ...}}"""
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        """Xóa toàn bộ số liệu đã ghi"""
+        with self._lock:
+            self._histograms = {}
+
+    def start_sampling(self, interval=0.005, thread_id=None):
+        """Bật sampling profiler (lấy mẫu stack của thread định kỳ)"""
+        if self._sampler is None:
+            self._sampler = SamplingProfiler(interval, thread_id)
+            self._sampler.start()
+        return self._sampler
+
+    def stop_sampling(self, top=30):
+        """Tắt sampling profiler, trả về các hàm tốn thời gian nhất"""
+        sampler, self._sampler = self._sampler, None
+        if sampler is None:
+            return []
+        sampler.stop()
+        return sampler.report(top)
+
+    @property
+    def sampling(self):
+        return self._sampler is not None
+
+class SamplingProfiler:
+    """Sampling profiler đơn giản: thread nền đọc sys._current_frames() mỗi `interval` giây.
+
+    Chi phí thấp hơn nhiều so với cProfile vì không hook vào từng lời gọi hàm;
+    nếu không chỉ định thread_id thì lấy mẫu mọi thread trừ chính nó.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = 0
+        self.self_counts = Counter()    # hàm đang chạy (đỉnh stack)
+        self.total_counts = Counter()   # hàm có mặt trong stack
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_id is not None and thread_id != self.thread_id):
+                    continue
+                self.samples += 1
+                self.self_counts[self._label(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    label = self._label(frame)
+                    if label not in seen:
+                        self.total_counts[label] += 1
+                        seen.add(label)
+                    frame = frame.f_back
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+    def report(self, top=30):
+        """Danh sách hàm theo số mẫu: self (đang chạy) và total (kể cả hàm con)"""
+        samples = max(self.samples, 1)
+        return [
+            {
+                'function': label,
+                'self_pct': self.self_counts[label] / samples * 100,
+                'total_pct': self.total_counts[label] / samples * 100
+            }
+            for label, _ in self.total_counts.most_common(top)
+        ]
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def process_memory_bytes():
+    """RSS hiện tại của process (bytes); dùng /proc nếu có, nếu không thì RSS đỉnh"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        return 0
+
+class MetricsRegistry:
+    """Counter / gauge / histogram trong process, xuất theo định dạng text của Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}        # name -> (type, help)
+        self._values = {}      # (name, labels) -> số (counter/gauge) hoặc Histogram
+        self._callbacks = {}   # name -> hàm trả về giá trị gauge khi scrape
+        self._profilers = []   # (prefix, StageProfiler) xuất thành histogram theo stage
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._meta:
+            self._meta[name] = (kind, help_text or name)
+
+    def inc(self, name, value=1, help_text=None, **labels):
+        """Tăng counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'counter', help_text)
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set_gauge(self, name, value, help_text=None, **labels):
+        """Gán giá trị gauge"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'gauge', help_text)
+            self._values[key] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, help_text=None, **labels):
+        """Ghi nhận giá trị vào histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'histogram', help_text)
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def gauge_callback(self, name, fn, help_text=None):
+        """Gauge được tính lại mỗi lần scrape (ví dụ: bộ nhớ, số bài hát)"""
+        with self._lock:
+            self._declare(name, 'gauge', help_text)
+            self._callbacks[name] = fn
+
+    def export_profiler(self, name, profiler, help_text=None):
+        """Xuất histogram của StageProfiler với label stage"""
+        with self._lock:
+            self._declare(name, 'histogram', help_text)
+            self._profilers.append((name, profiler))
+
+    def get(self, name, **labels):
+        """Giá trị hiện tại của counter/gauge (0 nếu chưa có)"""
+        with self._lock:
+            return self._values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """Xuất toàn bộ metrics theo Prometheus text exposition format"""
+        with self._lock:
+            values = list(self._values.items())
+            callbacks = list(self._callbacks.items())
+            profilers = list(self._profilers)
+            meta = dict(self._meta)
+
+        series = {}
+        for (name, labels), value in values:
+            series.setdefault(name, []).append((labels, value))
+        for name, fn in callbacks:
+            try:
+                series.setdefault(name, []).append(((), fn()))
+            except Exception:
+                continue
+        for name, profiler in profilers:
+            with profiler._lock:
+                stages = [(stage, h) for stage, h in profiler._histograms.items()]
+            for stage, histogram in stages:
+                series.setdefault(name, []).append(((('stage', stage),), histogram))
+
+        lines = []
+        for name in sorted(series):
+            kind, help_text = meta.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series[name], key=lambda item: item[0]):
+                if isinstance(value, Histogram):
+                    cumulative = 0
+                    bounds = list(value.buckets) + [float('inf')]
+                    for bound, count in zip(bounds, value.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, {'le': _format_value(bound)})} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {repr(float(value.sum))}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+# Profiler dùng chung trong process
+PROFILER = StageProfiler()
+
+# Metrics dùng chung trong process (endpoint /metrics)
+METRICS = MetricsRegistry()
+METRICS.gauge_callback('process_resident_memory_bytes', process_memory_bytes, "RSS của process (bytes)")
+METRICS.export_profiler('playlist_stage_duration_seconds', PROFILER, "Thời gian từng giai đoạn khi tạo playlist")
@@ -1,22 +1,81 @@
+import copy
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
 import json
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
 from config import Config
+from similarity import SimilarityIndex
+from instrumentation import METRICS, BATCH_SIZE_BUCKETS
+from catalog import column_of, iter_catalog_file
+from embedding_store import EmbeddingStore
+import logging
 import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+def _keras():
+    """Import Keras khi thật sự cần tạo model.
+    
+    Import TensorFlow mất vài giây, nên module này (PlaylistEnvironment, catalog...) được import
+    mà không kéo TensorFlow theo; web server có thể phục vụ các endpoint catalog trong lúc chờ.
+    """
+    from tensorflow import keras
+    return keras
+
+def make_pca(n_components, solver=None):
+    """PCA theo Config.EMBEDDING_PCA_SOLVER: 'incremental' dùng IncrementalPCA (fit theo lô, ít RAM),
+    còn lại là svd_solver của sklearn PCA ('randomized' nhanh hơn khi catalog lớn và nhiều feature)"""
+    solver = solver or Config.EMBEDDING_PCA_SOLVER
+    if solver == 'incremental':
+        from sklearn.decomposition import IncrementalPCA
+        return IncrementalPCA(n_components=n_components, batch_size=Config.EMBEDDING_BATCH_SIZE)
+    from sklearn.decomposition import PCA
+    return PCA(n_components=n_components, svd_solver=solver)
+
+def fit_pca(pca, features, batch_size=None):
+    """Fit pca; IncrementalPCA được fit từng lô để không cần thêm bản copy của cả ma trận"""
+    if hasattr(pca, 'partial_fit'):
+        batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        for start in range(0, len(features), batch_size):
+            end = start + batch_size
+            # Phần còn lại quá nhỏ thì gộp vào lô này (IncrementalPCA cần ít nhất n_components mẫu mỗi lô)
+            if len(features) - end < pca.n_components:
+                end = len(features)
+            pca.partial_fit(features[start:end])
+            if end == len(features):
+                break
+    else:
+        pca.fit(features)
+    return pca
+
+# Feature audio dùng cho SongEmbeddingModel (thêm popularity / 100 và duration_ms / 1e6)
+SONG_AUDIO_FEATURES = ('danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                       'instrumentalness', 'liveness', 'valence', 'tempo')
+
+def _rebatch(batches, min_size):
+    """Gộp lô nhỏ hơn min_size vào lô kề nó (IncrementalPCA cần ít nhất n_components mẫu mỗi lô)"""
+    pending = None
+    for batch in batches:
+        if pending is None:
+            pending = batch
+        elif len(pending) < min_size or len(batch) < min_size:
+            pending = np.vstack([pending, batch])
+        else:
+            yield pending
+            pending = batch
+    if pending is not None:
+        yield pending
 
 class SongEmbeddingModel:
     def __init__(self):
         self.model = None
-        self.scaler = StandardScaler()
-        self.pca = PCA(n_components=Config.EMBEDDING_DIM)
+        self.scaler = None  # StandardScaler / IncrementalPCA được tạo khi train (import scikit-learn lúc đó)
+        self.pca = None
+        self.transform = None  # Mảng của scaler + PCA đã fit, đủ để embed bài hát mới mà không cần sklearn
         
     def create_model(self, input_dim):
         """Tạo model để tạo embedding cho bài hát"""
+        keras = _keras()
+        layers = keras.layers
         model = keras.Sequential([
             layers.Dense(512, activation='relu', input_shape=(input_dim,)),
             layers.Dropout(0.3),
@@ -32,78 +91,162 @@ class SongEmbeddingModel:
         
         return model
     
+    def song_features(self, songs):
+        """(ids, features) của các bài hát có audio features (danceability khác None), tính theo cột"""
+        keep = np.array([value is not None for value in column_of(songs, 'danceability')], dtype=bool)
+        columns = [column_of(songs, feature, 0, 0).astype(np.float64)[keep] for feature in SONG_AUDIO_FEATURES]
+        columns.append(column_of(songs, 'popularity', 0, 0).astype(np.float64)[keep] / 100.0)  # Normalize popularity
+        columns.append(column_of(songs, 'duration_ms', 0, 0).astype(np.float64)[keep] / 1000000.0)
+        features = np.column_stack(columns) if keep.any() else np.zeros((0, len(columns)))
+        return column_of(songs, 'id')[keep], features
+    
     def prepare_features(self, songs_data):
         """Chuẩn bị features cho model"""
-        features = []
-        
-        for song in songs_data:
-            if song.get('danceability') is not None:
-                feature_vector = [
-                    song.get('danceability', 0),
-                    song.get('energy', 0),
-                    song.get('key', 0),
-                    song.get('loudness', 0),
-                    song.get('mode', 0),
-                    song.get('speechiness', 0),
-                    song.get('acousticness', 0),
-                    song.get('instrumentalness', 0),
-                    song.get('liveness', 0),
-                    song.get('valence', 0),
-                    song.get('tempo', 0),
-                    song.get('popularity', 0) / 100.0,  # Normalize popularity
-                    song.get('duration_ms', 0) / 1000000.0  # Convert to minutes
-                ]
-                features.append(feature_vector)
-        
-        return np.array(features)
+        return self.song_features(songs_data)[1]
     
-    def train(self, songs_data):
-        """Train model để tạo embedding"""
-        print("Chuẩn bị dữ liệu...")
-        features = self.prepare_features(songs_data)
-        
-        if len(features) == 0:
-            print("Không có dữ liệu hợp lệ để train")
-            return
-        
-        print(f"Shape của features: {features.shape}")
-        
-        # Chuẩn hóa dữ liệu
-        features_scaled = self.scaler.fit_transform(features)
-        
-        # Giảm chiều dữ liệu
-        features_pca = self.pca.fit_transform(features_scaled)
-        
-        # Tạo model
-        self.model = self.create_model(features_pca.shape[1])
-        
-        print("Bắt đầu training...")
-        self.model.fit(
-            features_pca, features_pca,
-            epochs=Config.EPOCHS,
-            batch_size=Config.BATCH_SIZE,
-            validation_split=0.2,
-            verbose=1
-        )
+    def _chunks(self, songs_data=None, catalog_file=None):
+        """Các lô (ids, features) từ songs_data trong RAM, hoặc đọc dần từ file catalog JSON"""
+        size = Config.EMBEDDING_BATCH_SIZE
+        if catalog_file:
+            batches = iter_catalog_file(catalog_file, size)
+        else:
+            batches = (songs_data[start:start + size] for start in range(0, len(songs_data), size))
+        for batch in batches:
+            ids, features = self.song_features(batch)
+            if len(ids):
+                yield ids, features
+    
+    def _project(self, features):
+        """Chuẩn hóa + PCA, thêm cột 0 nếu ít feature hơn Config.EMBEDDING_DIM (embedding luôn đủ EMBEDDING_DIM chiều)"""
+        t = self.transform
+        projected = ((features - t['scaler_mean']) / t['scaler_scale'] - t['pca_mean']) @ t['pca_components'].T
+        missing = Config.EMBEDDING_DIM - projected.shape[1]
+        return np.pad(projected, ((0, 0), (0, missing))) if missing > 0 else projected
+    
+    def _dataset(self, matrix, start, end, shuffle=False):
+        """tf.data.Dataset các batch (x, x) đọc từ ma trận mmap theo khối, không load cả ma trận vào RAM
+        
+        Shuffle theo 2 mức: thứ tự các khối Config.EMBEDDING_BATCH_SIZE hàng, rồi các hàng trong khối.
+        """
+        import tensorflow as tf
+        block = Config.EMBEDDING_BATCH_SIZE
+        
+        def generate():
+            starts = np.arange(start, end, block)
+            if shuffle:
+                np.random.shuffle(starts)
+            for block_start in starts:
+                x = np.asarray(matrix[block_start:min(block_start + block, end)])
+                if shuffle:
+                    x = x[np.random.permutation(len(x))]
+                for i in range(0, len(x), Config.BATCH_SIZE):
+                    yield x[i:i + Config.BATCH_SIZE], x[i:i + Config.BATCH_SIZE]
+        
+        spec = tf.TensorSpec(shape=(None, matrix.shape[1]), dtype=tf.float32)
+        return tf.data.Dataset.from_generator(generate, output_signature=(spec, spec)).prefetch(2)
+    
+    def train(self, songs_data=None, catalog_file=None):
+        """Train model để tạo embedding rồi ghi embeddings vào Config.EMBEDDING_STORE_FILE
         
-        # Tạo embeddings
-        embeddings = self.model.predict(features_pca)
+        Dữ liệu lấy từ songs_data, hoặc đọc dần từ catalog_file (catalog lớn hơn RAM): scaler và
+        IncrementalPCA fit theo từng lô, feature sau PCA được ghi tạm ra file mmap để train và predict
+        theo lô. RAM chỉ cần giữ khoảng 1 lô Config.EMBEDDING_BATCH_SIZE bài.
+        """
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.decomposition import IncrementalPCA
         
-        # Lưu embeddings
-        self.save_embeddings(songs_data, embeddings)
+        def chunks():
+            return self._chunks(songs_data, catalog_file)
         
-        return embeddings
+        print("Chuẩn bị dữ liệu...")
+        self.scaler = StandardScaler()
+        for _, features in chunks():
+            self.scaler.partial_fit(features)
+        count = int(getattr(self.scaler, 'n_samples_seen_', 0))
+        if count == 0:
+            print("Không có dữ liệu hợp lệ để train")
+            return None
+        
+        print(f"Shape của features: ({count}, {self.scaler.n_features_in_})")
+        
+        # Giảm chiều dữ liệu (không thể nhiều chiều hơn số feature: phần thiếu được thêm cột 0 trong _project)
+        self.pca = IncrementalPCA(n_components=min(Config.EMBEDDING_DIM, self.scaler.n_features_in_, count))
+        for features in _rebatch((self.scaler.transform(features) for _, features in chunks()), self.pca.n_components):
+            self.pca.partial_fit(features)
+        self.transform = {
+            'scaler_mean': self.scaler.mean_, 'scaler_scale': self.scaler.scale_,
+            'pca_mean': self.pca.mean_, 'pca_components': self.pca.components_,
+        }
+        
+        with tempfile.TemporaryDirectory() as scratch:
+            projected = np.lib.format.open_memmap(os.path.join(scratch, 'features.npy'), mode='w+',
+                                                  dtype=np.float32, shape=(count, Config.EMBEDDING_DIM))
+            ids_path = os.path.join(scratch, 'ids.txt')
+            row = 0
+            with open(ids_path, 'w', encoding='utf-8') as ids_file:
+                for ids, features in chunks():
+                    if row + len(ids) > count:
+                        raise RuntimeError("Catalog thay đổi trong lúc training embeddings")
+                    projected[row:row + len(ids)] = self._project(features)
+                    ids_file.write(''.join(f"{song_id}\n" for song_id in ids))
+                    row += len(ids)
+            projected.flush()
+            
+            # Tạo model
+            self.model = self.create_model(Config.EMBEDDING_DIM)
+            
+            print("Bắt đầu training...")
+            split = max(1, int(row * 0.8))  # 20% cuối làm validation như validation_split=0.2
+            self.model.fit(
+                self._dataset(projected, 0, split, shuffle=True),
+                validation_data=self._dataset(projected, split, row) if split < row else None,
+                epochs=Config.EPOCHS,
+                verbose=1
+            )
+            
+            # Tạo embeddings theo lô, ghi thẳng vào store
+            store = EmbeddingStore(Config.EMBEDDING_STORE_FILE)
+            with open(ids_path, 'r', encoding='utf-8') as ids_file, store.writer(Config.EMBEDDING_DIM) as writer:
+                for start in range(0, row, Config.EMBEDDING_BATCH_SIZE):
+                    block = np.asarray(projected[start:min(start + Config.EMBEDDING_BATCH_SIZE, row)])
+                    ids = [next(ids_file).rstrip('\n') for _ in range(len(block))]
+                    writer.write(ids, self.model.predict(block, batch_size=Config.BATCH_SIZE * 8, verbose=0))
+        
+        self.save(store)
+        print(f"Đã lưu {writer.count} embeddings vào {store.path}")
+        return store
+    
+    def save(self, store):
+        """Lưu weights và scaler/PCA cùng store để update() embed được bài hát mới mà không train lại"""
+        os.makedirs(os.path.dirname(Config.EMBEDDING_MODEL_FILE) or '.', exist_ok=True)
+        self.model.save_weights(Config.EMBEDDING_MODEL_FILE)
+        store.save_transform('autoencoder', **self.transform)
     
-    def save_embeddings(self, songs_data, embeddings):
-        """Lưu embeddings vào file"""
-        with open(Config.EMBEDDING_FILE, 'w', encoding='utf-8') as f:
-            f.write(f"# embedding: {' '.join([str(x) for x in range(Config.EMBEDDING_DIM)])}\n")
-            for i, song in enumerate(songs_data):
-                if song.get('danceability') is not None:
-                    embedding_str = ' '.join([str(x) for x in embeddings[i]])
-                    f.write(f"{song['id']} {embedding_str}\n")
-        
-        print(f"Đã lưu embeddings vào {Config.EMBEDDING_FILE}")
+    def load(self, store):
+        """Load weights + scaler/PCA đã lưu bằng save(); False nếu store không do model này tạo"""
+        transform = store.load_transform()
+        if transform is None or transform.pop('kind') != 'autoencoder' or not os.path.exists(Config.EMBEDDING_MODEL_FILE):
+            return False
+        self.transform = transform
+        self.model = self.create_model(Config.EMBEDDING_DIM)
+        self.model.load_weights(Config.EMBEDDING_MODEL_FILE)
+        return True
+    
+    def update(self, store, songs_data=None, catalog_file=None):
+        """Embed các bài hát chưa có trong store bằng model đã train rồi ghi nối vào store, trả về số bài mới"""
+        if self.transform is None and not self.load(store):
+            raise RuntimeError(f"{store.path} không có model embedding đã lưu, cần train() trước")
+        known = set(store.ids())
+        added = 0
+        with store.writer(Config.EMBEDDING_DIM, append=True) as writer:
+            for ids, features in self._chunks(songs_data, catalog_file):
+                new = np.array([song_id not in known for song_id in ids], dtype=bool)
+                if new.any():
+                    embeddings = self.model.predict(self._project(features[new]), batch_size=Config.BATCH_SIZE * 8, verbose=0)
+                    writer.write(ids[new], embeddings)
+                    known.update(ids[new])
+                    added += int(new.sum())
+        return added
 
 class DQNModel:
     def __init__(self, state_size, action_size):
@@ -122,6 +265,8 @@ class DQNModel:
     
     def _build_model(self):
         """Xây dựng DQN model"""
+        keras = _keras()
+        layers = keras.layers
         model = keras.Sequential([
             layers.Dense(256, activation='relu', input_shape=(self.state_size,)),
             layers.Dropout(0.2),
@@ -146,12 +291,14 @@ class DQNModel:
         """Lưu experience vào memory"""
         self.memory.append((state, action, reward, next_state, done))
     
-    def act(self, state, available_actions):
-        """Chọn action dựa trên epsilon-greedy policy"""
-        if np.random.random() <= self.epsilon:
+    def act(self, state, available_actions, explore=True):
+        """Chọn action dựa trên epsilon-greedy policy (explore=False: luôn chọn action có Q lớn nhất)"""
+        if explore and np.random.random() <= self.epsilon:
             return np.random.choice(available_actions)
         
         act_values = self.model.predict(state.reshape(1, -1), verbose=0)
+        METRICS.observe('dqn_inference_batch_size', 1, buckets=BATCH_SIZE_BUCKETS,
+                        help_text="Số state mỗi lần gọi Q-network", source='act')
         # Chỉ xem xét các action có sẵn
         masked_values = np.full(self.action_size, -np.inf)
         masked_values[available_actions] = act_values[0][available_actions]
@@ -177,6 +324,10 @@ class DQNModel:
         
         target = self.model.predict(states, verbose=0)
         next_target = self.target_model.predict(next_states, verbose=0)
+        METRICS.observe('dqn_inference_batch_size', batch_size, buckets=BATCH_SIZE_BUCKETS,
+                        help_text="Số state mỗi lần gọi Q-network", source='replay')
+        METRICS.observe('dqn_inference_batch_size', batch_size, buckets=BATCH_SIZE_BUCKETS,
+                        help_text="Số state mỗi lần gọi Q-network", source='replay_target')
         
         for i in range(batch_size):
             if dones[i]:
@@ -204,35 +355,42 @@ class DQNModel:
         self.model.save_weights(name)
 
 class PlaylistEnvironment:
-    def __init__(self, songs_data, embeddings):
+    def __init__(self, songs_data, embeddings, similarity=None):
         self.songs_data = songs_data
         self.embeddings = embeddings
         self.song_id_to_idx = {song['id']: i for i, song in enumerate(songs_data)}
         self.idx_to_song_id = {i: song['id'] for i, song in enumerate(songs_data)}
         
-        # Không tạo similarity matrix để tiết kiệm RAM
-        # Sẽ tính similarity on-demand
+        # Không tạo similarity matrix (n x n) để tiết kiệm RAM
+        # Chỉ giữ ma trận embedding (n x dim) và tính similarity on-demand;
+        # có thể truyền index dựng sẵn (ví dụ từ shared store) để không copy thêm ma trận
+        self.similarity = similarity if similarity is not None else SimilarityIndex.from_embeddings(
+            embeddings, [song['id'] for song in songs_data], normalize=False
+        )
         print(f"Environment created with {len(songs_data)} songs")
         
         self.reset()
     
+    def session(self):
+        """Bản sao nông cho 1 lần tạo playlist: dùng chung catalog, embeddings và similarity index
+        (chỉ đọc) nhưng có current_playlist / available_songs riêng, nên nhiều request chạy song song
+        không ghi đè trạng thái của nhau"""
+        env = copy.copy(self)
+        env.current_playlist = []
+        env.available_songs = []
+        return env
+    
     def _compute_similarity(self, idx1, idx2):
         """Tính similarity giữa 2 bài hát on-demand"""
-        # Chuyển index thành song_id
-        song_id1 = self.idx_to_song_id.get(idx1)
-        song_id2 = self.idx_to_song_id.get(idx2)
-        
-        if song_id1 in self.embeddings and song_id2 in self.embeddings:
-            embedding1 = np.array(self.embeddings[song_id1])
-            embedding2 = np.array(self.embeddings[song_id2])
-            return np.dot(embedding1, embedding2)
-        return 0.0
+        # Bài hát không có embedding có vector 0 nên similarity = 0
+        return self.similarity.pair(idx1, idx2)
     
-    def reset(self):
-        """Reset environment"""
+    def reset(self, rng=None):
+        """Reset environment (rng: bộ sinh số ngẫu nhiên để chọn bài đầu, mặc định np.random)"""
+        rng = rng if rng is not None else np.random
         self.current_playlist = []
         self.available_songs = list(range(len(self.songs_data)))
-        self.current_song_idx = np.random.choice(self.available_songs)
+        self.current_song_idx = int(rng.choice(self.available_songs))
         self.current_playlist.append(self.current_song_idx)
         self.available_songs.remove(self.current_song_idx)
         
@@ -277,7 +435,7 @@ class PlaylistEnvironment:
         if len(self.current_playlist) < 2:
             reward = np.random.uniform(0, 2)  # Random reward cho bài hát đầu tiên
             if len(self.current_playlist) == 1:  # Log cho episode đầu tiên
-                print(f"      Reward cho bài hát đầu: {reward:.2f}")
+                logger.debug("      Reward cho bài hát đầu: %.2f", reward)
             return reward
         
         # Tính độ tương đồng với bài hát cuối cùng trong playlist
@@ -295,8 +453,7 @@ class PlaylistEnvironment:
         diversity_bonus = 0
         if len(self.current_playlist) > 3:
             recent_songs = self.current_playlist[-4:-1]
-            similarities = [self._compute_similarity(recent_songs[i], new_song_idx) 
-                           for i in range(len(recent_songs))]
+            similarities = self.similarity.to_many(recent_songs, new_song_idx)
             avg_similarity = np.mean(similarities)
             diversity_bonus = (1 - avg_similarity) * 3
             base_reward += diversity_bonus
@@ -314,7 +471,9 @@ class PlaylistEnvironment:
         
         # Log chi tiết cho episode đầu tiên
         if len(self.current_playlist) <= 5:  # Chỉ log 5 steps đầu
-            print(f"      Step {len(self.current_playlist)}: similarity={similarity:.3f}, base={base_reward:.2f}, diversity={diversity_bonus:.2f}, length={length_bonus:.2f}, noise={noise:.2f}, final={final_reward:.2f}")
+            logger.debug("      Step %d: similarity=%.3f, base=%.2f, diversity=%.2f, length=%.2f, noise=%.2f, final=%.2f",
+                         len(self.current_playlist), similarity, base_reward, diversity_bonus,
+                         length_bonus, noise, final_reward)
         
         return final_reward
     
@@ -0,0 +1,308 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from config import Config
+from embedding_store import EmbeddingStore
+from instrumentation import METRICS, BATCH_SIZE_BUCKETS
+
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0),
+    'linear': lambda x: x,
+    'tanh': np.tanh,
+}
+
+def numpy_weights_path(model_path):
+    """File .npz tương ứng với file weights Keras (models/dqn_model.h5 -> models/dqn_model.npz)"""
+    for suffix in ('.weights.h5', '.h5'):
+        if model_path.endswith(suffix):
+            return model_path[:-len(suffix)] + '.npz'
+    return model_path + '.npz'
+
+def quantized_weights_path(model_path, mode):
+    """File .npz đã lượng tử hóa (models/dqn_model.h5, int8 -> models/dqn_model.int8.npz)"""
+    return numpy_weights_path(model_path)[:-len('.npz')] + f".{mode}.npz"
+
+def _save_npz(path, arrays):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # np.savez tự thêm đuôi .npz nên ghi qua file object để giữ đúng tên file tạm
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+def export_npz(keras_model, path):
+    """Ghi weights các lớp Dense của Keras model ra file .npz (Dropout bị bỏ qua vì chỉ có tác dụng khi train)"""
+    arrays = {}
+    activations = []
+    for layer in keras_model.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue
+        kernel, bias = weights
+        arrays[f"kernel_{len(activations)}"] = kernel
+        arrays[f"bias_{len(activations)}"] = bias
+        activations.append(layer.get_config().get('activation', 'linear'))
+    arrays['activations'] = np.array(activations)
+    return _save_npz(path, arrays)
+
+def quantize_kernel(kernel, mode):
+    """(kernel đã lượng tử hóa, scale theo từng output channel hoặc None)
+
+    int8: lượng tử hóa đối xứng, mỗi cột (1 action ở lớp cuối) có 1 scale = max|w| / 127;
+    float16: chỉ ép kiểu.
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)
+    if mode == 'float16':
+        return kernel.astype(np.float16), None
+    if mode == 'int8':
+        scale = np.abs(kernel).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        quantized = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+        return quantized, scale.astype(np.float32)
+    raise ValueError(f"Không hỗ trợ lượng tử hóa '{mode}' (chỉ int8 / float16)")
+
+def quantize_npz(src_path, dst_path, mode):
+    """Ghi bản lượng tử hóa của file .npz float32 (bias giữ float32 vì rất nhỏ)"""
+    with np.load(src_path) as data:
+        arrays = {name: data[name] for name in data.files}
+    for i in range(len(arrays['activations'])):
+        arrays[f"kernel_{i}"], scale = quantize_kernel(arrays[f"kernel_{i}"], mode)
+        if scale is not None:
+            arrays[f"scale_{i}"] = scale
+    arrays['quantization'] = np.array(mode)
+    return _save_npz(dst_path, arrays)
+
+class NumpyDQN:
+    """Q-network của DQNModel chạy bằng NumPy để phục vụ tạo playlist không cần TensorFlow.
+
+    Chỉ hỗ trợ inference (act / predict), cùng chính sách epsilon-greedy với DQNModel.act;
+    training vẫn dùng DQNModel.
+    """
+
+    def __init__(self, kernels, biases, activations, scales=None, dequantize=True):
+        """Kernel int8 / float16 (kèm scales) được đưa về float32 nếu dequantize=True (nhanh nhất với BLAS);
+        dequantize=False giữ nguyên trong bộ nhớ (nhỏ hơn 2-4 lần, mỗi lần gọi chậm hơn)"""
+        scales = scales or [None] * len(kernels)
+        if dequantize:
+            kernels = [np.asarray(k, dtype=np.float32) * (1 if sc is None else sc) for k, sc in zip(kernels, scales)]
+            scales = [None] * len(kernels)
+        self.kernels = [np.asarray(k) for k in kernels]
+        self.scales = scales
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activations = [ACTIVATIONS[name] for name in activations]
+        self.activation_names = list(activations)
+        self.state_size = self.kernels[0].shape[0]
+        self.action_size = self.kernels[-1].shape[1]
+        self.epsilon = Config.EPSILON_START  # Giống DQNModel vừa load weights
+
+    @classmethod
+    def load(cls, path, dequantize=True):
+        with np.load(path) as data:
+            activations = [str(name) for name in data['activations']]
+            kernels = [data[f"kernel_{i}"] for i in range(len(activations))]
+            biases = [data[f"bias_{i}"] for i in range(len(activations))]
+            scales = [data[f"scale_{i}"] if f"scale_{i}" in data.files else None for i in range(len(activations))]
+        return cls(kernels, biases, activations, scales=scales, dequantize=dequantize)
+
+    @property
+    def nbytes(self):
+        """Kích thước weights trong bộ nhớ"""
+        arrays = self.kernels + self.biases + [sc for sc in self.scales if sc is not None]
+        return sum(a.nbytes for a in arrays)
+
+    def predict(self, states):
+        """Q-value cho batch state, shape (batch, action_size)"""
+        x = np.asarray(states, dtype=np.float32).reshape(-1, self.state_size)
+        for kernel, scale, bias, activation in zip(self.kernels, self.scales, self.biases, self.activations):
+            # Kernel int8 / float16 được numpy nâng lên float32 khi nhân; scale theo từng output channel
+            y = x @ kernel
+            if scale is not None:
+                y *= scale
+            x = activation(y + bias)
+        return x
+
+    def act(self, state, available_actions, explore=True):
+        """Chọn action dựa trên epsilon-greedy policy (explore=False: luôn chọn action có Q lớn nhất)"""
+        if explore and np.random.random() <= self.epsilon:
+            return np.random.choice(available_actions)
+
+        act_values = self.predict(state)
+        METRICS.observe('dqn_inference_batch_size', 1, buckets=BATCH_SIZE_BUCKETS,
+                        help_text="Số state mỗi lần gọi Q-network", source='act')
+        # Chỉ xem xét các action có sẵn
+        masked_values = np.full(self.action_size, -np.inf)
+        masked_values[available_actions] = act_values[0][available_actions]
+        return np.argmax(masked_values)
+
+def load_keras_dqn(model_path, action_size):
+    """DQNModel (Keras) đã load weights, import TensorFlow lúc gọi"""
+    from models import DQNModel
+    model = DQNModel(Config.EMBEDDING_DIM, action_size)
+    model.load(model_path)
+    return model
+
+def load_serving_dqn(model_path, action_size, backend=None):
+    """Model dùng để tạo playlist theo Config.DQN_INFERENCE_BACKEND.
+
+    'auto': NumpyDQN nếu file .npz cạnh model_path có sẵn và không cũ hơn file weights, không thì Keras;
+    'numpy': luôn NumpyDQN (xuất .npz từ weights Keras nếu chưa có); 'keras': luôn DQNModel.
+    """
+    backend = backend or Config.DQN_INFERENCE_BACKEND
+    npz_path = numpy_weights_path(model_path)
+
+    if backend != 'keras' and os.path.exists(npz_path):
+        fresh = not os.path.exists(model_path) or os.path.getmtime(npz_path) >= os.path.getmtime(model_path)
+        if backend == 'numpy' or fresh:
+            model = _load_numpy_dqn(npz_path, model_path)
+            if model.state_size != Config.EMBEDDING_DIM or model.action_size != action_size:
+                raise ValueError(f"{npz_path} có shape ({model.state_size}, {model.action_size}), "
+                                 f"cần ({Config.EMBEDDING_DIM}, {action_size})")
+            return model
+
+    keras_model = load_keras_dqn(model_path, action_size)
+    if backend == 'numpy':
+        export_npz(keras_model.model, npz_path)
+        return _load_numpy_dqn(npz_path, model_path)
+    return keras_model
+
+def _load_numpy_dqn(npz_path, model_path):
+    """NumpyDQN từ file float32, hoặc từ bản lượng tử hóa theo Config.DQN_QUANTIZATION (tạo nếu chưa có / cũ)"""
+    mode = Config.DQN_QUANTIZATION
+    if not mode:
+        return NumpyDQN.load(npz_path)
+    quantized_path = quantized_weights_path(model_path, mode)
+    if not os.path.exists(quantized_path) or os.path.getmtime(quantized_path) < os.path.getmtime(npz_path):
+        quantize_npz(npz_path, quantized_path, mode)
+    return NumpyDQN.load(quantized_path, dequantize=Config.DQN_DEQUANTIZE_ON_LOAD)
+
+def check_parity(keras_model, numpy_model, samples=1000, seed=0):
+    """So sánh Q-value của 2 backend trên state ngẫu nhiên: (sai lệch tuyệt đối lớn nhất, tỉ lệ argmax trùng)"""
+    rng = np.random.default_rng(seed)
+    states = rng.normal(size=(samples, numpy_model.state_size)).astype(np.float32)
+    expected = keras_model.model.predict(states, verbose=0)
+    actual = numpy_model.predict(states)
+    max_abs_diff = float(np.max(np.abs(expected - actual)))
+    argmax_match = float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+    return max_abs_diff, argmax_match
+
+def default_embedding_file():
+    """Nguồn embeddings mới nhất giống PlaylistGenerator: file text Config.EMBEDDING_FILE hoặc
+    store nhị phân Config.EMBEDDING_STORE_FILE (None nếu chưa có)"""
+    candidates = {Config.EMBEDDING_FILE: Config.EMBEDDING_FILE,
+                  EmbeddingStore(Config.EMBEDDING_STORE_FILE).meta_path: Config.EMBEDDING_STORE_FILE}
+    existing = [path for path in candidates if os.path.exists(path)]
+    return candidates[max(existing, key=os.path.getmtime)] if existing else None
+
+def sample_states(samples, state_size, embedding_file=None, seed=0):
+    """State giống environment (trung bình embedding của 1-20 bài ngẫu nhiên) nếu có embeddings
+    (file text hoặc EmbeddingStore), không thì vector chuẩn ngẫu nhiên"""
+    rng = np.random.default_rng(seed)
+    rows = None
+    if embedding_file and EmbeddingStore(embedding_file).exists():
+        rows = np.asarray(EmbeddingStore(embedding_file).read()[1][:, :state_size])
+    elif embedding_file and os.path.exists(embedding_file):
+        rows = np.loadtxt(embedding_file, skiprows=1, usecols=range(1, state_size + 1), dtype=np.float32, ndmin=2)
+    if rows is not None and len(rows):
+        return np.stack([rows[rng.choice(len(rows), size=rng.integers(1, 21))].mean(axis=0) for _ in range(samples)])
+    print(f"⚠️ Không có embeddings ({embedding_file}), dùng state ngẫu nhiên")
+    return rng.normal(size=(samples, state_size)).astype(np.float32)
+
+def measure_drift(reference, candidate, states, k=10):
+    """Độ lệch chất lượng của candidate so với reference trên cùng các state:
+    tỉ lệ top-1 trùng, độ trùng trung bình của top-k và sai lệch Q-value lớn nhất (k tối đa bằng số action)"""
+    expected = reference.predict(states)
+    actual = candidate.predict(states)
+    k = min(k, expected.shape[1])
+    top_expected = np.argpartition(-expected, k - 1, axis=1)[:, :k]
+    top_actual = np.argpartition(-actual, k - 1, axis=1)[:, :k]
+    overlap = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(top_expected, top_actual)])
+    return {
+        'top1_agreement': float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1))),
+        f'top{k}_overlap': float(overlap),
+        'max_abs_diff': float(np.max(np.abs(expected - actual))),
+    }
+
+def _time_act(model, state, repeats=200):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(state)
+    return (time.perf_counter() - start) / repeats
+
+def drift_report(npz_path, modes=('float16', 'int8'), samples=1000, k=10, embedding_file=None):
+    """In bảng so sánh các chế độ lượng tử hóa với bản float32 (kích thước, độ trễ batch 1, độ lệch top-k)"""
+    reference = NumpyDQN.load(npz_path)
+    k = min(k, reference.action_size)
+    states = sample_states(samples, reference.state_size, embedding_file)
+    print(f"{'mode':<18} {'MB':>8} {'act ms':>8} {'top1':>7} {f'top{k}':>7} {'max |dQ|':>10}")
+    print(f"{'float32':<18} {reference.nbytes / 1e6:>8.2f} {_time_act(reference, states[0]) * 1e3:>8.3f} "
+          f"{1:>7.2%} {1:>7.2%} {0:>10.2e}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in modes:
+            quantized_path = quantize_npz(npz_path, os.path.join(tmp_dir, f"{mode}.npz"), mode)
+            for dequantize in (True, False):
+                model = NumpyDQN.load(quantized_path, dequantize=dequantize)
+                drift = measure_drift(reference, model, states, k=k)
+                label = f"{mode}{'' if dequantize else ' (giữ nguyên)'}"
+                print(f"{label:<18} {model.nbytes / 1e6:>8.2f} {_time_act(model, states[0]) * 1e3:>8.3f} "
+                      f"{drift['top1_agreement']:>7.2%} {drift[f'top{k}_overlap']:>7.2%} {drift['max_abs_diff']:>10.2e}")
+            print(f"{'':<18} file {os.path.getsize(quantized_path) / 1e6:.2f} MB "
+                  f"(float32: {os.path.getsize(npz_path) / 1e6:.2f} MB)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất DQN weights sang .npz và kiểm tra inference NumPy khớp Keras")
+    parser.add_argument('command', choices=['export', 'check', 'quantize', 'drift'],
+                        help="export/check: xuất .npz và so với Keras; quantize: ghi bản int8/float16; "
+                             "drift: so các chế độ lượng tử hóa với float32")
+    parser.add_argument('--model', default=Config.DQN_MODEL_FILE, help="File weights Keras")
+    parser.add_argument('--npz', default=None, help="File .npz (mặc định: cạnh file weights)")
+    parser.add_argument('--actions', type=int, default=None,
+                        help="Số action (= số bài hát trong catalog đã train); mặc định lấy từ file .npz")
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--tolerance', type=float, default=1e-4, help="Sai lệch Q-value tối đa cho phép")
+    parser.add_argument('--mode', choices=['int8', 'float16'], default='int8', help="Kiểu lượng tử hóa (quantize)")
+    parser.add_argument('--top-k', type=int, default=10, help="k khi đo độ trùng top-k (drift)")
+    parser.add_argument('--embeddings', default=None,
+                        help="File embeddings text hoặc EmbeddingStore để tạo state thực tế (drift); mặc định nguồn "
+                             "mới nhất như PlaylistGenerator, không có thì dùng state ngẫu nhiên")
+    args = parser.parse_args()
+
+    npz_path = args.npz or numpy_weights_path(args.model)
+
+    # 2 lệnh này chỉ đọc file .npz, không cần TensorFlow
+    if args.command == 'quantize':
+        output = quantize_npz(npz_path, quantized_weights_path(args.model, args.mode), args.mode)
+        print(f"Đã ghi {output} ({os.path.getsize(output) / 1e6:.2f} MB, "
+              f"float32: {os.path.getsize(npz_path) / 1e6:.2f} MB)")
+        return
+    if args.command == 'drift':
+        drift_report(npz_path, samples=args.samples, k=args.top_k,
+                     embedding_file=args.embeddings or default_embedding_file())
+        return
+
+    actions = args.actions
+    if actions is None:
+        if not os.path.exists(npz_path):
+            parser.error("cần --actions khi chưa có file .npz")
+        actions = NumpyDQN.load(npz_path).action_size
+    keras_model = load_keras_dqn(args.model, actions)
+
+    if args.command == 'export':
+        export_npz(keras_model.model, npz_path)
+        print(f"Đã xuất {args.model} -> {npz_path}")
+
+    numpy_model = NumpyDQN.load(npz_path)
+    max_abs_diff, argmax_match = check_parity(keras_model, numpy_model, samples=args.samples)
+    print(f"Sai lệch Q-value lớn nhất: {max_abs_diff:.2e}, argmax trùng: {argmax_match:.2%}")
+    if max_abs_diff > args.tolerance:
+        print("❌ Inference NumPy không khớp Keras")
+        sys.exit(1)
+    print("✅ Inference NumPy khớp Keras")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from catalog import column_of
+from config import Config
+
+STORE_FORMAT = 1
+
+class SharedCatalogArrays:
+    """Ma trận embedding và các cột số của catalog, mmap read-only từ file .npy.
+
+    Dữ liệu nằm trong page cache của hệ điều hành nên mọi process (web worker, job training,
+    worker đánh giá) mở cùng 1 store chỉ dùng chung 1 bản, không copy vào bộ nhớ riêng.
+    Các mảng xếp theo đúng thứ tự songs_data đã dùng để build.
+    """
+
+    ARRAYS = ('embeddings', 'embedding_valid', 'popularity', 'year', 'year_valid')
+
+    def __init__(self, directory):
+        self.directory = directory
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r'))
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def embedding_dict(self, song_ids):
+        """{song_id: vector} với vector là view vào ma trận mmap (không copy)"""
+        return {song_id: self.embeddings[i] for i, song_id in enumerate(song_ids) if self.embedding_valid[i]}
+
+def store_key(songs_data, embedding_file):
+    """Key của store: đổi khi danh sách bài hát hoặc file embeddings thay đổi"""
+    digest = hashlib.sha1()
+    for song in songs_data:
+        digest.update(song['id'].encode('utf-8'))
+        digest.update(b'\0')
+    stat = os.stat(embedding_file)
+    digest.update(f"{stat.st_mtime_ns}:{stat.st_size}:{STORE_FORMAT}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def catalog_columns(songs_data):
+    """Cột số dùng cho constraints (giá trị mặc định giống PlaylistGenerator._apply_constraints)"""
+    popularity = column_of(songs_data, 'popularity', 0, 0).astype(np.float64)
+    year = np.zeros(len(songs_data), dtype=np.int64)
+    year_valid = np.zeros(len(songs_data), dtype=bool)
+    parsed = {}  # Nhiều bài trùng ngày phát hành: chỉ parse mỗi giá trị 1 lần
+    for i, release_date in enumerate(column_of(songs_data, 'release_date', '0')):
+        if release_date not in parsed:
+            try:
+                parsed[release_date] = int(release_date[:4])
+            except (TypeError, ValueError):
+                parsed[release_date] = None
+        if parsed[release_date] is not None:
+            year[i] = parsed[release_date]
+            year_valid[i] = True
+    return {'popularity': popularity, 'year': year, 'year_valid': year_valid}
+
+def _build(directory, songs_data, embeddings, dim):
+    """Ghi store vào thư mục tạm rồi đổi tên, để process khác không bao giờ mở phải store ghi dở"""
+    tmp_dir = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    matrix = np.zeros((len(songs_data), dim), dtype=np.float64)
+    valid = np.zeros(len(songs_data), dtype=bool)
+    for i, song in enumerate(songs_data):
+        vector = embeddings.get(song['id'])
+        if vector is not None:
+            matrix[i] = vector
+            valid[i] = True
+
+    arrays = {'embeddings': matrix, 'embedding_valid': valid}
+    arrays.update(catalog_columns(songs_data))
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'format': STORE_FORMAT, 'songs': len(songs_data), 'dim': dim,
+                   'embeddings': int(valid.sum())}, f)
+
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Process khác đã build xong cùng key
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _remove_stale(root, keep):
+    """Xóa store cũ (process đang mmap store cũ vẫn đọc được trên Linux/macOS; Windows bỏ qua lỗi)"""
+    for name in os.listdir(root):
+        if name != keep and '.tmp-' not in name:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def open_store(songs_data, embedding_file, load_embeddings, root=None):
+    """Mở store dùng chung cho (songs_data, embedding_file), build nếu chưa có.
+
+    load_embeddings() trả về dict {song_id: vector}; chỉ được gọi khi phải build store mới.
+    """
+    root = root or Config.SHARED_STORE_DIR
+    os.makedirs(root, exist_ok=True)
+    key = store_key(songs_data, embedding_file)
+    directory = os.path.join(root, key)
+
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        embeddings = load_embeddings()
+        dim = Config.EMBEDDING_DIM
+        for vector in embeddings.values():
+            dim = len(vector)
+            break
+        _build(directory, songs_data, embeddings, dim)
+        _remove_stale(root, key)
+        print(f"Đã tạo shared store {directory}")
+
+    return SharedCatalogArrays(directory)
@@ -0,0 +1,67 @@
+import numpy as np
+from config import Config
+
+class SimilarityIndex:
+    """Ma trận vector (feature hoặc embedding) được chuẩn hóa sẵn một lần để tính similarity nhanh"""
+
+    def __init__(self, matrix, normalize=True, valid=None):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if normalize:
+            # Vector 0 giữ nguyên là 0 (giống cosine_similarity của sklearn)
+            norms = np.linalg.norm(matrix, axis=1)
+            self.vectors = matrix / np.where(norms > 0, norms, 1.0)[:, None]
+        else:
+            self.vectors = matrix
+
+        # valid[i] = False nếu bài hát i không có vector (ví dụ thiếu embedding)
+        self.valid = np.ones(len(matrix), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+
+    @classmethod
+    def from_embeddings(cls, embeddings, song_ids, normalize=False):
+        """Tạo index từ dict embeddings {song_id: vector} theo thứ tự song_ids"""
+        dim = Config.EMBEDDING_DIM
+        for vector in embeddings.values():
+            dim = len(vector)
+            break
+
+        matrix = np.zeros((len(song_ids), dim), dtype=np.float64)
+        valid = np.zeros(len(song_ids), dtype=bool)
+        for i, song_id in enumerate(song_ids):
+            vector = embeddings.get(song_id)
+            if vector is not None:
+                matrix[i] = vector
+                valid[i] = True
+
+        return cls(matrix, normalize=normalize, valid=valid)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def pair(self, idx1, idx2):
+        """Similarity giữa 2 bài hát"""
+        return float(self.vectors[idx1] @ self.vectors[idx2])
+
+    def to_many(self, indices, idx):
+        """Similarity giữa bài hát idx và từng bài trong indices"""
+        return self.vectors[np.asarray(indices, dtype=np.intp)] @ self.vectors[idx]
+
+    def consecutive(self, playlists):
+        """Similarity của mọi cặp bài liên tiếp: playlist shape (L,) -> (L - 1,),
+        lô playlist cùng độ dài shape (m, L) -> (m, L - 1)"""
+        vectors = self.vectors[np.asarray(playlists, dtype=np.intp)]
+        return np.einsum('...ld,...ld->...l', vectors[..., :-1, :], vectors[..., 1:, :])
+
+    def window(self, playlist, window):
+        """Similarity giữa mỗi bài và `window` bài đứng trước nó, shape (len, window)
+
+        Cột k-1 là similarity với bài cách k vị trí; vị trí không có bài trước là NaN.
+        """
+        indices = np.asarray(playlist, dtype=np.intp)
+        vectors = self.vectors[indices]
+        gram = vectors @ vectors.T
+
+        positions = np.arange(len(indices))[:, None]
+        previous = positions - np.arange(1, window + 1)[None, :]
+        result = gram[positions, np.maximum(previous, 0)]
+        result[previous < 0] = np.nan
+        return result
@@ -6,6 +6,7 @@ import time
 import random
 from tqdm import tqdm
 from config import Config
+from response_cache import ResponseCache
 import logging
 
 # Cấu hình logging
@@ -13,7 +14,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 class SpotifyDataCollector:
-    def __init__(self):
+    def __init__(self, cache=None):
         self.sp = spotipy.Spotify(
             client_credentials_manager=SpotifyClientCredentials(
                 client_id=Config.SPOTIFY_CLIENT_ID,
@@ -22,14 +23,37 @@ class SpotifyDataCollector:
         )
         self.songs_data = []
         
+        # Cache phản hồi search để không gọi lại API cho các trang đã lấy
+        if cache is None and Config.SEARCH_CACHE_ENABLED:
+            cache = ResponseCache(
+                Config.SEARCH_CACHE_FILE,
+                ttl=Config.SEARCH_CACHE_TTL,
+                max_entries=Config.SEARCH_CACHE_MAX_ENTRIES
+            )
+        self.cache = cache
+        self.last_search_cached = False
+        
     def search_songs(self, query, limit=50, offset=0):
-        """Tìm kiếm bài hát với query"""
+        """Tìm kiếm bài hát với query (ưu tiên lấy từ cache)"""
+        self.last_search_cached = False
+        cache_key = ResponseCache.make_key(query, offset, limit)
+        
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.last_search_cached = True
+                return cached
+        
         try:
             results = self.sp.search(q=query, type='track', limit=limit, offset=offset)
-            return results['tracks']['items']
+            tracks = results['tracks']['items']
         except Exception as e:
             logger.error(f"Lỗi khi tìm kiếm '{query}': {e}")
             return []
+        
+        if self.cache is not None:
+            self.cache.set(cache_key, tracks)
+        return tracks
     
     def _extract_genre_from_query(self, query):
         """Extract genre từ search query"""
@@ -233,10 +257,14 @@ class SpotifyDataCollector:
                         logger.warning(f"Đã lặp qua tất cả queries 2 lần, chỉ thu thập được {collected_count} bài hát")
                         break
                 
-                # Rate limiting
-                time.sleep(0.5)
+                # Rate limiting (không cần chờ nếu kết quả lấy từ cache)
+                if not self.last_search_cached:
+                    time.sleep(0.5)
         
         logger.info(f"Đã thu thập {len(self.songs_data)} bài hát")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            logger.info(f"Search cache: {stats['hits']} hit, {stats['misses']} miss ({stats['hit_rate']:.1%})")
         return self.songs_data
     
     def save_data(self, filename='spotify_songs.json'):
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Sinh catalog bài hát tổng hợp (cùng schema với spotify_songs.json) và file embeddings
+tương ứng ở quy mô tùy ý, xác định hoàn toàn theo seed.
+Dùng cho benchmark / load test khi không thể thu thập dữ liệu thật từ Spotify.
+
+Ví dụ:
+    python synthetic_catalog.py --songs 100000 --seed 0 --audio-features \\
+        --output data/synthetic_songs.json --embeddings data/synthetic_embeddings.txt
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+from config import Config
+
+# Genre (đúng các nhãn của SpotifyDataCollector._extract_genre_from_query), tỉ lệ và query mẫu
+GENRE_MIX = {
+    'Vietnamese': (0.22, ["vietnamese pop", "v-pop", "nhạc trẻ việt nam", "bolero việt nam", "nhạc vàng"]),
+    'Pop': (0.24, ["pop hits", "indie pop", "taylor swift", "happy songs", "2010s hits"]),
+    'K-pop': (0.13, ["k-pop", "bts", "blackpink", "twice", "newjeans"]),
+    'Hip Hop': (0.10, ["hip hop hits", "drake", "kendrick lamar", "eminem", "travis scott"]),
+    'Electronic': (0.08, ["electronic hits", "house", "techno", "avicii", "alan walker"]),
+    'Rock': (0.07, ["rock hits", "soft rock", "classic rock", "hard rock", "punk rock"]),
+    'J-pop': (0.03, ["j-pop"]),
+    'R&B': (0.03, ["r&b hits"]),
+    'Country': (0.02, ["country hits"]),
+    'Jazz': (0.02, ["jazz hits"]),
+    'Classical': (0.015, ["classical hits"]),
+    'Folk': (0.015, ["folk hits"]),
+    'Reggae': (0.01, ["reggae hits"]),
+    'Blues': (0.01, ["blues hits"]),
+    'Metal': (0.01, ["metal hits"]),
+}
+
+# Tỉ lệ bài explicit theo genre (mặc định 0.08)
+EXPLICIT_RATE = {'Hip Hop': 0.6, 'R&B': 0.25, 'Metal': 0.2, 'Electronic': 0.12, 'Pop': 0.12}
+
+BASE62 = np.array(list("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"))
+
+WORDS = ["love", "night", "dream", "heart", "summer", "fire", "rain", "light", "home", "forever",
+         "em", "anh", "mưa", "yêu", "nhớ", "sky", "dance", "blue", "gold", "stay", "baby", "city",
+         "moon", "wild", "young", "lost", "star", "road", "ocean", "tonight"]
+
+def _ids(rng, n, length=22):
+    """ID dạng base62 22 ký tự giống Spotify track id"""
+    chars = BASE62[rng.integers(0, len(BASE62), size=(n, length))]
+    return [''.join(row) for row in chars]
+
+def _titles(rng, n, prefix):
+    """Tên ngẫu nhiên ghép từ 1-3 từ"""
+    words = np.array(WORDS)
+    counts = rng.integers(1, 4, size=n)
+    picks = words[rng.integers(0, len(words), size=(n, 3))]
+    return [f"{prefix} " + ' '.join(picks[i, :counts[i]]).title() for i in range(n)]
+
+def generate_catalog(n_songs, seed=0, audio_features=False):
+    """Sinh danh sách n_songs bài hát (list of dict) xác định theo seed"""
+    rng = np.random.default_rng(seed)
+
+    genre_names = list(GENRE_MIX)
+    weights = np.array([GENRE_MIX[g][0] for g in genre_names])
+    genre_idx = rng.choice(len(genre_names), size=n_songs, p=weights / weights.sum())
+
+    # Nghệ sĩ phân bố kiểu Zipf: vài nghệ sĩ rất nhiều bài, phần lớn ít bài
+    n_artists = max(1, n_songs // 8)
+    artist_weights = 1.0 / np.arange(1, n_artists + 1) ** 0.8
+    artist_idx = rng.choice(n_artists, size=n_songs, p=artist_weights / artist_weights.sum())
+    artist_names = _titles(rng, n_artists, "Artist")
+    album_idx = artist_idx * 4 + rng.integers(0, 4, size=n_songs)  # ~4 album mỗi nghệ sĩ
+
+    # Popularity lệch về 30-60, nhạc Việt/K-pop trong dữ liệu thật phổ biến hơn một chút
+    popularity = rng.beta(2.2, 2.8, size=n_songs) * 100
+    popularity += np.isin(genre_idx, [genre_names.index('Vietnamese'), genre_names.index('K-pop')]) * 5
+    popularity = np.clip(np.round(popularity), 0, 100).astype(int)
+
+    # Thời lượng log-normal quanh ~3.5 phút
+    duration_ms = np.clip(rng.lognormal(np.log(210000), 0.25, size=n_songs), 60000, 600000).astype(int)
+
+    # Năm phát hành lệch về gần đây; ~10% chỉ có năm
+    year = np.clip(2024 - np.round(rng.exponential(8, size=n_songs)), 1950, 2024).astype(int)
+    month = rng.integers(1, 13, size=n_songs)
+    day = rng.integers(1, 29, size=n_songs)
+    year_only = rng.random(n_songs) < 0.1
+
+    explicit_rate = np.array([EXPLICIT_RATE.get(g, 0.08) for g in genre_names])
+    explicit = rng.random(n_songs) < explicit_rate[genre_idx]
+
+    query_pick = rng.integers(0, 1000, size=n_songs)
+    ids = _ids(rng, n_songs)
+    names = _titles(rng, n_songs, "Song")
+
+    if audio_features:
+        audio = {
+            'danceability': rng.beta(5, 3, size=n_songs),
+            'energy': rng.beta(4, 3, size=n_songs),
+            'key': rng.integers(0, 12, size=n_songs),
+            'loudness': np.clip(rng.normal(-8, 3, size=n_songs), -40, 0),
+            'mode': rng.integers(0, 2, size=n_songs),
+            'speechiness': rng.beta(1.2, 12, size=n_songs),
+            'acousticness': rng.beta(1, 3, size=n_songs),
+            'instrumentalness': rng.beta(0.3, 5, size=n_songs),
+            'liveness': rng.beta(2, 10, size=n_songs),
+            'valence': rng.beta(3, 3, size=n_songs),
+            'tempo': np.clip(rng.normal(120, 25, size=n_songs), 50, 220),
+            'time_signature': rng.choice([3, 4, 5], size=n_songs, p=[0.08, 0.9, 0.02]),
+        }
+
+    songs = []
+    for i in range(n_songs):
+        genre = genre_names[genre_idx[i]]
+        queries = GENRE_MIX[genre][1]
+
+        song = {
+            'id': ids[i],
+            'name': names[i],
+            'artist': artist_names[artist_idx[i]],
+            'album': f"Album {album_idx[i]}",
+            'popularity': int(popularity[i]),
+            'duration_ms': int(duration_ms[i]),
+            'explicit': bool(explicit[i]),
+            'release_date': str(year[i]) if year_only[i] else f"{year[i]}-{month[i]:02d}-{day[i]:02d}",
+            'search_query': queries[query_pick[i] % len(queries)],
+            'genre': genre
+        }
+        if audio_features:
+            for key, values in audio.items():
+                value = values[i]
+                song[key] = int(value) if key in ('key', 'mode', 'time_signature') else round(float(value), 4)
+        songs.append(song)
+
+    return songs
+
+def generate_embeddings(songs, seed=0, dim=None, spread=0.35):
+    """Embedding (n_songs, dim): tâm cụm theo genre + nhiễu, để similarity có ý nghĩa"""
+    dim = dim or Config.EMBEDDING_DIM
+    rng = np.random.default_rng(seed + 1)
+
+    genre_names = list(GENRE_MIX)
+    centers = rng.normal(0, 1, size=(len(genre_names), dim))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    genre_lookup = {genre: i for i, genre in enumerate(genre_names)}
+    genre_idx = np.array([genre_lookup.get(song.get('genre'), 0) for song in songs])
+    return centers[genre_idx] + rng.normal(0, spread, size=(len(songs), dim))
+
+def write_catalog(songs, path):
+    """Ghi catalog ra file JSON (giống SpotifyDataCollector.save_data nhưng không indent)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(songs, f, ensure_ascii=False)
+
+def write_embeddings(songs, embeddings, path, chunk_size=10000):
+    """Ghi embeddings theo định dạng Config.EMBEDDING_FILE (header + 'song_id v1 ... vN')"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    dim = embeddings.shape[1]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"# embedding: {' '.join(str(x) for x in range(dim))}\n")
+        for start in range(0, len(songs), chunk_size):
+            block = embeddings[start:start + chunk_size]
+            lines = [
+                f"{songs[start + i]['id']} {' '.join(f'{x:.6f}' for x in row)}\n"
+                for i, row in enumerate(block)
+            ]
+            f.writelines(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh catalog bài hát tổng hợp cho load test")
+    parser.add_argument('--songs', type=int, default=10000, help="Số bài hát")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--audio-features', action='store_true', help="Thêm audio features (danceability, energy, ...)")
+    parser.add_argument('--output', default=os.path.join(Config.DATA_DIR, "synthetic_songs.json"))
+    parser.add_argument('--embeddings', default=os.path.join(Config.DATA_DIR, "synthetic_embeddings.txt"),
+                        help="File embeddings đầu ra (để trống để bỏ qua)")
+    args = parser.parse_args()
+
+    print(f"Sinh {args.songs:,} bài hát (seed={args.seed})...")
+    songs = generate_catalog(args.songs, seed=args.seed, audio_features=args.audio_features)
+    write_catalog(songs, args.output)
+    print(f"Đã lưu catalog vào {args.output}")
+
+    if args.embeddings:
+        embeddings = generate_embeddings(songs, seed=args.seed)
+        write_embeddings(songs, embeddings, args.embeddings)
+        print(f"Đã lưu embeddings {embeddings.shape} vào {args.embeddings}")
+
+if __name__ == "__main__":
+    main()
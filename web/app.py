@@ -1,87 +1,366 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, g, Response
 from flask_cors import CORS
 import json
 import os
 from datetime import datetime
 from playlist_generator import PlaylistGenerator
-from spotify_data_collector import SpotifyDataCollector
-from models import DQNModel, PlaylistEnvironment
+from models import PlaylistEnvironment
+from numpy_dqn import load_serving_dqn, numpy_weights_path, quantized_weights_path
 from config import Config
+from embedding_store import EmbeddingStore
+from catalog import contains_text
+from instrumentation import PROFILER, METRICS
+from log_buffer import LogBuffer
+from jobs import JobManager, catalog_fingerprint
+from reloader import FileWatcher
+from result_cache import ResultCache, make_playlist_key
+import logging
+import numpy as np
 import threading
 import time
 import subprocess
 import sys
 
+# Handler cho root logger (log từng bước của playlist_generator...); basicConfig bỏ qua nếu đã có handler
+logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logging.getLogger().setLevel(Config.LOG_LEVEL)
+
 app = Flask(__name__)
 app.secret_key = Config.FLASK_SECRET_KEY
 CORS(app)
 
 # Global variables
-generator = None
+generator = None  # Chỉ thay bằng 1 phép gán; route nên giữ tham chiếu cục bộ `gen = generator`
+generator_version = 0  # Tăng mỗi khi generator hoặc model đang phục vụ được thay
 data_collector = None
 is_training = False
 training_progress = 0
 is_collecting = False
 collecting_progress = 0
 collecting_message = ""
-training_logs = []  # Lưu log training
+training_message = ""
+training_logs = LogBuffer(Config.TRAINING_LOG_BUFFER_SIZE)  # Lưu log training (ring buffer)
+status_version = 0  # Tăng mỗi khi trạng thái thay đổi để /api/stream đẩy ngay
+reload_lock = threading.Lock()
+reload_state = {'state': 'idle', 'reason': None, 'started_at': None, 'finished_at': None, 'error': None}
+file_watcher = None
+model_loading = False  # True khi DQN đang được load ở thread nền lúc khởi động
+model_load_error = None
+playlist_cache = ResultCache(Config.PLAYLIST_CACHE_SIZE, Config.PLAYLIST_CACHE_TTL, name='playlist')
+sse_slots = threading.BoundedSemaphore(Config.SSE_MAX_CONNECTIONS)  # Mỗi kết nối /api/stream giữ 1 thread phục vụ
+
+def _catalog_size():
+    gen = generator
+    return len(gen.songs_data) if gen is not None else 0
+
+def _model_loaded():
+    gen = generator
+    return int(gen is not None and gen.dqn_model is not None)
+
+METRICS.gauge_callback('catalog_songs', _catalog_size, "Số bài hát trong catalog đang phục vụ")
+METRICS.gauge_callback('model_loaded', _model_loaded, "1 nếu đã load DQN model")
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    """Đếm request và latency theo route (dùng rule của Flask để tránh bùng nổ label)"""
+    start = g.pop('request_start', None)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    METRICS.inc('http_requests_total', help_text="Tổng số HTTP request",
+                route=route, method=request.method, status=response.status_code)
+    if start is not None:
+        METRICS.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        help_text="Latency HTTP request (giây)", route=route)
+    return response
 
 def add_training_log(message, log_type="INFO"):
     """Thêm log training với timestamp và phân loại"""
-    global training_logs
     timestamp = datetime.now().strftime("%H:%M:%S")
     log_entry = f"[{timestamp}] {message}"
-    training_logs.append(log_entry)
-    
-    # Giới hạn số lượng log để tránh quá tải
-    if len(training_logs) > 1000:
-        training_logs = training_logs[-500:]  # Giữ lại 500 log gần nhất
+    training_logs.append(log_entry)  # Buffer tự bỏ log cũ nhất khi đầy
     
     print(log_entry, flush=True)
 
-def initialize_generator():
-    """Khởi tạo generator nếu có dữ liệu sẵn"""
-    global generator
+def notify_status_change():
+    """Báo cho các client SSE rằng trạng thái đã thay đổi"""
+    global status_version
+    status_version += 1
+    training_logs.notify()
+
+def _load_generator(model_path=None):
+    """Tạo generator mới từ file dữ liệu / model hiện tại, không đụng tới generator đang phục vụ"""
+    model_path = model_path or Config.DQN_MODEL_FILE
+    new_generator = PlaylistGenerator()
+    if not new_generator.load_data():
+        return None
+    if os.path.exists(model_path):
+        new_generator.load_model(model_path)
+    return new_generator
+
+def _swap_generator(new_generator):
+    """Đưa generator mới vào phục vụ bằng 1 phép gán (request đang chạy vẫn dùng bản cũ)"""
+    global generator, generator_version
+    # Gán generator trước rồi mới tăng version: request đọc version trước generator nên không bao giờ
+    # cache kết quả của bản cũ dưới version mới
+    generator = new_generator
+    generator_version += 1
+    playlist_cache.clear()
+    if file_watcher is not None:
+        file_watcher.sync()
+
+def reload_generator(reason='manual'):
+    """Load lại dữ liệu, embeddings và model vào generator mới rồi thay vào phục vụ.
+    
+    Không chặn request: trong lúc load, generator cũ vẫn phục vụ bình thường.
+    Trả về False nếu đang có lần reload khác hoặc load thất bại.
+    """
+    if not reload_lock.acquire(blocking=False):
+        return False
+    
+    try:
+        reload_state.update({'state': 'loading', 'reason': reason, 'started_at': time.time(),
+                             'finished_at': None, 'error': None})
+        notify_status_change()
+        add_training_log(f"Đang reload dữ liệu và model ({reason})...")
+        
+        start = time.perf_counter()
+        new_generator = _load_generator()
+        if new_generator is None:
+            raise RuntimeError(f"Không load được dữ liệu từ {Config.PLAYLIST_DATA_FILE}")
+        _swap_generator(new_generator)
+        
+        reload_state.update({'state': 'idle', 'finished_at': time.time()})
+        add_training_log(f"Hoàn thành reload trong {time.perf_counter() - start:.1f}s: "
+                         f"{len(new_generator.songs_data)} bài hát, "
+                         f"{'đã có' if new_generator.dqn_model is not None else 'chưa có'} model")
+        return True
+    except Exception as e:
+        reload_state.update({'state': 'error', 'finished_at': time.time(), 'error': str(e)})
+        add_training_log(f"Lỗi khi reload: {e}")
+        return False
+    finally:
+        reload_lock.release()
+        notify_status_change()
+
+def start_reload_watcher(interval=None):
+    """Tự reload khi file dữ liệu / embeddings / model thay đổi (interval <= 0 để tắt)"""
+    global file_watcher
+    interval = Config.RELOAD_WATCH_INTERVAL if interval is None else interval
+    if interval <= 0 or file_watcher is not None:
+        return None
+    
+    def on_change(paths):
+        return reload_generator(reason=f"file thay đổi: {', '.join(os.path.basename(p) for p in paths)}")
+    
+    file_watcher = FileWatcher([Config.PLAYLIST_DATA_FILE, Config.EMBEDDING_FILE,
+                                EmbeddingStore(Config.EMBEDDING_STORE_FILE).meta_path, Config.DQN_MODEL_FILE],
+                               on_change, interval=interval)
+    file_watcher.start()
+    return file_watcher
+
+def _replace_model_files(model_path):
+    """Đưa weights vừa train (và file .npz đi kèm) vào Config.DQN_MODEL_FILE.
+    
+    Thay .npz trước để file watcher của worker khác thấy file weights đổi thì .npz đã sẵn sàng.
+    """
+    npz_path = numpy_weights_path(model_path)
+    if os.path.exists(npz_path):
+        os.replace(npz_path, numpy_weights_path(Config.DQN_MODEL_FILE))
+    os.replace(model_path, Config.DQN_MODEL_FILE)
+
+def _install_trained_model(result):
+    """Đưa model vừa train vào phục vụ mà không chặn request.
+    
+    Nếu model được train trên đúng catalog đang phục vụ thì chỉ thay dqn_model (1 phép gán,
+    request đang chạy vẫn dùng model cũ); nếu không thì load lại toàn bộ generator rồi thay.
+    """
+    global generator_version
+    gen = generator
+    
+    if gen is not None and gen.songs_data and catalog_fingerprint(gen.songs_data) == result['catalog']:
+        model = load_serving_dqn(result['model_path'], len(gen.songs_data))
+        _replace_model_files(result['model_path'])
+        if gen.environment is None:
+            gen.environment = PlaylistEnvironment(gen.songs_data, gen.embeddings)
+        gen.dqn_model = model
+        generator_version += 1
+        playlist_cache.clear()
+        if file_watcher is not None:
+            file_watcher.sync()
+        add_training_log("Model đã được lưu và đưa vào phục vụ")
+    else:
+        _replace_model_files(result['model_path'])
+        reload_generator(reason="model mới train trên catalog khác")
+
+def _on_job_event(job, event, payload):
+    """Cập nhật trạng thái / log từ job nền (chạy trên thread theo dõi job)"""
+    global is_training, training_progress, training_message, is_collecting, collecting_progress, collecting_message
+    
+    if event == 'log':
+        add_training_log(payload)
+        return
+    
+    running = job['state'] in ('running', 'cancelling')
+    if job['kind'] == 'train':
+        is_training, training_progress, training_message = running, job['progress'], job['message']
+    else:
+        is_collecting, collecting_progress, collecting_message = running, job['progress'], job['message']
+    
+    try:
+        if event == 'done':
+            if job['kind'] == 'train':
+                _install_trained_model(payload)
+            else:
+                add_training_log(f"Hoàn thành: catalog mới có {payload['songs']} bài hát")
+                reload_generator(reason="thu thập dữ liệu xong")
+        elif event == 'error':
+            add_training_log(f"Lỗi khi chạy job {job['kind']}: {payload}")
+        elif event == 'cancelled':
+            add_training_log(f"Đã hủy job {job['kind']}")
+        elif event == 'remote' and not running:
+            # Job chạy ở worker khác (JobManager.share): worker đó đưa kết quả vào phục vụ, file watcher reload ở đây
+            add_training_log(f"Job {job['kind']} ở worker khác đã kết thúc: {job['state']}")
+    except Exception as e:
+        add_training_log(f"Lỗi khi đưa kết quả job {job['kind']} vào phục vụ: {e}")
+    finally:
+        notify_status_change()
+
+jobs = JobManager(_on_job_event, cancel_grace=Config.JOB_CANCEL_GRACE)
+
+def initialize_generator(background=False):
+    """Khởi tạo generator nếu có dữ liệu sẵn
+    
+    background=True: chỉ load catalog rồi trả về ngay, DQN được load ở thread nền
+    (/api/status báo model_state = 'loading' cho tới khi xong).
+    """
+    if background:
+        if not preload_catalog():
+            return False
+        print(f"Đã load {len(generator.songs_data)} bài hát từ file")
+        if os.path.exists(Config.DQN_MODEL_FILE):
+            load_model_in_background()
+        else:
+            print("⚠️ Chưa có model, cần training trước")
+        return True
+    
     try:
         if os.path.exists(Config.PLAYLIST_DATA_FILE):
-            generator = PlaylistGenerator()
-            if generator.load_data():
-                print(f"Đã load {len(generator.songs_data)} bài hát từ file")
+            # Load đầy đủ rồi mới gán, để request không thấy generator đang load dở
+            new_generator = _load_generator()
+            if new_generator is not None:
+                _swap_generator(new_generator)
+                print(f"Đã load {len(new_generator.songs_data)} bài hát từ file")
                 
-                # Tự động load model nếu có
-                model_path = 'models/dqn_model.h5'
-                if os.path.exists(model_path):
-                    try:
-                        generator.load_model(model_path)
-                        print("✅ Đã load model thành công!")
-                        return True
-                    except Exception as e:
-                        print(f"⚠️ Không thể load model: {e}")
-                        return True  # Vẫn OK nếu có dữ liệu
+                if new_generator.dqn_model is not None:
+                    print("✅ Đã load model thành công!")
+                elif os.path.exists(Config.DQN_MODEL_FILE):
+                    print("⚠️ Không thể load model")
                 else:
                     print("⚠️ Chưa có model, cần training trước")
-                    return True  # Vẫn OK nếu có dữ liệu
+                return True  # Vẫn OK nếu có dữ liệu
     except Exception as e:
         print(f"Lỗi khi load dữ liệu: {e}")
     return False
 
+def preload_catalog():
+    """Load catalog + embeddings (chưa load DQN) trong process master trước khi fork worker.
+    
+    Worker fork ra dùng chung phần dữ liệu này theo copy-on-write; DQN được load riêng
+    trong từng worker bằng load_serving_model().
+    """
+    if not os.path.exists(Config.PLAYLIST_DATA_FILE):
+        print("Chưa có dữ liệu, worker sẽ khởi động với generator rỗng")
+        return False
+    new_generator = PlaylistGenerator()
+    if not new_generator.load_data():
+        return False
+    new_generator.prepare_serving()
+    _swap_generator(new_generator)
+    return True
+
+def load_serving_model(model_path=None):
+    """Load DQN vào generator đang phục vụ (gọi trong từng worker sau khi fork, trước khi nhận request)"""
+    global generator_version
+    model_path = model_path or Config.DQN_MODEL_FILE
+    gen = generator
+    if gen is None or not os.path.exists(model_path):
+        return False
+    if not gen.load_model(model_path):
+        return False
+    generator_version += 1
+    playlist_cache.clear()
+    return True
+
+def load_model_in_background(model_path=None):
+    """Load DQN (kèm import TensorFlow) ở thread nền; trong lúc chờ server vẫn phục vụ các endpoint catalog"""
+    global model_loading, model_load_error
+    model_path = model_path or Config.DQN_MODEL_FILE
+    model_loading = True
+    model_load_error = None
+    notify_status_change()
+    
+    def run():
+        global model_loading, model_load_error
+        start = time.perf_counter()
+        try:
+            if load_serving_model(model_path):
+                print(f"✅ Đã load model trong {time.perf_counter() - start:.1f}s", flush=True)
+            elif os.path.exists(model_path):
+                model_load_error = f"Không thể load model từ {model_path}"
+                print(f"⚠️ {model_load_error}", flush=True)
+        except Exception as e:
+            model_load_error = str(e)
+            print(f"⚠️ Lỗi khi load model: {e}", flush=True)
+        finally:
+            model_loading = False
+            notify_status_change()
+    
+    thread = threading.Thread(target=run, name="model-loader", daemon=True)
+    thread.start()
+    return thread
+
+def warm_up():
+    """Chạy 1 request tạo playlist qua test client để khởi tạo sẵn model trước khi nhận traffic"""
+    gen = generator
+    if gen is None or gen.dqn_model is None:
+        return False
+    start = time.perf_counter()
+    with app.test_client() as client:
+        response = client.post('/api/generate-playlist',
+                               json={'length': Config.MIN_PLAYLIST_LENGTH, 'deterministic': True})
+    ok = response.status_code == 200 and bool(response.get_json().get('success'))
+    playlist_cache.clear()  # Không giữ kết quả warm-up trong cache
+    print(f"Warm-up {'xong' if ok else 'lỗi'} trong {time.perf_counter() - start:.2f}s", flush=True)
+    return ok
+
 @app.route('/')
 def index():
     """Trang chủ"""
     return render_template('index.html')
 
-@app.route('/api/status')
-def get_status():
-    """Lấy trạng thái hệ thống"""
-    global generator, is_training, training_progress, is_collecting, collecting_progress, collecting_message
+def _model_state(gen):
+    """'ready' | 'loading' | 'error' | 'missing'"""
+    if gen is not None and gen.dqn_model is not None:
+        return 'ready'
+    if model_loading:
+        return 'loading'
+    return 'error' if model_load_error else 'missing'
+
+def _current_status():
+    """Trạng thái hệ thống dạng dict (dùng chung cho /api/status và /api/stream)"""
+    global generator, is_training, training_progress, training_message, is_collecting, collecting_progress, collecting_message
     
     # Kiểm tra xem dữ liệu có thực sự tồn tại không
     data_exists = False
     songs_count = 0
     
-    if generator and generator.songs_data:
+    gen = generator
+    if gen and gen.songs_data:
         # Sử dụng số lượng bài hát thực tế từ generator
-        songs_count = len(generator.songs_data)
+        songs_count = len(gen.songs_data)
         data_exists = songs_count > 0
     else:
         # Kiểm tra file dữ liệu có tồn tại không
@@ -99,60 +378,197 @@ def get_status():
             songs_count = 0
     
     # Reset generator nếu dữ liệu không tồn tại
-    if not data_exists and generator:
+    if not data_exists and gen and generator is gen:
         generator = None
+        gen = None
     
     status = {
         'data_loaded': data_exists,
-        'model_trained': generator is not None and generator.dqn_model is not None,
+        'model_trained': gen is not None and gen.dqn_model is not None,
+        'model_state': _model_state(gen),
+        'model_error': model_load_error,
         'is_training': is_training,
         'training_progress': training_progress,
+        'training_message': training_message,
         'is_collecting': is_collecting,
         'collecting_progress': collecting_progress,
         'collecting_message': collecting_message,
-        'songs_count': songs_count
+        'songs_count': songs_count,
+        'job': jobs.current(),
+        'generator_version': generator_version,
+        'reload': dict(reload_state)
     }
     
-    return jsonify(status)
+    return status
+
+@app.route('/api/status')
+def get_status():
+    """Lấy trạng thái hệ thống"""
+    return jsonify(_current_status())
+
+def _sse_event(event, data, event_id=None):
+    """Định dạng 1 sự kiện server-sent events"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/stream')
+def stream_events():
+    """Server-sent events: đẩy log training mới và thay đổi trạng thái ngay khi có.
+    
+    Client đọc tiếp từ header Last-Event-ID (EventSource tự gửi khi kết nối lại) hoặc ?after=<cursor>;
+    /api/status và /api/training-logs vẫn giữ cho client polling. Mỗi kết nối giữ 1 thread nên mỗi
+    process chỉ nhận tối đa Config.SSE_MAX_CONNECTIONS kết nối, vượt quá trả 503 (trang web quay về polling).
+    """
+    if not sse_slots.acquire(blocking=False):
+        return jsonify({'success': False, 'message': 'Quá nhiều kết nối stream, vui lòng dùng /api/status'}), 503
+    
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    
+    def events():
+        cursor = after
+        last_status = None
+        last_version = None
+        next_status_check = 0.0
+        # Báo client tự kết nối lại sau 3 giây nếu mất kết nối
+        yield "retry: 3000\n\n"
+        while True:
+            if cursor is not None:
+                training_logs.wait(cursor, timeout=Config.SSE_STATUS_INTERVAL)
+            sent = False
+            
+            logs, new_cursor, reset = training_logs.since(cursor)
+            if logs or reset or cursor is None:
+                yield _sse_event('logs', {'logs': logs, 'cursor': new_cursor, 'reset': reset or cursor is None},
+                                 event_id=new_cursor)
+                sent = True
+            cursor = new_cursor
+            
+            # Trạng thái được kiểm tra khi có notify_status_change() hoặc định kỳ (file dữ liệu có thể thay đổi)
+            now = time.monotonic()
+            if status_version != last_version or now >= next_status_check:
+                last_version = status_version
+                next_status_check = now + Config.SSE_STATUS_INTERVAL
+                status = _current_status()
+                if status != last_status:
+                    last_status = status
+                    yield _sse_event('status', status)
+                    sent = True
+            
+            if not sent:
+                yield ": keep-alive\n\n"
+    
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Server gọi close() khi client ngắt kết nối (kể cả khi generator chưa chạy lần nào)
+    response.call_on_close(sse_slots.release)
+    return response
 
 @app.route('/api/collect-data', methods=['POST'])
 def collect_data():
-    """Thu thập dữ liệu từ Spotify - Chỉ thông báo"""
-    return jsonify({
-        'success': False, 
-        'message': 'Vui lòng chạy collect_data.py để thu thập dữ liệu trước khi sử dụng web interface'
-    })
+    """Thu thập dữ liệu từ Spotify trong process nền"""
+    data = request.get_json(silent=True) or {}
+    job = jobs.start('collect', {'target_count': int(data.get('target_count', 2000))})
+    if job is None:
+        return jsonify({'success': False, 'message': 'Đang có job khác chạy, vui lòng chờ hoặc hủy job đó'})
+    
+    notify_status_change()
+    return jsonify({'success': True, 'message': 'Đã bắt đầu thu thập dữ liệu', 'job': job})
 
 @app.route('/api/train-model', methods=['POST'])
 def train_model():
-    """Train model - Chỉ thông báo"""
-    return jsonify({
-        'success': False, 
-        'message': 'Vui lòng chạy train_model.py để training model trước khi sử dụng web interface'
-    })
+    """Train model trong process nền, model mới được đưa vào phục vụ khi train xong"""
+    data = request.get_json(silent=True) or {}
+    episodes = int(data.get('episodes', 500))
+    # Lưu ra file riêng (cùng đuôi với Config.DQN_MODEL_FILE), chỉ thay file chính khi load thành công
+    directory, filename = os.path.split(Config.DQN_MODEL_FILE)
+    stem, extension = filename.split('.', 1)
+    save_path = os.path.join(directory, f"{stem}.{int(time.time())}.{extension}")
+    
+    job = jobs.start('train', {'episodes': episodes, 'save_path': save_path})
+    if job is None:
+        return jsonify({'success': False, 'message': 'Đang có job khác chạy, vui lòng chờ hoặc hủy job đó'})
+    
+    add_training_log(f"Bắt đầu training {episodes} episodes (job {job['id']})")
+    notify_status_change()
+    return jsonify({'success': True, 'message': 'Đã bắt đầu training model', 'job': job})
+
+@app.route('/api/job')
+def get_job():
+    """Thông tin job đang chạy hoặc job gần nhất"""
+    return jsonify({'job': jobs.current()})
+
+@app.route('/api/cancel-job', methods=['POST'])
+def cancel_job():
+    """Hủy job đang chạy"""
+    if jobs.cancel():
+        return jsonify({'success': True, 'message': 'Đang hủy job...'})
+    return jsonify({'success': False, 'message': 'Không có job nào đang chạy'})
+
+@app.route('/api/admin/reload', methods=['POST'])
+def admin_reload():
+    """Reload dữ liệu + model không downtime; {"wait": true} để chờ reload xong mới trả về"""
+    if Config.ADMIN_TOKEN and request.headers.get('X-Admin-Token') != Config.ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Không có quyền'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    if reload_lock.locked():
+        return jsonify({'success': False, 'message': 'Đang reload, vui lòng chờ', 'reload': dict(reload_state)})
+    
+    if data.get('wait'):
+        ok = reload_generator(reason='admin')
+        return jsonify({'success': ok, 'message': 'Đã reload' if ok else 'Reload thất bại',
+                        'reload': dict(reload_state), 'generator_version': generator_version})
+    
+    threading.Thread(target=reload_generator, kwargs={'reason': 'admin'}, name="generator-reload", daemon=True).start()
+    return jsonify({'success': True, 'message': 'Đang reload ở nền, generator hiện tại vẫn phục vụ'})
 
 @app.route('/api/generate-playlist', methods=['POST'])
 def generate_playlist():
-    """Tạo playlist"""
-    global generator
+    """Tạo playlist
+    
+    {"deterministic": true} (hoặc Config.DETERMINISTIC_GENERATION) cho kết quả cố định theo
+    (seed_song, length, constraints, random_seed) và được cache cho tới lần reload model/catalog kế tiếp.
+    """
+    version = generator_version  # Đọc version trước generator (xem _swap_generator)
+    gen = generator  # Giữ nguyên bản đang phục vụ trong suốt request (có thể bị reload giữa chừng)
     
     try:
-        if generator is None or generator.dqn_model is None:
+        if gen is None or gen.dqn_model is None:
+            if model_loading:
+                return jsonify({'success': False, 'message': 'Model đang được load, vui lòng thử lại sau giây lát'})
             return jsonify({'success': False, 'message': 'Vui lòng train model trước'})
         
         data = request.json
         length = data.get('length', 20)
         seed_song = data.get('seed_song', None)
         constraints = data.get('constraints', {})
+        deterministic = bool(data.get('deterministic', Config.DETERMINISTIC_GENERATION))
+        random_seed = int(data.get('random_seed', 0))
         
-        playlist = generator.generate_playlist(
+        # Chỉ cache chế độ deterministic (chế độ thường cố ý trả playlist khác nhau mỗi lần)
+        cache_key = None
+        if deterministic and Config.PLAYLIST_CACHE_SIZE > 0:
+            cache_key = make_playlist_key(seed_song, length, constraints, random_seed, version)
+            cached = playlist_cache.get(cache_key)
+            if cached is not None:
+                return jsonify(dict(cached, cached=True))
+        
+        playlist = gen.generate_playlist(
             seed_song_id=seed_song,
             length=length,
-            constraints=constraints
+            constraints=constraints,
+            deterministic=deterministic,
+            random_seed=random_seed
         )
         
         # Đánh giá playlist
-        score = generator.evaluate_playlist(playlist)
+        score = gen.evaluate_playlist(playlist)
         
         # Format playlist cho frontend
         formatted_playlist = []
@@ -168,68 +584,95 @@ def generate_playlist():
             }
             formatted_playlist.append(formatted_song)
         
-        return jsonify({
+        result = {
             'success': True,
             'playlist': formatted_playlist,
             'score': score,
             'length': len(formatted_playlist)
-        })
+        }
+        if cache_key is not None:
+            playlist_cache.set(cache_key, result)
+        
+        return jsonify(dict(result, cached=False))
     
     except Exception as e:
         return jsonify({'success': False, 'message': f'Lỗi: {str(e)}'})
 
 @app.route('/api/training-logs')
 def get_training_logs():
-    """Lấy log training"""
-    global training_logs
-    return jsonify({'logs': training_logs})
+    """Lấy log training; truyền ?after=<cursor> để chỉ lấy các log mới hơn"""
+    after = request.args.get('after', type=int)
+    logs, cursor, reset = training_logs.since(after)
+    return jsonify({'logs': logs, 'cursor': cursor, 'reset': reset})
 
 @app.route('/api/clear-training-logs', methods=['POST'])
 def clear_training_logs():
     """Xóa log training"""
-    global training_logs
-    training_logs = []
-    return jsonify({'success': True, 'message': 'Đã xóa log training'})
+    cursor = training_logs.clear()
+    return jsonify({'success': True, 'message': 'Đã xóa log training', 'cursor': cursor})
+
+@app.route('/api/timings')
+def get_timings():
+    """Thống kê thời gian theo giai đoạn khi tạo playlist (giây)"""
+    return jsonify({'stages': PROFILER.snapshot(), 'sampling': PROFILER.sampling})
+
+@app.route('/api/profiler', methods=['POST'])
+def toggle_profiler():
+    """Bật/tắt sampling profiler; khi tắt trả về các hàm tốn thời gian nhất"""
+    data = request.get_json(silent=True) or {}
+    if data.get('enabled'):
+        PROFILER.start_sampling(interval=float(data.get('interval', 0.005)))
+        return jsonify({'success': True, 'sampling': True})
+    
+    report = PROFILER.stop_sampling(top=int(data.get('top', 30)))
+    if data.get('reset_timings'):
+        PROFILER.reset()
+    return jsonify({'success': True, 'sampling': False, 'report': report})
+
+@app.route('/metrics')
+def metrics():
+    """Metrics theo định dạng text của Prometheus"""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/search-songs', methods=['GET'])
 def search_songs():
     """Tìm kiếm bài hát"""
-    global generator
+    gen = generator
     
-    if generator is None:
+    if gen is None:
         return jsonify({'success': False, 'message': 'Chưa có dữ liệu'})
     
     query = request.args.get('q', '').lower()
     limit = int(request.args.get('limit', 10))
     
+    # So khớp trên cột (giá trị không trùng) thay vì duyệt từng bài hát; chỉ đọc `limit` bài đầu tiên khớp
+    songs_data = gen.songs_data
+    matches = (contains_text(songs_data, 'name', query) | contains_text(songs_data, 'artist', query) |
+               contains_text(songs_data, 'genre', query))
     results = []
-    for song in generator.songs_data:
-        if (query in song['name'].lower() or 
-            query in song['artist'].lower() or
-            query in song.get('genre', '').lower()):
-            results.append({
-                'id': song['id'],
-                'name': song['name'],
-                'artist': song['artist'],
-                'genre': song.get('genre', 'Unknown')
-            })
-            if len(results) >= limit:
-                break
+    for index in np.flatnonzero(matches)[:limit]:
+        song = songs_data[int(index)]
+        results.append({
+            'id': song['id'],
+            'name': song['name'],
+            'artist': song['artist'],
+            'genre': song.get('genre', 'Unknown')
+        })
     
     return jsonify({'success': True, 'songs': results})
 
 @app.route('/api/genres')
 def get_genres():
     """Lấy danh sách thể loại từ dữ liệu thực tế + các thể loại cổ điển"""
-    global generator
+    gen = generator
     
     # Các thể loại cổ điển/phổ biến
     standard_genres = ['Vietnamese', 'Pop', 'Rock', 'Hip-hop', 'Electronic', 'Jazz', 'Classical', 'Country', 'R&B', 'Folk', 'Reggae', 'Blues', 'Metal']
     
-    if generator and generator.songs_data:
+    if gen and gen.songs_data:
         # Lấy các genre thực tế từ dữ liệu
         data_genres = set()
-        for song in generator.songs_data:
+        for song in gen.songs_data:
             genre = song.get('genre', 'Unknown')
             if genre and genre != 'Unknown':
                 data_genres.add(genre)
@@ -255,6 +698,10 @@ def reset_system():
     global generator, data_collector, is_training, training_progress, is_collecting, collecting_progress, collecting_message
     
     try:
+        # Dừng job nền (nếu có) và chờ worker thoát hẳn trước khi xóa dữ liệu (worker có thể đang ghi file)
+        if jobs.cancel() and not jobs.wait(Config.JOB_CANCEL_GRACE + 5):
+            return jsonify({'success': False, 'message': 'Job nền chưa dừng, vui lòng thử reset lại sau'})
+        
         # Reset các biến global
         generator = None
         data_collector = None
@@ -275,13 +722,17 @@ def reset_system():
         for file_path in files_to_delete:
             if os.path.exists(file_path):
                 os.remove(file_path)
+        EmbeddingStore(Config.EMBEDDING_STORE_FILE).remove()
         
         # Xóa model files
-        model_files = ['models/dqn_model.h5']
+        model_files = [Config.DQN_MODEL_FILE, numpy_weights_path(Config.DQN_MODEL_FILE)]
+        model_files += [quantized_weights_path(Config.DQN_MODEL_FILE, mode) for mode in ('int8', 'float16')]
+        model_files.append(Config.EMBEDDING_MODEL_FILE)
         for model_file in model_files:
             if os.path.exists(model_file):
                 os.remove(model_file)
         
+        notify_status_change()
         return jsonify({'success': True, 'message': 'Đã reset hệ thống thành công'})
     
     except Exception as e:
@@ -295,6 +746,8 @@ if __name__ == '__main__':
     
     # Khởi tạo generator nếu có dữ liệu sẵn
     print("Khởi tạo hệ thống...")
-    initialize_generator()
+    # Load catalog rồi mở server ngay, DQN (và TensorFlow) được load ở thread nền
+    initialize_generator(background=True)
+    start_reload_watcher()
     
     app.run(debug=False, host='0.0.0.0', port=5000) 
\ No newline at end of file
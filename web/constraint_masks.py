@@ -0,0 +1,151 @@
+import math
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+import numpy as np
+from catalog import column_of
+from shared_store import catalog_columns
+
+AUDIO_FEATURES = ('danceability', 'energy', 'valence', 'acousticness',
+                  'tempo', 'instrumentalness', 'speechiness', 'liveness')
+
+class ConstraintMasks:
+    """Bitmap (mảng bool theo index bài hát) cho các constraint genre / popularity / năm phát hành.
+
+    Bitmap của từng điều kiện (mỗi genre, mỗi ngưỡng popularity, mỗi năm) được tính 1 lần rồi
+    cache; ngưỡng được làm tròn lên giá trị có trong catalog nên số bitmap cache không vượt quá số giá
+    trị khác nhau của cột, dù client gửi ngưỡng tùy ý. Bitmap của cả bộ constraints là phép OR các genre rồi AND với các điều kiện còn lại,
+    cũng được cache theo bộ constraints đã chuẩn hóa. Kết quả giống hệt vòng lặp
+    PlaylistGenerator._apply_constraints cũ.
+    """
+
+    def __init__(self, songs_data, max_cached=256, columns=None):
+        self.size = len(songs_data)
+        self.max_cached = max_cached
+
+        # Genre mặc định là Vietnamese giống _apply_constraints
+        genres = column_of(songs_data, 'genre', 'Vietnamese')
+        self.genre_lookup = {}
+        self.genre_codes = np.array([self.genre_lookup.setdefault(g, len(self.genre_lookup)) for g in genres],
+                                    dtype=np.int32)
+
+        # Cột popularity / year / year_valid: dùng lại từ shared store nếu có (columns), không thì tính
+        # từ songs_data. Không đọc được năm: year_valid = False, bài hát bị loại khi có min_year
+        if columns is None:
+            columns = SimpleNamespace(**catalog_columns(songs_data))
+        self.popularity = columns.popularity
+        self.years = columns.year
+        self.year_valid = columns.year_valid
+        self._popularity_levels = np.unique(self.popularity)
+        self._year_levels = np.unique(self.years[self.year_valid])
+
+        self.songs_data = songs_data
+        self._feature_columns = {}
+        self._genre_masks = {}
+        self._popularity_masks = {}
+        self._year_masks = {}
+        self._combined = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def _cached(self, cache, key, compute):
+        mask = cache.get(key)
+        if mask is None:
+            mask = compute()
+            mask.flags.writeable = False
+            cache[key] = mask
+        return mask
+
+    def genre_mask(self, genre):
+        """Bài hát có genre đúng bằng `genre`"""
+        code = self.genre_lookup.get(genre)
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return self._cached(self._genre_masks, genre, lambda: self.genre_codes == code)
+
+    @staticmethod
+    def _threshold(levels, value):
+        """Giá trị nhỏ nhất trong levels (đã sắp xếp) mà >= value, inf nếu không có: `>= kết quả`
+        chọn đúng các bài hát thỏa `>= value`"""
+        position = np.searchsorted(levels, float(value))
+        return levels[position].item() if position < len(levels) else math.inf
+
+    def popularity_mask(self, min_popularity):
+        """Bài hát có popularity >= min_popularity"""
+        threshold = self._threshold(self._popularity_levels, min_popularity)
+        return self._cached(self._popularity_masks, threshold, lambda: self.popularity >= threshold)
+
+    def year_mask(self, min_year):
+        """Bài hát có năm phát hành đọc được và >= min_year"""
+        threshold = self._threshold(self._year_levels, min_year)
+        return self._cached(self._year_masks, threshold, lambda: self.year_valid & (self.years >= threshold))
+
+    def feature_column(self, feature):
+        """Cột audio feature dạng float, NaN nếu bài hát không có giá trị"""
+        with self._lock:
+            values = self._feature_columns.get(feature)
+            if values is None:
+                values = column_of(self.songs_data, feature, np.nan, np.nan).astype(np.float64)
+                values.flags.writeable = False
+                self._feature_columns[feature] = values
+            return values
+
+    def audio_mask(self, constraints):
+        """Bitmap các bài hát thỏa audio constraints (không cache vì giá trị mục tiêu liên tục).
+
+        Bài hát không có giá trị feature thì không bị loại; tolerance ±20, riêng tempo ±30.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for feature in AUDIO_FEATURES:
+            if feature in constraints:
+                tolerance = 30 if feature == 'tempo' else 20
+                values = self.feature_column(feature)
+                with np.errstate(invalid='ignore'):
+                    mask &= ~(np.abs(values - constraints[feature]) > tolerance)
+        return mask
+
+    @staticmethod
+    def normalize(constraints):
+        """Key của bộ constraints: (genre đã chọn hoặc None, min_popularity, min_year)"""
+        selected = constraints.get('genre')
+        genre_key = None
+        # Chọn Vietnamese nghĩa là chấp nhận mọi genre
+        if selected and 'Vietnamese' not in selected:
+            genre_key = selected if isinstance(selected, str) else frozenset(selected)
+        return genre_key, constraints.get('min_popularity'), constraints.get('min_year')
+
+    def mask(self, constraints):
+        """Bitmap các bài hát thỏa genre / popularity / năm (chỉ đọc, dùng chung giữa các request)"""
+        genre_key, min_popularity, min_year = self.normalize(constraints)
+        if min_popularity is not None:
+            min_popularity = self._threshold(self._popularity_levels, min_popularity)
+        if min_year is not None:
+            min_year = self._threshold(self._year_levels, min_year)
+        key = (genre_key, min_popularity, min_year)
+        with self._lock:
+            mask = self._combined.get(key)
+            if mask is not None:
+                self._combined.move_to_end(key)
+                return mask
+
+            genre_key, min_popularity, min_year = key
+            mask = np.ones(self.size, dtype=bool)
+            if genre_key is not None:
+                # `genre in selected` giữ nguyên ngữ nghĩa cũ cho cả list lẫn chuỗi
+                genre_union = np.zeros(self.size, dtype=bool)
+                for genre in self.genre_lookup:
+                    if isinstance(genre, str) and genre in genre_key:
+                        genre_union |= self.genre_mask(genre)
+                mask &= genre_union
+            if min_popularity is not None:
+                mask &= self.popularity_mask(min_popularity)
+            if min_year is not None:
+                mask &= self.year_mask(min_year)
+
+            mask.flags.writeable = False
+            self._combined[key] = mask
+            while len(self._combined) > self.max_cached:
+                self._combined.popitem(last=False)
+            return mask
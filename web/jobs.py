@@ -0,0 +1,413 @@
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có file lock, chỉ chia sẻ job an toàn khi chạy 1 process web
+    fcntl = None
+
+def catalog_fingerprint(songs):
+    """Hash của danh sách song id, để biết model được train trên đúng catalog đang phục vụ hay không"""
+    return hashlib.sha1('\n'.join(song['id'] for song in songs).encode('utf-8')).hexdigest()
+
+class JobCancelled(Exception):
+    """Job bị hủy theo yêu cầu"""
+
+class JobReporter:
+    """Gửi log / tiến độ từ worker process về web process qua queue"""
+
+    def __init__(self, events, cancel_event, min_interval=0.5):
+        self.events = events
+        self.cancel_event = cancel_event
+        self.min_interval = min_interval
+        self._last_progress = 0.0
+
+    def log(self, message):
+        self.events.put(('log', message))
+
+    def progress(self, percent, message, force=False):
+        """Báo tiến độ (0-100); bị giới hạn tần suất để không làm ngập kênh trạng thái"""
+        now = time.monotonic()
+        if force or percent >= 100 or now - self._last_progress >= self.min_interval:
+            self._last_progress = now
+            self.events.put(('progress', float(percent), message))
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+def collect_job(reporter, params):
+    """Thu thập dữ liệu từ Spotify và ghi đè Config.PLAYLIST_DATA_FILE"""
+    from spotify_data_collector import SpotifyDataCollector
+
+    target_count = int(params.get('target_count', 2000))
+    collector = SpotifyDataCollector()
+    reporter.log(f"Bắt đầu thu thập {target_count} bài hát...")
+    reporter.progress(0, "Bắt đầu thu thập...", force=True)
+
+    last_logged = [0]
+    def progress_callback(current, total, message):
+        reporter.check_cancelled()
+        reporter.progress(current / total * 100, f"[{current}/{total}] {message}")
+        if current - last_logged[0] >= 100 or current == total:
+            last_logged[0] = current
+            reporter.log(f"Đã thu thập {current}/{total} bài hát")
+
+    songs = collector.collect_data(target_count=target_count, progress_callback=progress_callback)
+    if not songs:
+        raise RuntimeError("Không thu thập được bài hát nào, vui lòng kiểm tra Spotify API credentials")
+
+    # Ghi ra file tạm rồi đổi tên để web process không bao giờ đọc phải file đang ghi dở
+    tmp_file = Config.PLAYLIST_DATA_FILE + '.tmp'
+    collector.save_data(tmp_file)
+    os.replace(tmp_file, Config.PLAYLIST_DATA_FILE)
+    reporter.log(f"Hoàn thành thu thập {len(songs)} bài hát")
+
+    # Chỉ embed bài hát mới (PCA đã fit được dùng lại), không fit lại trên cả catalog
+    from playlist_generator import PlaylistGenerator
+    reporter.progress(100, "Cập nhật embeddings...", force=True)
+    generator = PlaylistGenerator()
+    if generator.load_data():
+        added = generator.update_embeddings()
+        reporter.log(f"Đã cập nhật embeddings: {added} bài hát mới")
+    return {'songs': len(songs), 'data_file': Config.PLAYLIST_DATA_FILE}
+
+def train_job(reporter, params):
+    """Train DQN model từ dữ liệu hiện có, lưu weights vào params['save_path']"""
+    from playlist_generator import PlaylistGenerator
+
+    episodes = int(params.get('episodes', 500))
+    save_path = params['save_path']
+
+    reporter.progress(10, "Chuẩn bị dữ liệu", force=True)
+    reporter.log("Đang load dữ liệu và embeddings...")
+    generator = PlaylistGenerator()
+    if not generator.load_data():
+        raise RuntimeError("Chưa có dữ liệu, vui lòng thu thập dữ liệu trước")
+    reporter.check_cancelled()
+
+    reporter.progress(30, "Tạo Embeddings", force=True)
+    reporter.log(f"Đã load {len(generator.songs_data)} bài hát, {len(generator.embeddings)} embeddings")
+    reporter.progress(40, "Training DQN Model", force=True)
+    reporter.log(f"Bắt đầu training {episodes} episodes...")
+
+    def progress_callback(episode, total, total_reward, epsilon):
+        reporter.check_cancelled()
+        reporter.progress(40 + 60 * episode / total, f"Episode {episode}/{total}")
+        if episode % 10 == 0 or episode == total:
+            reporter.log(f"Episode {episode}/{total} - Progress {episode / total:.0%}, "
+                         f"Total Reward: {total_reward:.2f}, Epsilon: {epsilon:.2f}")
+
+    generator.train_rl_model(episodes=episodes, progress_callback=progress_callback, save_path=save_path)
+    reporter.log(f"Training hoàn thành, model đã được lưu vào {save_path}")
+    return {'model_path': save_path, 'songs': len(generator.songs_data),
+            'catalog': catalog_fingerprint(generator.songs_data)}
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+JOB_TYPES = {
+    'collect': collect_job,
+    'train': train_job
+}
+
+def _worker_main(kind, params, events, cancel_event):
+    """Điểm vào của worker process"""
+    reporter = JobReporter(events, cancel_event)
+    try:
+        result = JOB_TYPES[kind](reporter, params)
+        events.put(('done', result))
+    except JobCancelled:
+        events.put(('cancelled', None))
+    except Exception as e:
+        traceback.print_exc()
+        events.put(('error', str(e)))
+
+class JobManager:
+    """Chạy tối đa 1 job (thu thập / training) trong process riêng, theo dõi bằng thread nền.
+
+    on_event(job, event, payload) được gọi từ thread theo dõi với event là
+    'log', 'progress', 'done', 'error' hoặc 'cancelled'. Sau share(), job chạy ở process web khác
+    được báo qua 'log' và 'remote' (trạng thái thay đổi, kết quả đã được process kia xử lý).
+    """
+
+    def __init__(self, on_event, cancel_grace=10):
+        self.on_event = on_event
+        self.cancel_grace = cancel_grace
+        # spawn để worker có TensorFlow runtime riêng, không kế thừa thread của Flask
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._job = None
+        self._process = None
+        self._cancel_event = None
+        self.state_file = None
+        self.log_file = None
+
+    @property
+    def running(self):
+        return self._job is not None and self._job['state'] in ('running', 'cancelling')
+
+    def current(self):
+        """Thông tin job đang chạy hoặc job gần nhất (None nếu chưa có), tính cả job của process web khác sau share()"""
+        with self._lock:
+            local = dict(self._job) if self._job else None
+        if self.state_file is None:
+            return local
+        shared = self._read_shared()
+        if shared is None or (local is not None and shared['job']['id'] == local['id']):
+            return local
+        job = shared['job']
+        if job['state'] in ('running', 'cancelling') and not _pid_alive(shared['owner']):
+            # Process chạy job đã thoát (worker bị restart) trước khi kịp ghi kết quả
+            job.update(state='error', error="Process web chạy job đã dừng")
+        return job
+
+    def share(self, state_file, interval=1.0):
+        """Chia sẻ job giữa các process web (gunicorn worker) qua state_file.
+
+        Process chạy job ghi trạng thái vào state_file và log vào state_file + '.log'; process khác đọc lại
+        mỗi interval giây, nên /api/job, /api/status và log giống nhau ở mọi worker, cả server chỉ chạy
+        1 job và worker nào cũng hủy được job. Gọi trong từng worker sau khi fork (có thread nền).
+        """
+        directory = os.path.dirname(state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.state_file = state_file
+        self.log_file = state_file + '.log'
+        threading.Thread(target=self._follow, args=(interval,), name="job-follower", daemon=True).start()
+
+    def start(self, kind, params=None):
+        """Khởi động job, trả về thông tin job hoặc None nếu đang có job khác chạy"""
+        if kind not in JOB_TYPES:
+            raise ValueError(f"Loại job không hợp lệ: {kind}")
+
+        with self._lock, self._shared_lock():
+            if self.running or self._remote_job() is not None:
+                return None
+
+            job = {
+                'id': uuid.uuid4().hex[:8],
+                'kind': kind,
+                'state': 'running',
+                'progress': 0.0,
+                'message': '',
+                'started_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            events = self._context.Queue()
+            cancel_event = self._context.Event()
+            process = self._context.Process(
+                target=_worker_main, args=(kind, dict(params or {}), events, cancel_event),
+                name=f"job-{kind}-{job['id']}", daemon=True
+            )
+            process.start()
+
+            self._job = job
+            self._process = process
+            self._cancel_event = cancel_event
+            if self.state_file is not None:
+                open(self.log_file, 'w').close()
+                self._write_shared(job)
+
+        threading.Thread(target=self._monitor, args=(job, process, events),
+                         name=f"job-monitor-{job['id']}", daemon=True).start()
+        return dict(job)
+
+    def cancel(self):
+        """Yêu cầu hủy job đang chạy; nếu worker không dừng sau cancel_grace giây thì terminate"""
+        with self._lock:
+            if not self.running:
+                return self._request_remote_cancel()
+            job, process = self._job, self._process
+            job['state'] = 'cancelling'
+            self._cancel_event.set()
+            self._publish(job)
+
+        def terminate_later():
+            process.join(self.cancel_grace)
+            if process.is_alive():
+                process.terminate()
+
+        threading.Thread(target=terminate_later, daemon=True).start()
+        self.on_event(dict(job), 'progress', None)
+        return True
+
+    def wait(self, timeout=None):
+        """Chờ worker process của job gần nhất (kể cả job của process web khác) thoát; False nếu vẫn còn chạy sau timeout giây"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            process = self._process
+        if process is not None:
+            process.join(timeout)
+            if process.is_alive():
+                return False
+        while self._remote_job() is not None:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def _monitor(self, job, process, events):
+        """Đọc sự kiện từ worker tới khi job kết thúc"""
+        final = None
+        next_cancel_check = 0.0
+        while final is None:
+            if self.state_file is not None and time.monotonic() >= next_cancel_check:
+                # Process web khác yêu cầu hủy qua state_file
+                next_cancel_check = time.monotonic() + 0.5
+                shared = self._read_shared()
+                if shared and shared.get('cancel') and shared['job']['id'] == job['id'] and job['state'] == 'running':
+                    self.cancel()
+            try:
+                message = events.get(timeout=0.5)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                # Worker đã thoát: đọc nốt các sự kiện còn lại trong queue
+                try:
+                    message = events.get(timeout=0.5)
+                except queue.Empty:
+                    break
+
+            kind = message[0]
+            if kind == 'log':
+                self._append_shared_log(job, message[1])
+                self.on_event(dict(job), 'log', message[1])
+            elif kind == 'progress':
+                with self._lock:
+                    job['progress'], job['message'] = message[1], message[2]
+                    self._publish(job)
+                self.on_event(dict(job), 'progress', None)
+            else:
+                final = message
+
+        process.join()
+        with self._lock:
+            if final is None:
+                # Worker bị terminate hoặc crash mà không kịp báo kết quả
+                final = ('cancelled', None) if job['state'] == 'cancelling' else \
+                    ('error', f"Worker thoát bất thường (exit code {process.exitcode})")
+            event, payload = final
+            job['finished_at'] = time.time()
+            if event == 'done':
+                job['state'], job['progress'], job['result'] = 'done', 100.0, payload
+            elif event == 'error':
+                job['state'], job['error'] = 'error', payload
+            else:
+                job['state'] = 'cancelled'
+            self._publish(job)
+            snapshot = dict(job)
+
+        self.on_event(snapshot, event, payload)
+
+    @contextlib.contextmanager
+    def _shared_lock(self):
+        """Khóa state_file giữa các process web (đọc - sửa - ghi nguyên tử); không làm gì nếu chưa share()"""
+        if self.state_file is None or fcntl is None:
+            yield
+            return
+        with open(self.state_file + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_shared(self):
+        """{'owner': pid process web chạy job, 'job': ..., 'cancel': ...} hoặc None"""
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_shared(self, job, cancel=False, owner=None):
+        """Ghi trạng thái job vào state_file (gọi khi đang giữ _shared_lock), mặc định job của process này"""
+        tmp_path = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'owner': owner or os.getpid(), 'job': job, 'cancel': cancel}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_file)
+
+    def _publish(self, job):
+        """Cập nhật state_file sau khi job của process này đổi trạng thái, giữ yêu cầu hủy đang chờ"""
+        if self.state_file is None:
+            return
+        with self._shared_lock():
+            shared = self._read_shared()
+            cancel = bool(shared and shared['job']['id'] == job['id'] and shared.get('cancel'))
+            self._write_shared(job, cancel=cancel)
+
+    def _remote_job(self):
+        """Job đang chạy ở process web khác (theo state_file), None nếu không có"""
+        if self.state_file is None:
+            return None
+        shared = self._read_shared()
+        if shared is None or shared['owner'] == os.getpid() or not _pid_alive(shared['owner']):
+            return None
+        return shared['job'] if shared['job']['state'] in ('running', 'cancelling') else None
+
+    def _request_remote_cancel(self):
+        """Đánh dấu yêu cầu hủy job của process web khác; process đó hủy ở lần kiểm tra kế tiếp"""
+        with self._shared_lock():
+            if self._remote_job() is None:
+                return False
+            shared = self._read_shared()
+            self._write_shared(shared['job'], cancel=True, owner=shared['owner'])
+        return True
+
+    def _append_shared_log(self, job, message):
+        if self.log_file is None:
+            return
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'owner': os.getpid(), 'job': job['id'], 'log': message}, ensure_ascii=False) + '\n')
+
+    def _read_shared_logs(self, offset):
+        """Các dòng log đầy đủ sau vị trí offset của log_file; trả về (entries, offset mới)"""
+        try:
+            with open(self.log_file, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return [], offset
+        end = data.rfind(b'\n') + 1  # Bỏ dòng đang ghi dở
+        return [json.loads(line) for line in data[:end].splitlines()], offset + end
+
+    def _follow(self, interval):
+        """Thread nền: chuyển log và thay đổi trạng thái của job ở process web khác thành on_event"""
+        offset, log_job, last = 0, None, None
+        while True:
+            time.sleep(interval)
+            try:
+                shared = self._read_shared()
+                if shared is None or shared['owner'] == os.getpid():
+                    continue
+                if shared['job']['id'] != log_job:
+                    # Log được ghi lại từ đầu mỗi khi có job mới
+                    offset, log_job = 0, shared['job']['id']
+                entries, offset = self._read_shared_logs(offset)
+                job = self.current()
+                for entry in entries:
+                    if entry['owner'] != os.getpid():
+                        self.on_event(dict(job), 'log', entry['log'])
+                if job != last:
+                    last = job
+                    self.on_event(dict(job), 'remote', None)
+            except Exception:
+                traceback.print_exc()
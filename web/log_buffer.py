@@ -0,0 +1,63 @@
+import threading
+from collections import deque
+from itertools import islice
+
+class LogBuffer:
+    """Ring buffer giữ N log gần nhất, mỗi log có số thứ tự (seq) tăng dần để client đọc tiếp từ cursor"""
+
+    def __init__(self, maxlen=1000):
+        self._entries = deque(maxlen=maxlen)  # (seq, log)
+        self._seq = 0
+        self._wakeups = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # báo cho các stream đang chờ
+
+    def append(self, log_entry):
+        """Thêm 1 log, trả về seq của log đó"""
+        with self._lock:
+            self._seq += 1
+            self._entries.append((self._seq, log_entry))
+            self._changed.notify_all()
+            return self._seq
+
+    def since(self, after=None):
+        """Các log có seq > after (after=None: toàn bộ buffer).
+
+        Trả về (logs, cursor, reset); reset=True khi cursor của client không còn hợp lệ
+        (server đã khởi động lại) và logs là toàn bộ buffer.
+        """
+        with self._lock:
+            cursor = self._seq
+            if after is None or after > cursor:
+                return [log for _, log in self._entries], cursor, after is not None
+            if after == cursor:
+                return [], cursor, False
+            # seq liên tục nên vị trí trong deque tính trực tiếp từ seq đầu tiên
+            first_seq = self._entries[0][0] if self._entries else cursor + 1
+            start = max(after + 1 - first_seq, 0)
+            return [log for _, log in islice(self._entries, start, None)], cursor, False
+
+    def wait(self, after, timeout=None):
+        """Chờ tới khi có log mới hơn after hoặc có notify(); trả về False nếu hết timeout"""
+        with self._changed:
+            wakeups = self._wakeups
+            return self._changed.wait_for(lambda: self._seq != after or self._wakeups != wakeups, timeout)
+
+    def notify(self):
+        """Đánh thức các stream đang chờ mà không thêm log (ví dụ: trạng thái thay đổi)"""
+        with self._changed:
+            self._wakeups += 1
+            self._changed.notify_all()
+
+    def clear(self):
+        """Xóa toàn bộ log (seq vẫn tiếp tục tăng để cursor cũ của client không bị trùng)"""
+        with self._lock:
+            self._entries.clear()
+            return self._seq
+
+    @property
+    def cursor(self):
+        return self._seq
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,9 +1,65 @@
 import json
+import logging
 import numpy as np
-from models import SongEmbeddingModel, DQNModel, PlaylistEnvironment
+from models import SongEmbeddingModel, DQNModel, PlaylistEnvironment, make_pca, fit_pca
 from config import Config
+from similarity import SimilarityIndex
+from constraint_masks import ConstraintMasks, AUDIO_FEATURES
+from catalog import SongCatalog, column_of
+from numpy_dqn import load_serving_dqn, export_npz, numpy_weights_path
+from shared_store import open_store
+from embedding_store import EmbeddingStore
+from instrumentation import PROFILER, METRICS
 import os
 
+logger = logging.getLogger(__name__)
+
+# Feature cơ bản của create_embeddings
+SEARCH_CATEGORIES = ('vietnamese', 'k-pop', 'j-pop', 'pop', 'rock', 'hip hop', 'electronic')
+EMBEDDING_AUDIO_FEATURES = ('danceability', 'energy', 'valence', 'acousticness',
+                            'tempo', 'instrumentalness', 'speechiness', 'liveness')
+
+def _map_unique(values, func):
+    """func(value) cho từng phần tử (số hoặc tuple số), nhưng mỗi giá trị khác nhau chỉ tính 1 lần
+    (tên nghệ sĩ, ngày phát hành... lặp lại nhiều)"""
+    cache = {}
+    return np.array([cache[value] if value in cache else cache.setdefault(value, func(value)) for value in values],
+                    dtype=np.float64)
+
+def _normalized_year(release_date):
+    """Năm phát hành chuẩn hóa về 0-1 (1950-2024), 0.5 nếu không đọc được"""
+    try:
+        year = int(release_date[:4])
+    except (TypeError, ValueError):
+        return 0.5
+    return max(0, min(1, (year - 1950) / (2024 - 1950)))
+
+def basic_features(songs_data):
+    """Ma trận feature (n, 22) của create_embeddings, tính theo cột catalog thay vì từng bài hát
+    
+    Thứ tự cột: popularity, duration, explicit, năm, độ dài tên nghệ sĩ / bài / album,
+    one-hot SEARCH_CATEGORIES theo search_query, EMBEDDING_AUDIO_FEATURES (thiếu thì 0.5).
+    """
+    columns = [
+        column_of(songs_data, 'popularity', 50, 50).astype(np.float64) / 100.0,  # 0-100 -> 0-1
+        np.minimum(column_of(songs_data, 'duration_ms', 180000, 180000).astype(np.float64) / 600000.0, 1.0),  # Tối đa 10 phút
+        column_of(songs_data, 'explicit', False, False).astype(np.float64),
+        _map_unique(column_of(songs_data, 'release_date', '2020'), _normalized_year),
+        np.minimum(_map_unique(column_of(songs_data, 'artist', '', ''), len) / 50.0, 1.0),  # Giả sử tối đa 50 ký tự
+        np.minimum(_map_unique(column_of(songs_data, 'name', '', ''), len) / 100.0, 1.0),
+        np.minimum(_map_unique(column_of(songs_data, 'album', '', ''), len) / 100.0, 1.0),
+    ]
+    
+    # One-hot (n, 7) theo search_query
+    one_hot = _map_unique(column_of(songs_data, 'search_query', '', ''),
+                          lambda query: tuple(1.0 if category in query.lower() else 0.0 for category in SEARCH_CATEGORIES))
+    columns.append(one_hot.reshape(len(songs_data), len(SEARCH_CATEGORIES)))
+    
+    for feature in EMBEDDING_AUDIO_FEATURES:
+        columns.append(column_of(songs_data, feature, 0.5, 0.5).astype(np.float64))
+    
+    return np.column_stack(columns)
+
 class PlaylistGenerator:
     def __init__(self):
         self.songs_data = []
@@ -11,6 +67,12 @@ class PlaylistGenerator:
         self.embedding_model = SongEmbeddingModel()
         self.dqn_model = None
         self.environment = None
+        self._similarity_index = None
+        self._constraint_masks = None
+        self._popularity = None
+        self.shared = None  # SharedCatalogArrays khi embeddings được load qua shared store
+        self._song_id_to_idx = {}
+        self.profiler = PROFILER
         
     def load_data(self):
         """Load dữ liệu từ file"""
@@ -19,18 +81,21 @@ class PlaylistGenerator:
                 all_songs = json.load(f)
             
             # Chỉ lấy 10,000 bài hát mới nhất
+            # Lưu catalog dạng cột (SongCatalog) thay cho list dict, phần tử vẫn dùng như dict
             if len(all_songs) > 10000:
-                self.songs_data = all_songs[-10000:]  # Lấy 10,000 bài hát cuối
+                self.songs_data = SongCatalog(all_songs[-10000:])  # Lấy 10,000 bài hát cuối
                 print(f"Đã load {len(self.songs_data)} bài hát (10,000 bài hát mới nhất từ tổng {len(all_songs)} bài)")
             else:
-                self.songs_data = all_songs
+                self.songs_data = SongCatalog(all_songs)
                 print(f"Đã load {len(self.songs_data)} bài hát")
+            self._constraint_masks = None
+            self._popularity = None
         else:
             print("Không tìm thấy file dữ liệu. Vui lòng chạy spotify_data_collector.py trước")
             return False
         
         # Load embeddings nếu có
-        if os.path.exists(Config.EMBEDDING_FILE):
+        if self._embedding_source():
             self.load_embeddings()
         else:
             print("Không tìm thấy file embeddings. Sẽ tạo mới...")
@@ -38,9 +103,34 @@ class PlaylistGenerator:
         
         return True
     
+    def _embedding_source(self):
+        """File embeddings mới nhất: file text Config.EMBEDDING_FILE hoặc meta của store nhị phân (None nếu chưa có)"""
+        candidates = [path for path in (Config.EMBEDDING_FILE, EmbeddingStore(Config.EMBEDDING_STORE_FILE).meta_path)
+                      if os.path.exists(path)]
+        return max(candidates, key=os.path.getmtime, default=None)
+    
     def load_embeddings(self):
-        """Load embeddings từ file"""
-        self.embeddings = {}
+        """Load embeddings từ file (qua shared store mmap nếu bật Config.SHARED_STORE_DIR)"""
+        self._similarity_index = None
+        self._constraint_masks = None
+        source = self._embedding_source()
+        if source == Config.EMBEDDING_FILE:
+            read_embeddings = self._read_embedding_file
+        else:
+            read_embeddings = EmbeddingStore(Config.EMBEDDING_STORE_FILE).to_dict
+        if Config.SHARED_STORE_DIR:
+            # Vector là view vào file .npy mmap: mọi process dùng chung 1 bản trong page cache
+            self.shared = open_store(self.songs_data, source, read_embeddings)
+            self.embeddings = self.shared.embedding_dict([song['id'] for song in self.songs_data])
+        else:
+            self.shared = None
+            self.embeddings = read_embeddings()
+        
+        print(f"Đã load {len(self.embeddings)} embeddings")
+    
+    def _read_embedding_file(self):
+        """Đọc file embeddings dạng text thành dict {song_id: vector}"""
+        embeddings = {}
         with open(Config.EMBEDDING_FILE, 'r', encoding='utf-8') as f:
             lines = f.readlines()
             for line in lines[1:]:  # Bỏ qua dòng header
@@ -48,116 +138,105 @@ class PlaylistGenerator:
                 if len(parts) > Config.EMBEDDING_DIM:
                     song_id = parts[0]
                     embedding = [float(x) for x in parts[1:Config.EMBEDDING_DIM+1]]
-                    self.embeddings[song_id] = embedding
-        
-        print(f"Đã load {len(self.embeddings)} embeddings")
+                    embeddings[song_id] = embedding
+        return embeddings
     
     def load_model(self, model_path):
         """Load model DQN từ file"""
         try:
-            from models import DQNModel, PlaylistEnvironment
+            from models import PlaylistEnvironment
             
             # Tạo environment nếu chưa có
             if not self.environment:
-                self.environment = PlaylistEnvironment(self.songs_data, self.embeddings)
+                self.environment = PlaylistEnvironment(self.songs_data, self.embeddings,
+                                                       similarity=self._get_similarity_index())
                 print("✅ Đã tạo environment")
             
-            state_size = Config.EMBEDDING_DIM
             action_size = len(self.songs_data)
-            self.dqn_model = DQNModel(state_size, action_size)
-            self.dqn_model.load(model_path)
+            # Chỉ gán sau khi đã load xong weights: request đang chạy không bao giờ thấy model chưa có weights.
+            # Có file .npz thì dùng NumpyDQN (không cần TensorFlow khi phục vụ)
+            dqn_model = load_serving_dqn(model_path, action_size)
+            self.dqn_model = dqn_model
             print(f"✅ Đã load model từ {model_path}")
             return True
         except Exception as e:
             print(f"❌ Lỗi khi load model: {e}")
             return False
     
+    def prepare_serving(self):
+        """Dựng sẵn environment, similarity index và constraint masks (gọi trước khi fork worker để dùng chung)"""
+        if self.environment is None:
+            self.environment = PlaylistEnvironment(self.songs_data, self.embeddings,
+                                                   similarity=self._get_similarity_index())
+        self._get_similarity_index()
+        self._get_constraint_masks()
+    
     def create_embeddings(self):
-        """Tạo embeddings cho bài hát"""
+        """Tạo embeddings cho bài hát từ dữ liệu cơ bản (không cần audio features), ghi vào Config.EMBEDDING_STORE_FILE"""
         print("Bắt đầu tạo embeddings...")
         
-        # Sử dụng dữ liệu cơ bản thay vì audio features
-        features = []
-        song_ids = []
-        
-        for song in self.songs_data:
-            # Tạo feature vector từ dữ liệu cơ bản
-            feature_vector = []
-            
-            # 1. Popularity (0-100) -> normalize to 0-1
-            popularity = song.get('popularity', 50) / 100.0
-            feature_vector.append(popularity)
-            
-            # 2. Duration (normalize to 0-1, max 10 minutes)
-            duration = min(song.get('duration_ms', 180000) / 600000.0, 1.0)
-            feature_vector.append(duration)
-            
-            # 3. Explicit flag (0 or 1)
-            explicit = float(song.get('explicit', False))
-            feature_vector.append(explicit)
-            
-            # 4. Release year (normalize to 0-1, 1950-2024)
-            try:
-                year = int(song.get('release_date', '2020')[:4])
-                year_normalized = (year - 1950) / (2024 - 1950)
-                year_normalized = max(0, min(1, year_normalized))  # Clamp to 0-1
-            except:
-                year_normalized = 0.5
-            feature_vector.append(year_normalized)
-            
-            # 5. Artist name length (normalize)
-            artist_length = len(song.get('artist', '')) / 50.0  # Assume max 50 chars
-            feature_vector.append(min(artist_length, 1.0))
-            
-            # 6. Song name length (normalize)
-            name_length = len(song.get('name', '')) / 100.0  # Assume max 100 chars
-            feature_vector.append(min(name_length, 1.0))
-            
-            # 7. Album name length (normalize)
-            album_length = len(song.get('album', '')) / 100.0
-            feature_vector.append(min(album_length, 1.0))
-            
-            # 8. Search query category (one-hot encoding)
-            search_query = song.get('search_query', '').lower()
-            categories = ['vietnamese', 'k-pop', 'j-pop', 'pop', 'rock', 'hip hop', 'electronic']
-            for category in categories:
-                feature_vector.append(1.0 if category in search_query else 0.0)
-            
-            # 9. Audio features (nếu có từ dữ liệu cũ)
-            audio_features = ['danceability', 'energy', 'valence', 'acousticness', 
-                            'tempo', 'instrumentalness', 'speechiness', 'liveness']
-            for feature in audio_features:
-                value = song.get(feature, 0.5)  # Default to 0.5 if not available
-                feature_vector.append(value)
-            
-            features.append(feature_vector)
-            song_ids.append(song['id'])
-        
-        # Chuyển đổi sang numpy array
-        features = np.array(features)
+        features = basic_features(self.songs_data)
         print(f"Shape của features: {features.shape}")
+        if len(features) == 0:
+            return
+        
+        # Sử dụng PCA để giảm chiều xuống 128 (Config.EMBEDDING_PCA_SOLVER chọn cách fit)
+        pca = fit_pca(make_pca(min(128, features.shape[1], len(features))), features)
+        
+        # Transform và ghi thẳng từng lô ra file nhị phân
+        store = EmbeddingStore(Config.EMBEDDING_STORE_FILE)
+        song_ids = column_of(self.songs_data, 'id')
+        batch_size = Config.EMBEDDING_BATCH_SIZE
+        with store.writer(pca.n_components_) as writer:
+            for start in range(0, len(features), batch_size):
+                writer.write(song_ids[start:start + batch_size], pca.transform(features[start:start + batch_size]))
+        # Giữ PCA đã fit để update_embeddings chỉ cần embed bài hát mới
+        store.save_transform('basic_pca', mean=pca.mean_, components=pca.components_)
+        
+        print(f"Đã tạo {writer.count} embeddings với shape ({writer.count}, {pca.n_components_}), lưu vào {store.path}")
+        self.load_embeddings()
+    
+    def update_embeddings(self):
+        """Chỉ tạo embeddings cho bài hát chưa có trong store (dùng lại PCA / SongEmbeddingModel đã fit) rồi ghi nối vào store.
+        
+        Tạo lại toàn bộ nếu store chưa có phép biến đổi đã lưu. Trả về số embeddings mới.
+        """
+        store = EmbeddingStore(Config.EMBEDDING_STORE_FILE)
+        source = self._embedding_source()
+        if source == Config.EMBEDDING_FILE:
+            print(f"Embeddings đang dùng {Config.EMBEDDING_FILE}, không cập nhật tăng dần được")
+            return 0
+        transform = store.load_transform() if source else None
+        if transform is None or transform['kind'] not in ('basic_pca', 'autoencoder'):
+            self.create_embeddings()
+            return len(self.embeddings)
         
-        # Sử dụng PCA để giảm chiều xuống 128
-        from sklearn.decomposition import PCA
-        pca = PCA(n_components=min(128, features.shape[1]))
-        embeddings = pca.fit_transform(features)
-        
-        # Chuyển đổi sang dictionary
-        for i, song_id in enumerate(song_ids):
-            self.embeddings[song_id] = embeddings[i].tolist()
-        
-        print(f"Đã tạo {len(self.embeddings)} embeddings với shape {embeddings.shape}")
-        
-        # Lưu embeddings
-        with open('data/embeddings.json', 'w') as f:
-            json.dump(self.embeddings, f)
+        if transform['kind'] == 'autoencoder':
+            added = self.embedding_model.update(store, songs_data=self.songs_data)
+        else:
+            known = set(store.ids())
+            song_ids = column_of(self.songs_data, 'id')
+            positions = [i for i, song_id in enumerate(song_ids) if song_id not in known]
+            added = len(positions)
+            if positions:
+                features = basic_features([self.songs_data[i] for i in positions])
+                store.append(song_ids[positions], (features - transform['mean']) @ transform['components'].T)
+        if added:
+            self.load_embeddings()
+        print(f"Đã thêm {added} embeddings mới vào {store.path}")
+        return added
     
-    def train_rl_model(self, episodes=1000):
-        """Train DQN model"""
+    def train_rl_model(self, episodes=1000, progress_callback=None, save_path=None):
+        """Train DQN model
+        
+        progress_callback(episode, episodes, total_reward, epsilon) được gọi sau mỗi episode
+        (có thể raise exception để dừng training giữa chừng).
+        """
         print("Bắt đầu training DQN model...")
         
         # Tạo environment
-        self.environment = PlaylistEnvironment(self.songs_data, self.embeddings)
+        self.environment = PlaylistEnvironment(self.songs_data, self.embeddings,
+                                               similarity=self._get_similarity_index())
         
         # Tạo DQN model
         state_size = Config.EMBEDDING_DIM
@@ -192,167 +271,209 @@ class PlaylistGenerator:
             
             if episode % 100 == 0:
                 print(f"Episode {episode}/{episodes}, Total Reward: {total_reward:.2f}, Epsilon: {self.dqn_model.epsilon:.2f}")
+            
+            if progress_callback:
+                progress_callback(episode + 1, episodes, total_reward, self.dqn_model.epsilon)
         
         # Lưu model
-        self.dqn_model.save('models/dqn_model.h5')
-        print("Đã lưu DQN model")
+        save_path = save_path or Config.DQN_MODEL_FILE
+        directory = os.path.dirname(save_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.dqn_model.save(save_path)
+        export_npz(self.dqn_model.model, numpy_weights_path(save_path))
+        print(f"Đã lưu DQN model vào {save_path}")
     
-    def generate_playlist(self, seed_song_id=None, length=20, constraints=None):
-        """Tạo playlist với constraints"""
+    def generate_playlist(self, seed_song_id=None, length=20, constraints=None, deterministic=False, random_seed=0):
+        """Tạo playlist với constraints
+        
+        deterministic=True: bài đầu chọn theo random_seed và model luôn chọn action tốt nhất (không epsilon),
+        nên cùng input + cùng model luôn cho cùng playlist.
+        """
         if self.environment is None:
             print("Vui lòng train model trước")
             return []
         
-        # Reset environment
-        state = self.environment.reset()
-        
-        # Nếu có seed song, thêm vào playlist
-        if seed_song_id:
-            seed_idx = self.environment.song_id_to_idx.get(seed_song_id)
-            if seed_idx is not None and seed_idx in self.environment.available_songs:
-                self.environment.current_playlist = [seed_idx]
-                self.environment.available_songs.remove(seed_idx)
-                state = self.environment._get_state()
-        
-        # Áp dụng constraints
-        if constraints:
-            self._apply_constraints(constraints)
-        
-        # Tạo playlist
-        for i in range(length):
-            if len(self.environment.available_songs) == 0:
-                print(f"Hết bài hát available sau {i} bài")
-                break
-            
-            # Chọn action
-            action = self.dqn_model.act(state, self.environment.available_songs)
-            print(f"Bài {i+1}: Action={action}, Available songs={len(self.environment.available_songs)}")
-            
-            # Thực hiện action
-            next_state, reward, done, _ = self.environment.step(action)
-            state = next_state
-            print(f"Reward: {reward}, Done: {done}, Playlist length: {len(self.environment.current_playlist)}")
-            
-            # Không dừng sớm, chỉ dừng khi hết bài hoặc đủ số lượng
-            # if done:
-            #     break
-        
-        return self.environment.get_playlist()
-    
-    def _apply_constraints(self, constraints):
-        """Áp dụng constraints cho playlist (linh hoạt hơn)"""
-        available_songs = self.environment.available_songs.copy()
-        
-        # Đếm số bài hát theo từng constraint để kiểm tra
-        genre_counts = {}
-        for song_idx in available_songs:
-            song = self.songs_data[song_idx]
-            genre = song.get('genre', 'Unknown')
-            genre_counts[genre] = genre_counts.get(genre, 0) + 1
-        
-        print(f"Thống kê thể loại có sẵn: {genre_counts}")
+        # Giữ model trong suốt 1 lần tạo playlist (model có thể được thay trong lúc đang chạy)
+        dqn_model = self.dqn_model
+        # Trạng thái playlist riêng cho lần gọi này: environment dùng chung giữa các thread phục vụ request
+        env = self.environment.session()
         
-        for song_idx in available_songs:
-            song = self.songs_data[song_idx]
-            should_remove = False
-            
-            # Genre constraint (linh hoạt hơn)
-            if 'genre' in constraints and len(constraints['genre']) > 0:
-                selected_genres = constraints['genre']
-                song_genre = song.get('genre', 'Vietnamese')  # Default Vietnamese
+        with self.profiler.stage('generate.total'):
+            # Reset environment
+            with self.profiler.stage('generate.reset'):
+                rng = np.random.default_rng(random_seed) if deterministic else None
+                state = env.reset(rng=rng)
                 
-                # Nếu chọn nhiều thể loại, chấp nhận bất kỳ thể loại nào trong danh sách
-                if song_genre not in selected_genres:
-                    # Nếu chọn Vietnamese, chấp nhận tất cả
-                    if 'Vietnamese' not in selected_genres:
-                        should_remove = True
-                    # Nếu chọn Pop/Rock/Hip-hop mà bài hát là Vietnamese, vẫn chấp nhận một số
-                    elif song_genre == 'Vietnamese' and len(selected_genres) > 0 and 'Vietnamese' not in selected_genres:
-                        # Chỉ loại bỏ 70% bài Vietnamese để vẫn có đủ bài hát
-                        import random
-                        if random.random() < 0.7:
-                            should_remove = True
-            
-            # Popularity constraint
-            if 'min_popularity' in constraints and song.get('popularity', 0) < constraints['min_popularity']:
-                should_remove = True
+                # Nếu có seed song, thêm vào playlist
+                if seed_song_id:
+                    seed_idx = env.song_id_to_idx.get(seed_song_id)
+                    if seed_idx is not None and seed_idx in env.available_songs:
+                        env.current_playlist = [seed_idx]
+                        env.available_songs.remove(seed_idx)
+                        state = env._get_state()
             
-            # Year constraint
-            if 'min_year' in constraints:
-                try:
-                    year = int(song.get('release_date', '0')[:4])
-                    if year < constraints['min_year']:
-                        should_remove = True
-                except:
-                    should_remove = True
+            # Áp dụng constraints
+            if constraints:
+                with self.profiler.stage('generate.constraints'):
+                    self._apply_constraints(constraints, env)
             
-            # Audio features constraints
-            audio_features = ['danceability', 'energy', 'valence', 'acousticness', 
-                            'tempo', 'instrumentalness', 'speechiness', 'liveness']
+            # Tạo playlist
+            for i in range(length):
+                if len(env.available_songs) == 0:
+                    logger.info("Hết bài hát available sau %d bài", i)
+                    break
+                
+                # Chọn action
+                with self.profiler.stage('generate.act'):
+                    action = dqn_model.act(state, env.available_songs, explore=not deterministic)
+                logger.debug("Bài %d: Action=%s, Available songs=%d", i + 1, action, len(env.available_songs))
+                
+                # Thực hiện action
+                with self.profiler.stage('generate.step'):
+                    next_state, reward, done, _ = env.step(action)
+                state = next_state
+                METRICS.inc('playlist_generation_steps_total', help_text="Tổng số bước (bài hát) đã chọn khi tạo playlist")
+                logger.debug("Reward: %s, Done: %s, Playlist length: %d", reward, done, len(env.current_playlist))
+                
+                # Không dừng sớm, chỉ dừng khi hết bài hoặc đủ số lượng
+                # if done:
+                #     break
             
-            for feature in audio_features:
-                if feature in constraints and song.get(feature) is not None:
-                    target_value = constraints[feature]
-                    actual_value = song.get(feature, 0)
-                    
-                    # Tính độ lệch (tolerance ±20 cho các features thường, ±30 cho tempo)
-                    tolerance = 30 if feature == 'tempo' else 20
-                    
-                    if abs(actual_value - target_value) > tolerance:
-                        should_remove = True
-                        break
+            METRICS.inc('playlists_generated_total', help_text="Tổng số playlist đã tạo")
+            return env.get_playlist()
+    
+    def get_timing_stats(self):
+        """Thống kê thời gian theo giai đoạn (reset, constraints, act, step, evaluate)"""
+        return self.profiler.snapshot()
+    
+    def _apply_constraints(self, constraints, env=None):
+        """Áp dụng constraints cho playlist (linh hoạt hơn) trên env (mặc định self.environment)"""
+        env = env if env is not None else self.environment
+        available_songs = env.available_songs
+        
+        # Đếm số bài hát theo từng constraint để kiểm tra (chỉ khi bật log DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            genre_counts = {}
+            for song_idx in available_songs:
+                song = self.songs_data[song_idx]
+                genre = song.get('genre', 'Unknown')
+                genre_counts[genre] = genre_counts.get(genre, 0) + 1
             
-            if should_remove:
-                self.environment.available_songs.remove(song_idx)
+            logger.debug("Thống kê thể loại có sẵn: %s", genre_counts)
+        
+        # Genre / popularity / năm: bitmap dựng sẵn theo bộ constraints; audio features (giá trị liên tục)
+        # tính trên cột float đã cache. Giữ nguyên thứ tự available_songs
+        masks = self._get_constraint_masks()
+        allowed = masks.mask(constraints)
+        if any(feature in constraints for feature in AUDIO_FEATURES):
+            allowed = allowed & masks.audio_mask(constraints)
+        candidates = np.asarray(available_songs, dtype=np.int64)
+        kept = candidates[allowed[candidates]].tolist() if len(candidates) else []
+        env.available_songs = kept
         
         # Đảm bảo có ít nhất 50 bài hát để tạo playlist
-        if len(self.environment.available_songs) < 50:
-            print(f"⚠️ Chỉ còn {len(self.environment.available_songs)} bài hát sau khi áp dụng constraints")
-            print("🔄 Thêm lại một số bài hát Vietnamese để đảm bảo đa dạng...")
+        if len(kept) < 50:
+            logger.warning("Chỉ còn %d bài hát sau khi áp dụng constraints, thêm lại một số bài hát Vietnamese",
+                           len(kept))
             
-            # Thêm lại một số bài hát Vietnamese
-            for song_idx in range(len(self.songs_data)):
-                if len(self.environment.available_songs) >= 100:
-                    break
-                if song_idx not in self.environment.available_songs:
-                    song = self.songs_data[song_idx]
-                    if song.get('genre', 'Vietnamese') == 'Vietnamese':
-                        self.environment.available_songs.append(song_idx)
+            # Thêm lại các bài hát Vietnamese chưa có (theo thứ tự index) cho đủ 100 bài
+            in_available = np.zeros(len(self.songs_data), dtype=bool)
+            in_available[kept] = True
+            refill = np.flatnonzero(masks.genre_mask('Vietnamese') & ~in_available)
+            kept.extend(refill[:max(0, 100 - len(kept))].tolist())
         
-        print(f"✅ Có {len(self.environment.available_songs)} bài hát available sau khi áp dụng constraints")
+        logger.debug("Có %d bài hát available sau khi áp dụng constraints", len(env.available_songs))
     
-    def evaluate_playlist(self, playlist):
-        """Đánh giá chất lượng playlist"""
-        if len(playlist) == 0:
-            return 0
-        
-        if len(playlist) == 1:
-            # Chỉ có 1 bài hát, đánh giá dựa trên popularity
-            popularity = playlist[0].get('popularity', 50)
-            return (popularity / 100) * 5  # Tối đa 5 điểm cho 1 bài
-        
-        # Tính độ tương đồng trung bình
-        similarities = []
-        for i in range(len(playlist) - 1):
-            song1_id = playlist[i]['id']
-            song2_id = playlist[i+1]['id']
-            
-            if song1_id in self.embeddings and song2_id in self.embeddings:
-                similarity = np.dot(self.embeddings[song1_id], self.embeddings[song2_id])
-                similarities.append(similarity)
-        
-        if similarities:
-            avg_similarity = np.mean(similarities)
-            diversity = 1 - abs(avg_similarity)  # Sử dụng abs để tránh giá trị âm
-            popularity = np.mean([song.get('popularity', 50) for song in playlist])
+    def _get_constraint_masks(self):
+        """Bitmap constraint theo thứ tự songs_data (tạo 1 lần, cache theo bộ constraints)"""
+        if self._constraint_masks is None or len(self._constraint_masks) != len(self.songs_data):
+            columns = self.shared if self.shared is not None and len(self.shared) == len(self.songs_data) else None
+            self._constraint_masks = ConstraintMasks(self.songs_data, max_cached=Config.CONSTRAINT_MASK_CACHE_SIZE,
+                                                     columns=columns)
+        return self._constraint_masks
+    
+    def _get_similarity_index(self):
+        """Ma trận embedding theo thứ tự songs_data (tạo 1 lần, dùng lại cho mọi lần đánh giá)"""
+        if self._similarity_index is None or len(self._similarity_index) != len(self.songs_data):
+            song_ids = [song['id'] for song in self.songs_data]
+            self._song_id_to_idx = {song_id: i for i, song_id in enumerate(song_ids)}
+            if self.shared is not None and len(self.shared) == len(self.songs_data):
+                # Dùng thẳng ma trận mmap, không copy
+                self._similarity_index = SimilarityIndex(self.shared.embeddings, normalize=False,
+                                                         valid=self.shared.embedding_valid)
+            else:
+                self._similarity_index = SimilarityIndex.from_embeddings(self.embeddings, song_ids, normalize=False)
+        return self._similarity_index
+    
+    def _get_popularity_column(self):
+        """Popularity theo thứ tự songs_data (bài thiếu popularity tính là 50 như khi đánh giá)"""
+        if self._popularity is None or len(self._popularity) != len(self.songs_data):
+            self._popularity = column_of(self.songs_data, 'popularity', 50, 50).astype(np.float64)
+        return self._popularity
+    
+    def _playlist_arrays(self, playlists):
+        """(positions, popularity, lengths): positions shape (m, L) là index trong songs_data (-1 nếu không có / ô trống),
+        popularity shape (m, L) (0 ở ô trống), lengths shape (m,)
+        
+        Mỗi playlist là mảng index songs_data hoặc list bài hát (Song của catalog được tra index trực tiếp).
+        """
+        self._get_similarity_index()  # Đảm bảo _song_id_to_idx khớp với songs_data
+        popularity_column = self._get_popularity_column()
+        width = max((len(playlist) for playlist in playlists), default=0)
+        positions = np.full((len(playlists), width), -1, dtype=np.intp)
+        popularity = np.zeros((len(playlists), width))
+        lengths = np.fromiter((len(playlist) for playlist in playlists), dtype=np.intp, count=len(playlists))
+        
+        for row, playlist in enumerate(playlists):
+            if len(playlist) == 0:
+                continue
+            if isinstance(playlist, np.ndarray) or isinstance(playlist[0], (int, np.integer)):
+                indices = np.asarray(playlist, dtype=np.intp)
+                positions[row, :len(indices)] = indices
+                popularity[row, :len(indices)] = popularity_column[indices]
+                continue
             
-            # Score tổng hợp (điều chỉnh để có điểm số hợp lý)
-            score = (abs(avg_similarity) * 0.4 + diversity * 0.3 + popularity / 100 * 0.3) * 10
-            return max(0, min(10, score))  # Clamp giữa 0-10
-        
-        # Fallback: dựa trên popularity trung bình
-        popularity = np.mean([song.get('popularity', 50) for song in playlist])
-        return (popularity / 100) * 7  # Tối đa 7 điểm
+            index_of = getattr(self.songs_data, 'index_of', None)
+            for col, song in enumerate(playlist):
+                idx = index_of(song) if index_of else -1
+                if idx < 0:
+                    idx = self._song_id_to_idx.get(song['id'], -1)
+                positions[row, col] = idx
+                # Bài không thuộc catalog: lấy popularity từ chính bài đó
+                popularity[row, col] = popularity_column[idx] if idx >= 0 else song.get('popularity', 50)
+        return positions, popularity, lengths
+    
+    def evaluate_playlist(self, playlist):
+        """Đánh giá chất lượng playlist (list bài hát hoặc mảng index songs_data)"""
+        with self.profiler.stage('evaluate'):
+            return float(self._score_playlists(*self._playlist_arrays([playlist]))[0])
+    
+    def evaluate_playlists(self, playlists):
+        """Điểm của nhiều playlist cùng lúc, mảng shape (m,) (playlist có thể dài ngắn khác nhau)"""
+        with self.profiler.stage('evaluate'):
+            return self._score_playlists(*self._playlist_arrays(playlists))
+    
+    def _score_playlists(self, positions, popularity, lengths):
+        avg_popularity = popularity.sum(axis=1) / np.maximum(lengths, 1)
+        
+        # Độ tương đồng trung bình (chỉ các cặp liên tiếp đều có embedding)
+        index = self._get_similarity_index()
+        safe_positions = np.maximum(positions, 0)
+        has_embedding = (positions >= 0) & index.valid[safe_positions]
+        pair_mask = has_embedding[:, :-1] & has_embedding[:, 1:]
+        similarities = index.consecutive(safe_positions)  # (m, L - 1)
+        pair_counts = pair_mask.sum(axis=1)
+        avg_similarity = (similarities * pair_mask).sum(axis=1) / np.maximum(pair_counts, 1)
+        
+        diversity = 1 - np.abs(avg_similarity)  # Sử dụng abs để tránh giá trị âm
+        # Score tổng hợp (điều chỉnh để có điểm số hợp lý), clamp giữa 0-10
+        scores = np.clip((np.abs(avg_similarity) * 0.4 + diversity * 0.3 + avg_popularity / 100 * 0.3) * 10, 0, 10)
+        # Fallback khi không có cặp nào có embedding: dựa trên popularity trung bình (tối đa 7 điểm)
+        scores = np.where(pair_counts > 0, scores, avg_popularity / 100 * 7)
+        # Chỉ có 1 bài hát: dựa trên popularity, tối đa 5 điểm
+        scores = np.where(lengths == 1, avg_popularity / 100 * 5, scores)
+        return np.where(lengths == 0, 0.0, scores)
 
 def main():
     """Hàm main để test"""
@@ -0,0 +1,68 @@
+import os
+import threading
+
+class FileWatcher:
+    """Theo dõi mtime/size của các file bằng thread nền, gọi callback khi có file thay đổi.
+
+    Callback chỉ được gọi khi chữ ký file đã ổn định qua 2 lần kiểm tra liên tiếp,
+    để không load phải file đang được ghi dở. Callback trả về True nếu đã load xong; nếu trả về
+    False (hoặc lỗi) thay đổi vẫn được coi là chưa load và sẽ được thử lại ở các lần kiểm tra sau.
+    """
+
+    def __init__(self, paths, callback, interval=30):
+        self.paths = list(paths)
+        self.callback = callback
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._loaded = self.signature()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def signature(self):
+        """{path: (mtime_ns, size)} hoặc None nếu file không tồn tại"""
+        result = {}
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                result[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                result[path] = None
+        return result
+
+    def sync(self):
+        """Đánh dấu trạng thái file hiện tại là đã load (gọi sau mỗi lần reload thành công)"""
+        with self._lock:
+            self._loaded = self.signature()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            current = self.signature()
+            with self._lock:
+                changed = current != self._loaded
+            if not changed:
+                pending = None
+            elif current == pending:
+                # Không đổi thêm trong 1 chu kỳ: coi như đã ghi xong
+                pending = None
+                changed_paths = [path for path in self.paths if current[path] != self._loaded.get(path)]
+                try:
+                    loaded = self.callback(changed_paths)
+                except Exception:
+                    loaded = False
+                if loaded:
+                    with self._lock:
+                        self._loaded = current
+            else:
+                pending = current
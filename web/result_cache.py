@@ -0,0 +1,91 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from instrumentation import METRICS
+
+def _normalize_value(value):
+    """Chuẩn hóa 1 giá trị constraint để các request tương đương có cùng key"""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, (list, tuple, set)):
+        # Genre là tập hợp: thứ tự và phần tử trùng không ảnh hưởng kết quả
+        return sorted({str(item) for item in value})
+    return value
+
+def normalize_constraints(constraints):
+    """Bỏ constraint rỗng, sắp xếp danh sách và đưa số về float"""
+    normalized = {}
+    for key, value in (constraints or {}).items():
+        if value is None or (isinstance(value, (list, tuple, set)) and len(value) == 0):
+            continue
+        normalized[str(key)] = _normalize_value(value)
+    return normalized
+
+def make_playlist_key(seed_song, length, constraints, random_seed, version):
+    """Hash của request tạo playlist đã chuẩn hóa (kèm version của generator/model đang phục vụ)"""
+    payload = json.dumps(
+        [seed_song or None, int(length), normalize_constraints(constraints), int(random_seed), version],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """Cache kết quả trong bộ nhớ với TTL và giới hạn kích thước theo LRU"""
+
+    def __init__(self, max_entries=1000, ttl=None, name='result'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (created_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Lấy giá trị, trả về None nếu không có hoặc đã hết hạn"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and now - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                result = 'miss'
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                result = 'hit'
+
+        METRICS.inc('cache_requests_total', help_text="Số lần tra cứu cache theo kết quả (hit/miss)",
+                    cache=self.name, result=result)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value):
+        """Lưu giá trị, loại bỏ entry ít dùng nhất nếu vượt max_entries"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
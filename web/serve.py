@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Chạy web app ở chế độ production bằng gunicorn (pre-fork, nhiều worker)
+
+Process master load catalog + embeddings 1 lần rồi mới fork worker, nên các worker dùng chung
+phần dữ liệu đó theo copy-on-write thay vì mỗi worker giữ 1 bản. Mỗi worker tự load DQN
+(TensorFlow không an toàn khi fork sau khi đã tạo model) và chạy 1 request warm-up trước khi
+nhận traffic.
+
+    python serve.py
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+
+Job thu thập dữ liệu / training chạy trong worker đã nhận request; trạng thái và log của job được
+chia sẻ qua Config.SERVE_JOB_STATE_FILE nên /api/job, /api/status, /api/stream giống nhau ở mọi worker,
+cả server chỉ chạy 1 job và worker nào cũng hủy được. Các worker khác nhận model / dữ liệu mới qua
+file watcher (Config.SERVE_RELOAD_WATCH_INTERVAL). Mỗi kết nối /api/stream giữ 1 thread nên mỗi worker
+nhận tối đa Config.SSE_MAX_CONNECTIONS kết nối stream (nên nhỏ hơn --threads).
+"""
+
+import argparse
+import gc
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'web'))
+
+from gunicorn.app.base import BaseApplication
+from config import Config
+
+class PlaylistServer(BaseApplication):
+    """Gunicorn application: preload dữ liệu ở master, load model + warm-up ở từng worker"""
+
+    def __init__(self, options, reload_interval=0):
+        self.options = options
+        self.reload_interval = reload_interval
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('post_worker_init', self.post_worker_init)
+
+    def load(self):
+        # Với preload_app, hàm này chạy 1 lần trong master trước khi fork
+        import app as web_app
+        os.makedirs('models', exist_ok=True)
+        print("Khởi tạo dữ liệu trong process master...", flush=True)
+        web_app.preload_catalog()
+        # Đưa toàn bộ object đã load vào generation cố định: GC trong worker không ghi vào các
+        # trang bộ nhớ đó nữa, nên dữ liệu không bị copy dần sang từng worker
+        gc.freeze()
+        return web_app.app
+
+    def post_worker_init(self, worker):
+        """Chạy trong từng worker sau khi fork, trước khi worker bắt đầu nhận request"""
+        import app as web_app
+        if web_app.load_serving_model():
+            print(f"[worker {worker.pid}] ✅ Đã load model", flush=True)
+            web_app.warm_up()
+        else:
+            print(f"[worker {worker.pid}] ⚠️ Chưa có model, cần training trước", flush=True)
+        web_app.start_reload_watcher(interval=self.reload_interval)
+        web_app.jobs.share(Config.SERVE_JOB_STATE_FILE)
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy web app bằng gunicorn (production)")
+    parser.add_argument('--bind', default=Config.SERVE_BIND)
+    parser.add_argument('--workers', type=int, default=Config.SERVE_WORKERS)
+    parser.add_argument('--threads', type=int, default=Config.SERVE_THREADS)
+    parser.add_argument('--timeout', type=int, default=Config.SERVE_TIMEOUT)
+    parser.add_argument('--reload-interval', type=int, default=Config.SERVE_RELOAD_WATCH_INTERVAL,
+                        help="Giây giữa 2 lần kiểm tra file dữ liệu/model trong mỗi worker (0 = tắt)")
+    args = parser.parse_args()
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'preload_app': True,
+    }
+    PlaylistServer(options, reload_interval=args.reload_interval).run()
+
+if __name__ == '__main__':
+    main()